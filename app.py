@@ -1,31 +1,169 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, make_response, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, make_response, jsonify, Response, stream_template, stream_with_context, abort
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.exc import IntegrityError
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_migrate import Migrate
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
+import click
 from datetime import datetime, timedelta
 import os
+import atexit
+import csv
 import json
+import threading
+import time
+import zipfile
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
-from io import BytesIO
+from io import BytesIO, StringIO
 from dataclasses import dataclass
 from decimal import Decimal, ROUND_HALF_UP
+from events import EventHub, SQLiteBroker, format_sse
+from kitchen import KitchenQueue, OPEN_STATUSES
+from search import MenuSearch
+from catalog import CategoryFacets
+from profiler import SQLProfiler
+from metrics import Metrics
+from tracing import FlaskTracing
+from identity import IdentityCache, UserIdentity
+from passwords import HashingOverloaded, LoginThrottle, PasswordHasher
+from ratelimit import RateLimiter
+from cartstore import CartStore, MemoryBackend, SQLiteKVBackend
+from retention import purge_in_batches, reclaim_space
+from archive import archive_table, attach_database, copy_rows, delete_rows
+import menu_io
+from tenancy import DEFAULT_TENANT, TenantLocal, TenantSession, Tenants
+from replica import ReadReplicas, ReplicaSessionMixin
+import heapq
+from functools import partial
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///restaurant.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///restaurant.db')
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['EVENT_BROKER_PATH'] = os.getenv('EVENT_BROKER_PATH', os.path.join(app.instance_path, 'events.db'))
+app.config['EVENT_STREAM_HEARTBEAT'] = 15  # seconds between SSE keep-alive comments
+app.config['SQL_PROFILER_ENABLED'] = os.getenv('SQL_PROFILER', '0') == '1'
+app.config['SQL_SLOW_QUERY_MS'] = float(os.getenv('SQL_SLOW_QUERY_MS', '100'))
+app.config['USER_CACHE_TTL'] = float(os.getenv('USER_CACHE_TTL', '60'))  # seconds a cached login identity is trusted
+app.config['USER_CACHE_SIZE'] = 10000
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')  # older hashes are upgraded on login
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.getenv('PASSWORD_HASH_QUEUE', '16'))  # waiting hashes before logins get a 503
+app.config['LOGIN_RATE_LIMIT'] = int(os.getenv('LOGIN_RATE_LIMIT', '10'))  # failed attempts per IP per window
+app.config['LOGIN_RATE_WINDOW'] = 60  # seconds
+app.config['TRUSTED_PROXIES'] = int(os.getenv('TRUSTED_PROXIES', '0'))  # proxies in front of the app (e.g. nginx); 0 uses the socket address
+app.config['RATE_LIMIT_ENABLED'] = os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+app.config['RATE_LIMIT_STORAGE'] = os.getenv('RATE_LIMIT_STORAGE')  # SQLite file shared by all workers, e.g. instance/ratelimit.db
+app.config['WRITE_CONCURRENCY_LIMIT'] = int(os.getenv('WRITE_CONCURRENCY_LIMIT', '8'))  # concurrent cart/payment writes per process
+app.config['CART_STORE'] = os.getenv('CART_STORE', 'sqlite')  # 'sqlite' (shared by workers) or 'memory' (one process)
+app.config['CART_STORE_PATH'] = os.getenv('CART_STORE_PATH')  # default: instance/carts.db or instance/carts.jsonl
+app.config['CART_FLUSH_INTERVAL'] = float(os.getenv('CART_FLUSH_INTERVAL', '5'))  # seconds; 0 writes carts only at checkout
+app.config['CART_RETENTION_DAYS'] = float(os.getenv('CART_RETENTION_DAYS', '30'))  # carts idle this long are purged; 0 keeps them
+app.config['CART_RETENTION_BATCH'] = 500  # carts per delete transaction
+app.config['CART_ARCHIVE_PATH'] = os.getenv('CART_ARCHIVE_PATH')  # JSON lines file to archive purged carts to (optional)
+app.config['VACUUM_MAX_PAGES'] = int(os.getenv('VACUUM_MAX_PAGES', '0'))  # free pages returned per run; 0 = all
+app.config['ORDER_ARCHIVE_DAYS'] = float(os.getenv('ORDER_ARCHIVE_DAYS', '90'))  # completed orders older than this move to the archive; 0 keeps them
+app.config['ORDER_ARCHIVE_PATH'] = os.getenv('ORDER_ARCHIVE_PATH')  # default: <database>-archive.db next to the database
+app.config['ORDER_ARCHIVE_BATCH'] = 500  # orders per move
+app.config['MENU_IMPORT_IMAGE_WORKERS'] = int(os.getenv('MENU_IMPORT_IMAGE_WORKERS', '4'))  # threads resizing imported images
+app.config['TENANTS'] = os.getenv('TENANTS', '')  # other outlets, e.g. "downtown,airport"; each gets its own database
+app.config['TENANT_DATABASE_URI'] = os.getenv('TENANT_DATABASE_URI', 'sqlite:///' + os.path.join(app.instance_path, 'tenants', '{tenant}.db'))
+app.config['TENANT_HOSTS'] = dict(pair.split('=', 1) for pair in os.getenv('TENANT_HOSTS', '').split(',') if '=' in pair)  # host=tenant,...
+app.config['TENANT_BASE_DOMAIN'] = os.getenv('TENANT_BASE_DOMAIN')  # <tenant>.<domain> selects the tenant
+app.config['TENANT_REPORT_WORKERS'] = int(os.getenv('TENANT_REPORT_WORKERS', '4'))  # shards read at once by tenant-report
+app.config['READ_REPLICA'] = os.getenv('READ_REPLICA')  # 'snapshot' (a copy of the SQLite database) or a replica URI; unset reads the primary
+app.config['READ_REPLICA_MAX_STALENESS'] = float(os.getenv('READ_REPLICA_MAX_STALENESS', '10'))  # seconds; older replicas aren't read
+app.config['READ_REPLICA_REFRESH_INTERVAL'] = float(os.getenv('READ_REPLICA_REFRESH_INTERVAL', '5'))  # seconds between snapshots
+app.config['TRACING_ENABLED'] = os.getenv('TRACING', '0') == '1'
+app.config['TRACING_SAMPLE_RATE'] = float(os.getenv('TRACING_SAMPLE_RATE', '0.1'))
+app.config['TRACING_OTLP_ENDPOINT'] = os.getenv('TRACING_OTLP_ENDPOINT')  # e.g. http://localhost:4318/v1/traces
 
-db = SQLAlchemy(app)
+if app.config['TRUSTED_PROXIES']:
+    # Take the client address from X-Forwarded-For so login throttling and rate limits see clients, not the proxy
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+
+order_archive_paths = {}
+
+def configure_engine(tenant, engine):
+    # Archived orders live in a second SQLite file attached to every connection (see archive.py)
+    if engine.dialect.name != 'sqlite':
+        return
+    path = app.config['ORDER_ARCHIVE_PATH'] if tenant == DEFAULT_TENANT else None
+    if not path:
+        os.makedirs(app.instance_path, exist_ok=True)
+        path = os.path.splitext(engine.url.database)[0] + '-archive.db'
+    if tenant == DEFAULT_TENANT:
+        app.config['ORDER_ARCHIVE_PATH'] = path
+    attach_database(engine, path)
+    order_archive_paths[tenant] = path
+
+# Every outlet has its own database; the session follows the tenant of the request (see tenancy.py)
+tenants = Tenants(on_engine=configure_engine)
+# Read-only views read from a replica of that database when one is configured (see replica.py)
+replicas = ReadReplicas(app, primary=tenants.engine, current=tenants.current,
+                        on_route=lambda target: read_replica_queries_total.inc(target=target))
+
+class AppSession(ReplicaSessionMixin, TenantSession):
+    pass
+
+db = SQLAlchemy(app, session_options={'class_': AppSession, 'tenants': tenants, 'replicas': replicas})
+tenants.init_app(app, db)
+with app.app_context():
+    tenants.engine(DEFAULT_TENANT)  # configure it before anything connects
 migrate = Migrate(app, db)
+sql_profiler = SQLProfiler(app)
+metrics = Metrics(app)
+tracing = FlaskTracing(app)
+rate_limited_total = metrics.counter('rate_limited_total', 'Requests rejected by rate limits or the write concurrency cap.',
+                                     ('endpoint', 'reason'))
+# Buckets are per outlet: user ids and client IPs of different outlets must not drain each other's buckets
+rate_limiter = RateLimiter(app, on_reject=lambda endpoint, reason: rate_limited_total.inc(endpoint=endpoint, reason=reason),
+                           namespace=tenants.current)
+checkouts_total = metrics.counter('checkouts_total', 'Orders placed through checkout.', ('payment_method',))
+pdf_render_seconds = metrics.histogram('pdf_render_seconds', 'PDF generation time.', ('document',))
+login_rejected_total = metrics.counter('login_rejected_total', 'Login and signup attempts turned away.', ('reason',))
+retention_rows_deleted_total = metrics.counter('retention_rows_deleted_total', 'Rows removed by retention jobs.',
+                                              ('table',))
+read_replica_queries_total = metrics.counter('read_replica_queries_total',
+                                             'Queries from read-only views, by the database that served them.', ('target',))
+scheduler_job_seconds = metrics.histogram('scheduler_job_duration_seconds', 'Background job run time.', ('job',),
+                                          buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0))
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Live order feed shared by every worker process (see events.py)
+os.makedirs(os.path.dirname(app.config['EVENT_BROKER_PATH']), exist_ok=True)
+event_broker = SQLiteBroker(app.config['EVENT_BROKER_PATH'])
+
+def tenant_channel(channel, tenant):
+    return channel if tenant == DEFAULT_TENANT else f'{channel}:{tenant}'
+
+# Feeds, queues and caches below are kept per tenant (see tenancy.TenantLocal)
+order_events = TenantLocal(tenants, lambda tenant: EventHub(event_broker, channel=tenant_channel('orders', tenant)))
+kitchen_queue = TenantLocal(tenants, lambda tenant: KitchenQueue())
+menu_search = TenantLocal(tenants, lambda tenant: MenuSearch())  # FTS5 may be available in one shard and not another
+category_facets = TenantLocal(tenants, lambda tenant: CategoryFacets())
+# Menu changes made by one worker invalidate the catalog caches of the others
+catalog_events = TenantLocal(tenants, lambda tenant: EventHub(event_broker, channel=tenant_channel('catalog', tenant)))
+# ...and user changes invalidate their cached login identities
+identity_events = TenantLocal(tenants, lambda tenant: EventHub(event_broker, channel=tenant_channel('identity', tenant)))
+_kitchen_queue_lock = threading.Lock()
+# Password hashing runs on a small bounded pool so login bursts can't take every CPU
+password_hasher = PasswordHasher(method=app.config['PASSWORD_HASH_METHOD'],
+                                 max_workers=app.config['PASSWORD_HASH_WORKERS'],
+                                 max_queue=app.config['PASSWORD_HASH_QUEUE'])
+login_throttle = LoginThrottle(limit=app.config['LOGIN_RATE_LIMIT'], window=app.config['LOGIN_RATE_WINDOW'])
+metrics.registry.gauge('password_hash_pending', 'Password hashes running or waiting for a worker.',
+                       function=lambda: password_hasher.pending)
+
 @dataclass
 class OrderTotals:
     subtotal: float
@@ -99,16 +237,26 @@ def calculate_order_totals(items, gst_percentage, discount_percentage=0.0):
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+def upload_folder():
+    """(directory, path under static/) for uploaded images; outlets other than the default get a subfolder."""
+    tenant = tenants.current()
+    if tenant == DEFAULT_TENANT:
+        return app.config['UPLOAD_FOLDER'], 'uploads'
+    folder = os.path.join(app.config['UPLOAD_FOLDER'], tenant)
+    os.makedirs(folder, exist_ok=True)
+    return folder, f'uploads/{tenant}'
+
 # Models
 class Cart(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     items = db.relationship('CartItem', backref='cart', lazy=True, cascade='all, delete-orphan')
 
 class OrderItem(db.Model):
     __tablename__ = 'order_item'
+    __table_args__ = {'sqlite_autoincrement': True}  # ids of archived rows must never be handed out again
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
     menu_item_id = db.Column(db.Integer, db.ForeignKey('menu_item.id'), nullable=False)
@@ -121,9 +269,10 @@ class OrderItem(db.Model):
 
 class Order(db.Model):
     __tablename__ = 'order'
+    __table_args__ = {'sqlite_autoincrement': True}  # ids of archived orders must never be handed out again
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, paid, completed, cancelled
+    status = db.Column(db.String(20), default='pending', nullable=False, index=True)  # pending, paid, completed, cancelled
     payment_method = db.Column(db.String(20), nullable=True)  # upi, card, netbanking, cod
     cod_payment_method = db.Column(db.String(20), nullable=True)  # upi, cash (only used when payment_method is 'cod')
     payment_status = db.Column(db.String(20), default='pending')  # pending, completed, failed, refunded
@@ -134,10 +283,11 @@ class Order(db.Model):
     
     user = db.relationship('User', backref=db.backref('orders', lazy=True))
     items = db.relationship('OrderItem', backref='order', lazy=True, cascade='all, delete-orphan')
+    is_archived = False
 
 class CartItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    cart_id = db.Column(db.Integer, db.ForeignKey('cart.id'), nullable=False)
+    cart_id = db.Column(db.Integer, db.ForeignKey('cart.id'), nullable=False, index=True)
     menu_item_id = db.Column(db.Integer, db.ForeignKey('menu_item.id'), nullable=False)
     quantity = db.Column(db.Integer, default=1, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -154,6 +304,9 @@ class User(UserMixin, db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # New field for update time
     cart = db.relationship('Cart', backref='user', uselist=False, cascade='all, delete-orphan')
     
+    def get_id(self):
+        return tenants.user_id(self.id)
+    
     def get_or_create_cart(self):
         if not self.cart:
             self.cart = Cart(user_id=self.id)
@@ -177,7 +330,14 @@ class Settings(db.Model):
         return settings
 
 class MenuItem(db.Model):
+    __table_args__ = (
+        # Active/expired discount lookups filter on the discount window
+        db.Index('ix_menu_item_discount_window', 'discount_end', 'discount_start'),
+        # Bulk imports match rows to items by SKU
+        db.Index('ux_menu_item_sku', 'sku', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
+    sku = db.Column(db.String(64), nullable=True)  # stable external key for bulk import/export
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=True)
     price = db.Column(db.Float, nullable=False)
@@ -185,7 +345,7 @@ class MenuItem(db.Model):
     discount_percentage = db.Column(db.Float, default=0.0)
     discount_start = db.Column(db.DateTime, nullable=True)
     discount_end = db.Column(db.DateTime, nullable=True)
-    category = db.Column(db.String(50), nullable=True)
+    category = db.Column(db.String(50), nullable=True, index=True)
     image_path = db.Column(db.String(200))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -201,19 +361,38 @@ class MenuItem(db.Model):
             self.original_price = self.price
     
     @property
+    def external_key(self):
+        return self.sku or f'ITEM-{self.id}'
+    
+    @hybrid_property
     def has_active_discount(self):
         now = datetime.utcnow()
-        return (self.discount_percentage > 0 and 
-                self.discount_start and 
-                self.discount_end and
-                self.discount_start <= now <= self.discount_end)
+        return bool(self.discount_percentage and self.discount_percentage > 0 and 
+                    self.discount_start and 
+                    self.discount_end and
+                    self.discount_start <= now <= self.discount_end)
     
-    @property
+    @has_active_discount.expression
+    def has_active_discount(cls):
+        # "now" is bound when the query is built, so this works on any database
+        now = datetime.utcnow()
+        return db.and_(cls.discount_percentage > 0,
+                       cls.discount_start <= now,
+                       cls.discount_end >= now)
+    
+    @hybrid_property
     def current_price(self):
         if self.has_active_discount:
             return self.original_price * (1 - (self.discount_percentage / 100))
         return self.original_price
     
+    @current_price.expression
+    def current_price(cls):
+        return db.case(
+            (cls.has_active_discount, cls.original_price * (1 - cls.discount_percentage / 100)),
+            else_=cls.original_price
+        )
+    
     def apply_discount(self, percentage, days):
         # Only update original_price if there's no active discount
         if not self.has_active_discount:
@@ -223,7 +402,6 @@ class MenuItem(db.Model):
         self.discount_end = self.discount_start + timedelta(days=days)
         # Update the current price based on the discount
         self.price = self.original_price * (1 - (percentage / 100))
-        db.session.commit()
     
     def remove_discount(self):
         if self.original_price:
@@ -231,16 +409,303 @@ class MenuItem(db.Model):
         self.discount_percentage = 0.0
         self.discount_start = None
         self.discount_end = None
-        db.session.commit()
-        self.discount_start = None
-        self.discount_end = None  # Flat discount amount
 
     def __repr__(self):
         return f'<MenuItem {self.name}>'
 
+class DiscountCampaign(db.Model):
+    __tablename__ = 'discount_campaign'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    scope = db.Column(db.String(20), nullable=False)  # category, items, all
+    category = db.Column(db.String(50), nullable=True)  # only used when scope is 'category'
+    item_ids = db.Column(db.Text, nullable=True)  # JSON list, only used when scope is 'items'
+    discount_percentage = db.Column(db.Float, nullable=False)
+    starts_at = db.Column(db.DateTime, nullable=False)
+    ends_at = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), default='scheduled', nullable=False, index=True)  # scheduled, active, ended, cancelled
+    items_affected = db.Column(db.Integer, default=0)
+    items_reverted = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    applied_at = db.Column(db.DateTime, nullable=True)
+    reverted_at = db.Column(db.DateTime, nullable=True)
+    
+    def _scope_filter(self):
+        if self.scope == 'category':
+            return MenuItem.category == self.category
+        if self.scope == 'items':
+            return MenuItem.id.in_(json.loads(self.item_ids or '[]'))
+        return db.true()
+    
+    def apply(self):
+        """Discount every targeted item with one UPDATE. The caller commits."""
+        now = datetime.utcnow()
+        # Same rule as MenuItem.apply_discount(): keep original_price if a discount is already running
+        base_price = db.case((MenuItem.has_active_discount, MenuItem.original_price), else_=MenuItem.price)
+        result = db.session.execute(
+            db.update(MenuItem)
+            .where(self._scope_filter())
+            .values(
+                original_price=base_price,
+                price=base_price * (1 - self.discount_percentage / 100),
+                discount_percentage=self.discount_percentage,
+                discount_start=self.starts_at,
+                discount_end=self.ends_at
+            )
+            .execution_options(synchronize_session=False)
+        )
+        self.items_affected = result.rowcount
+        self.applied_at = now
+    
+    def revert(self):
+        """Restore prices with one UPDATE, skipping items whose discount was replaced since. The caller commits."""
+        result = db.session.execute(
+            db.update(MenuItem)
+            .where(
+                self._scope_filter(),
+                MenuItem.discount_percentage == self.discount_percentage,
+                MenuItem.discount_start == self.starts_at,
+                MenuItem.discount_end == self.ends_at
+            )
+            .values(
+                price=MenuItem.original_price,
+                discount_percentage=0.0,
+                discount_start=None,
+                discount_end=None
+            )
+            .execution_options(synchronize_session=False)
+        )
+        self.items_reverted = result.rowcount
+        self.reverted_at = datetime.utcnow()
+    
+    def _claim(self, from_status, to_status):
+        # Conditional status change so that only one worker process acts on a campaign
+        result = db.session.execute(
+            db.update(DiscountCampaign)
+            .where(DiscountCampaign.id == self.id, DiscountCampaign.status == from_status)
+            .values(status=to_status)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            self.status = to_status
+        return bool(result.rowcount)
+    
+    def start(self):
+        if self._claim('scheduled', 'active'):
+            self.apply()
+            return True
+        return False
+    
+    def finish(self, status='ended'):
+        if self._claim('active', status):
+            self.revert()
+            return True
+        return self._claim('scheduled', status)
+
+class ArchivedOrderItem(db.Model):
+    __table__ = archive_table(OrderItem.__table__, db.metadata, archived=('order',))
+    menu_item = db.relationship('MenuItem')
+
+class ArchivedOrder(db.Model):
+    """A completed order moved out of the hot tables by archive_orders(); read-only."""
+    __table__ = archive_table(Order.__table__, db.metadata)
+    user = db.relationship('User')
+    items = db.relationship('ArchivedOrderItem', backref='order', lazy=True)
+    is_archived = True
+
+ARCHIVE_STATUSES = ('completed',)
+
+def find_order(order_id, **filters):
+    """An order by id from the hot tables, or from the archive once it has been moved there."""
+    return (Order.query.filter_by(id=order_id, **filters).first()
+            or ArchivedOrder.query.filter_by(id=order_id, **filters).first())
+
+def newest_first(*order_lists, key='created_at'):
+    """Merge order iterables that are each sorted newest first by `key` (hot and archived orders)."""
+    return heapq.merge(*order_lists, key=lambda order: getattr(order, key) or datetime.min, reverse=True)
+
+def order_event_payload(order):
+    """Serialize an order for the live order feed."""
+    return {
+        'id': order.id,
+        'status': order.status,
+        'payment_method': order.payment_method,
+        'total_amount': order.total_amount,
+        'username': order.user.username if order.user else None,
+        'email': order.user.email if order.user else None,
+        'created_at': order.created_at.isoformat() if order.created_at else None,
+        'items': [{
+            'menu_item_id': item.menu_item_id,
+            'name': item.menu_item_name,
+            'quantity': item.quantity,
+            'price': item.price
+        } for item in order.items]
+    }
+
+def publish_order_event(event_type, order):
+    # The order is already committed at this point; a broken feed must never fail the request
+    try:
+        order_events.publish(event_type, order_event_payload(order))
+    except Exception as e:
+        app.logger.error(f"Error publishing {event_type} event for order {order.id}: {str(e)}")
+
+def get_kitchen_queue():
+    """Return the kitchen index, loading open orders once and then following order events."""
+    if not kitchen_queue.loaded:
+        with _kitchen_queue_lock:
+            if not kitchen_queue.loaded:
+                # Start following the feed before reading the table so nothing committed
+                # in between is missed; events already in the snapshot are skipped by id
+                order_events.add_listener(kitchen_queue.apply)
+                as_of = order_events.broker.last_id(order_events.channel)
+                open_orders = Order.query.options(
+                    db.joinedload(Order.user),
+                    db.selectinload(Order.items)
+                ).filter(Order.status.in_(OPEN_STATUSES)).order_by(Order.created_at).all()
+                kitchen_queue.load([order_event_payload(order) for order in open_orders], as_of)
+    return kitchen_queue
+
+def bump_catalog():
+    """Invalidate cached menu data here and in every other worker process."""
+    category_facets.invalidate()
+    try:
+        catalog_events.publish('catalog_changed', {'pid': os.getpid()})
+    except Exception as e:
+        app.logger.error(f"Error publishing catalog change: {str(e)}")
+
+def _on_catalog_event(tenant, event):
+    if event.data.get('pid') != os.getpid():
+        category_facets.for_tenant(tenant).invalidate()
+
+_catalog_listening = set()
+
+def get_category_facets():
+    tenant = tenants.current()
+    if tenant not in _catalog_listening:
+        _catalog_listening.add(tenant)
+        catalog_events.add_listener(partial(_on_catalog_event, tenant))
+    with replicas.reads(False):  # a cache filled from a stale replica would stay stale after the invalidation
+        return category_facets.get(db.session, MenuItem)
+
+def load_identity(user_id):
+    """Read the cached login identity (the user fields it carries) with one query."""
+    with replicas.reads(False):  # cached, so it must not come from a stale replica
+        row = db.session.query(User.id, User.username, User.email, User.is_admin).filter(User.id == user_id).first()
+    if row is None:
+        return None
+    return UserIdentity(*row, load_user=lambda user_id: db.session.get(User, user_id))
+
+user_identities = TenantLocal(tenants, lambda tenant: IdentityCache(load_identity, maxsize=app.config['USER_CACHE_SIZE'],
+                                                                   ttl=app.config['USER_CACHE_TTL']))
+
+def _identity_changed(target, user_id):
+    # Invalidate after commit, so no other request can re-cache the old row in between
+    session = object_session(target)
+    if session is not None and user_id is not None:
+        session.info.setdefault('changed_identities', set()).add(user_id)
+
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def _on_user_changed(mapper, connection, target):
+    _identity_changed(target, target.id)
+
+@db.event.listens_for(Session, 'after_commit')
+def _invalidate_identities(session):
+    for user_id in session.info.pop('changed_identities', ()):
+        user_identities.invalidate(user_id)
+        try:
+            identity_events.publish('user_changed', {'pid': os.getpid(), 'user_id': user_id})
+        except Exception as e:
+            app.logger.error(f"Error publishing user change: {str(e)}")
+
+@db.event.listens_for(Session, 'after_rollback')
+def _discard_identity_changes(session):
+    session.info.pop('changed_identities', None)
+
+def _on_identity_event(tenant, event):
+    if event.data.get('pid') != os.getpid():
+        user_identities.for_tenant(tenant).invalidate(event.data['user_id'])
+
+_identity_listening = set()
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    tenant, user_id = tenants.parse_user_id(user_id)
+    if tenant != tenants.current():  # logged in at another outlet
+        return None
+    if tenant not in _identity_listening:
+        _identity_listening.add(tenant)
+        identity_events.add_listener(partial(_on_identity_event, tenant))
+    return user_identities.get(user_id)
+
+def load_cart_lines(user_id):
+    """A user's cart from the cart_item table, as {menu_item_id: quantity}."""
+    lines = {}
+    for menu_item_id, quantity in db.session.query(CartItem.menu_item_id, CartItem.quantity).join(Cart).filter(
+            Cart.user_id == user_id).order_by(CartItem.id):
+        lines[menu_item_id] = lines.get(menu_item_id, 0) + quantity
+    return lines
+
+def save_carts(carts):
+    """Replace the cart_item rows of each {user_id: lines} cart in one transaction."""
+    def find_carts(user_ids):
+        return dict(db.session.query(Cart.user_id, db.func.min(Cart.id)).filter(
+            Cart.user_id.in_(user_ids)).group_by(Cart.user_id).all())
+
+    cart_ids = find_carts(list(carts))
+    missing = [user_id for user_id, lines in carts.items() if lines and user_id not in cart_ids]
+    if missing:
+        # Insert-if-absent in one statement, so workers flushing at the same time can't both create a cart
+        now = datetime.utcnow()
+        for user_id in missing:
+            db.session.execute(db.insert(Cart).from_select(
+                ['user_id', 'created_at', 'updated_at'],
+                db.select(db.literal(user_id), db.literal(now), db.literal(now)).where(
+                    ~db.exists().where(Cart.user_id == user_id))
+            ))
+        cart_ids.update(find_carts(missing))
+    # Items removed from the menu since they were added are dropped
+    menu_item_ids = {menu_item_id for lines in carts.values() for menu_item_id in lines}
+    on_menu = {row[0] for row in db.session.query(MenuItem.id).filter(MenuItem.id.in_(list(menu_item_ids)))}
+    CartItem.query.filter(CartItem.cart_id.in_(list(cart_ids.values()))).delete(synchronize_session=False)
+    rows = [{'cart_id': cart_ids[user_id], 'menu_item_id': menu_item_id, 'quantity': quantity}
+            for user_id, lines in carts.items() for menu_item_id, quantity in lines.items()
+            if menu_item_id in on_menu]
+    if rows:
+        db.session.execute(db.insert(CartItem), rows)
+    db.session.commit()
+
+# Cart clicks go to the cart store; the cart tables are written in the background (see cartstore.py)
+os.makedirs(app.instance_path, exist_ok=True)
+
+def make_cart_store(tenant):
+    if app.config['CART_STORE'] == 'memory':
+        path = app.config['CART_STORE_PATH'] or os.path.join(app.instance_path, 'carts.jsonl')
+    else:
+        path = app.config['CART_STORE_PATH'] or os.path.join(app.instance_path, 'carts.db')
+    if tenant != DEFAULT_TENANT:
+        path = f'{os.path.splitext(path)[0]}-{tenant}{os.path.splitext(path)[1]}'
+    backend = MemoryBackend(path) if app.config['CART_STORE'] == 'memory' else SQLiteKVBackend(path)
+    return CartStore(backend, load_cart_lines, save_carts)
+
+cart_store = TenantLocal(tenants, make_cart_store)
+
+@dataclass
+class CartLine:
+    menu_item: 'MenuItem'
+    quantity: int
+
+    @property
+    def menu_item_id(self):
+        return self.menu_item.id
+
+def cart_lines(lines):
+    """CartLines with their menu items for {menu_item_id: quantity}, in cart order."""
+    if not lines:
+        return []
+    menu_items = {item.id: item for item in MenuItem.query.filter(MenuItem.id.in_(list(lines)))}
+    return [CartLine(menu_items[menu_item_id], quantity) for menu_item_id, quantity in lines.items()
+            if menu_item_id in menu_items]
 
 # API Routes
 @app.route('/api/settings', methods=['GET'])
@@ -254,19 +719,19 @@ def get_settings():
 @app.route('/api/cart', methods=['GET'])
 @login_required
 def get_cart():
-    cart = current_user.get_or_create_cart()
     cart_items = [{
         'id': item.menu_item.id,
         'name': item.menu_item.name,
         'price': float(item.menu_item.price),
         'quantity': item.quantity,
         'image_path': item.menu_item.image_path
-    } for item in cart.items]
+    } for item in cart_lines(cart_store.get(current_user.id))]
     
     return jsonify(cart_items)
 
 @app.route('/api/cart/add', methods=['POST'])
 @login_required
+@rate_limiter.limit(user='60/minute', ip='300/minute', write=True)
 def add_to_cart():
     try:
         data = request.get_json()
@@ -280,28 +745,12 @@ def add_to_cart():
         if not menu_item:
             return jsonify({'error': 'Item not found'}), 404
         
-        cart = current_user.get_or_create_cart()
-        
-        # Check if item already in cart
-        cart_item = CartItem.query.filter_by(cart_id=cart.id, menu_item_id=item_id).first()
-        
-        if cart_item:
-            # Update quantity if item already in cart
-            cart_item.quantity += quantity
-        else:
-            # Add new item to cart
-            cart_item = CartItem(
-                cart_id=cart.id,
-                menu_item_id=item_id,
-                quantity=quantity
-            )
-            db.session.add(cart_item)
-        
-        db.session.commit()
+        # Adds to the quantity if the item is already in the cart
+        lines = cart_store.add(current_user.id, menu_item.id, quantity)
         
         return jsonify({
             'message': 'Item added to cart',
-            'cart_count': sum(item.quantity for item in cart.items)
+            'cart_count': sum(lines.values())
         })
         
     except Exception as e:
@@ -310,6 +759,7 @@ def add_to_cart():
 
 @app.route('/api/cart/update', methods=['POST'])
 @login_required
+@rate_limiter.limit(user='60/minute', ip='300/minute', write=True)
 def update_cart():
     try:
         data = request.get_json()
@@ -319,23 +769,15 @@ def update_cart():
         if not item_id:
             return jsonify({'error': 'Menu item ID is required'}), 400
             
-        cart = current_user.get_or_create_cart()
-        cart_item = CartItem.query.filter_by(cart_id=cart.id, menu_item_id=item_id).first()
-        
-        if not cart_item:
+        item_id = int(item_id)
+        if item_id not in cart_store.get(current_user.id):
             return jsonify({'error': 'Item not found in cart'}), 404
             
-        if quantity <= 0:
-            # Remove item if quantity is 0 or less
-            db.session.delete(cart_item)
-        else:
-            # Update quantity
-            cart_item.quantity = quantity
-            
-        db.session.commit()
+        # Removes the item if quantity is 0 or less
+        lines = cart_store.set(current_user.id, item_id, quantity)
         
         # Calculate cart totals
-        cart_items = CartItem.query.filter_by(cart_id=cart.id).all()
+        cart_items = cart_lines(lines)
         subtotal = sum(item.menu_item.price * item.quantity for item in cart_items)
         
         return jsonify({
@@ -374,6 +816,7 @@ def update_settings():
 
 @app.route('/api/process-payment', methods=['POST'])
 @login_required
+@rate_limiter.limit(user='10/minute', ip='60/minute', write=True)
 def process_payment():
     try:
         data = request.get_json()
@@ -385,22 +828,6 @@ def process_payment():
         if payment_method not in valid_methods:
             return jsonify({'success': False, 'message': 'Invalid payment method'}), 400
         
-        # Get user's cart
-        cart = current_user.get_or_create_cart()
-        cart_items = CartItem.query.filter_by(cart_id=cart.id).all()
-        
-        if not cart_items:
-            return jsonify({'success': False, 'message': 'Your cart is empty'}), 400
-        
-        # Calculate order totals using the utility function
-        settings = Settings.get_settings()
-        totals = calculate_order_totals(
-            items=[{"price": item.menu_item.price, "quantity": item.quantity} for item in cart_items],
-            gst_percentage=settings.gst_percentage,
-            discount_percentage=settings.discount_percentage
-        )
-        total_amount = totals.total
-        
         # Validate payment details based on method
         if payment_method == 'upi' and not payment_details.get('upi_id'):
             return jsonify({'success': False, 'message': 'Please enter UPI ID'}), 400
@@ -423,40 +850,64 @@ def process_payment():
         # Get the COD payment method if it exists
         cod_payment_method = payment_details.get('cod_payment_method') if payment_method == 'cod' else None
         
-        with db.session.no_autoflush:
-            # Create order
-            order = Order(
-                user_id=current_user.id,
-                status='paid' if payment_method != 'cod' else 'pending',
-                total_amount=total_amount,
-                payment_method=payment_method,
-                payment_status='completed' if payment_method != 'cod' else 'pending',
-                cod_payment_method=cod_payment_method if payment_method == 'cod' else None
+        # Take the user's cart out of the cart store; it is put back if the order isn't saved
+        taken = cart_store.take(current_user.id)
+        cart_items = cart_lines(taken)
+        
+        if not cart_items:
+            return jsonify({'success': False, 'message': 'Your cart is empty'}), 400
+        
+        try:
+            # Calculate order totals using the utility function
+            settings = Settings.get_settings()
+            totals = calculate_order_totals(
+                items=[{"price": item.menu_item.price, "quantity": item.quantity} for item in cart_items],
+                gst_percentage=settings.gst_percentage,
+                discount_percentage=settings.discount_percentage
             )
-            db.session.add(order)
-            db.session.flush()
             
-            # Add items to order
-            for item in cart_items:
-                order_item = OrderItem(
-                    order_id=order.id,
-                    menu_item_id=item.menu_item_id,
-                    menu_item_name=item.menu_item.name,
-                    quantity=item.quantity,
-                    price=item.menu_item.price
+            with db.session.no_autoflush:
+                # Create order
+                order = Order(
+                    user_id=current_user.id,
+                    status='paid' if payment_method != 'cod' else 'pending',
+                    total_amount=totals.total,
+                    payment_method=payment_method,
+                    payment_status='completed' if payment_method != 'cod' else 'pending',
+                    cod_payment_method=cod_payment_method if payment_method == 'cod' else None
                 )
-                order.items.append(order_item)
-            
-            # Clear the cart
-            CartItem.query.filter_by(cart_id=cart.id).delete()
-            db.session.commit()
-            
-            return jsonify({
-                'success': True,
-                'message': 'Payment successful' if payment_method != 'cod' else 'Order placed successfully. Payment will be collected on delivery.',
-                'order_id': order.id,
-                'is_cod': payment_method == 'cod'
-            })
+                db.session.add(order)
+                db.session.flush()
+                
+                # Add items to order
+                for item in cart_items:
+                    order_item = OrderItem(
+                        order_id=order.id,
+                        menu_item_id=item.menu_item_id,
+                        menu_item_name=item.menu_item.name,
+                        quantity=item.quantity,
+                        price=item.menu_item.price
+                    )
+                    order.items.append(order_item)
+                
+                # Clear any cart rows already written by the cart store
+                CartItem.query.filter(CartItem.cart_id.in_(
+                    db.session.query(Cart.id).filter(Cart.user_id == current_user.id)
+                )).delete(synchronize_session=False)
+                db.session.commit()
+        except Exception:
+            cart_store.restore(current_user.id, taken)
+            raise
+        
+        checkouts_total.inc(payment_method=payment_method)
+        publish_order_event('order_created', order)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Payment successful' if payment_method != 'cod' else 'Order placed successfully. Payment will be collected on delivery.',
+            'order_id': order.id,
+            'is_cod': payment_method == 'cod'
+        })
             
     except Exception as e:
         db.session.rollback()
@@ -469,7 +920,7 @@ def checkout():
         data = request.get_json()
         payment_method = data.get('payment_method', 'cod')
         
-        # This is kept for backward compatibility
+        # This is kept for backward compatibility (rate limits apply through process_payment)
         return process_payment()
         
     except Exception as e:
@@ -477,33 +928,152 @@ def checkout():
 
 @app.route('/api/cart/clear', methods=['POST'])
 @login_required
+@rate_limiter.limit(user='30/minute', ip='300/minute', write=True)
 def clear_cart():
     try:
         # Delete all items in the user's cart
-        CartItem.query.filter_by(cart_id=current_user.cart.id).delete()
-        db.session.commit()
+        cart_store.clear(current_user.id)
         return jsonify({'success': True, 'message': 'Cart cleared successfully'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/menu/search', methods=['GET'])
+@replicas.read_only
+def search_menu():
+    query = request.args.get('q', '').strip()
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 50)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    
+    if not query:
+        return jsonify({'query': query, 'results': []})
+    
+    hits = menu_search.search(db.session, MenuItem, query, limit=limit)
+    items = {item.id: item for item in MenuItem.query.filter(MenuItem.id.in_([hit['id'] for hit in hits]))}
+    results = []
+    for hit in hits:
+        item = items.get(hit['id'])
+        if not item:
+            continue
+        results.append({
+            'id': item.id,
+            'name': item.name,
+            'name_html': str(hit['name']),
+            'snippet_html': str(hit['snippet']),
+            'category': item.category,
+            'price': float(item.price),
+            'original_price': float(item.original_price),
+            'has_active_discount': bool(item.has_active_discount),
+            'image_path': item.image_path,
+            'url': url_for('item_details', item_id=item.id)
+        })
+    
+    return jsonify({'query': query, 'results': results})
+
+def iter_orders(query, batch_size=500):
+    """Iterate orders in batches with their user and items, without holding every row in memory."""
+    # selectinload loads the items once per batch; a joined collection load cannot be batched
+    model = query.column_descriptions[0]['entity']  # Order or ArchivedOrder
+    return query.options(db.joinedload(model.user), db.selectinload(model.items)).yield_per(batch_size)
+
+def buffered_stream(chunks, size=16384):
+    """Group the many small strings a streamed template yields into fewer, larger writes."""
+    buffer, length = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+def menu_items_query(category=None, on_sale=False, min_price=None, max_price=None, sort=None, direction='asc'):
+    """Build a menu query that filters and sorts on the effective price entirely in SQL."""
+    sort_columns = {
+        'price': MenuItem.current_price,
+        'name': MenuItem.name,
+        'newest': MenuItem.created_at
+    }
+    query = MenuItem.query
+    if category:
+        query = query.filter(MenuItem.category == category)
+    if on_sale:
+        query = query.filter(MenuItem.has_active_discount)
+    if min_price is not None:
+        query = query.filter(MenuItem.current_price >= min_price)
+    if max_price is not None:
+        query = query.filter(MenuItem.current_price <= max_price)
+    if sort in sort_columns:
+        column = sort_columns[sort]
+        query = query.order_by(column.desc() if direction == 'desc' else column.asc(), MenuItem.id)
+    return query
+
+@app.route('/api/menu', methods=['GET'])
+@replicas.read_only
+def list_menu():
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 24, type=int), 1), 100)
+    query = menu_items_query(
+        category=request.args.get('category'),
+        on_sale=request.args.get('on_sale') in ('1', 'true'),
+        min_price=request.args.get('min_price', type=float),
+        max_price=request.args.get('max_price', type=float),
+        sort=request.args.get('sort', 'name'),
+        direction='desc' if request.args.get('dir') == 'desc' else 'asc'
+    )
+    
+    # Fetch one extra row to know whether there is a next page without a COUNT(*)
+    rows = query.offset((page - 1) * per_page).limit(per_page + 1).add_columns(
+        MenuItem.current_price, MenuItem.has_active_discount
+    ).all()
+    return jsonify({
+        'page': page,
+        'per_page': per_page,
+        'has_next': len(rows) > per_page,
+        'items': [{
+            'id': item.id,
+            'name': item.name,
+            'description': item.description,
+            'category': item.category,
+            'price': float(current_price),
+            'original_price': float(item.original_price),
+            'has_active_discount': bool(has_active_discount),
+            'discount_percentage': item.discount_percentage if has_active_discount else 0.0,
+            'image_path': item.image_path
+        } for item, current_price, has_active_discount in rows[:per_page]]
+    })
+
 # Routes
 @app.route('/')
+@replicas.read_only
 def index():
     category = request.args.get('category')
-    if category:
-        menu_items = MenuItem.query.filter_by(category=category).all()
+    search_query = request.args.get('q', '').strip()
+    if search_query:
+        # Keep the search ranking order
+        hits = menu_search.search(db.session, MenuItem, search_query, limit=100)
+        items = {item.id: item for item in MenuItem.query.filter(MenuItem.id.in_([hit['id'] for hit in hits]))}
+        menu_items = [items[hit['id']] for hit in hits if hit['id'] in items]
     else:
-        menu_items = MenuItem.query.all()
+        menu_items = menu_items_query(
+            category=category,
+            on_sale=request.args.get('on_sale') == '1',
+            sort=request.args.get('sort'),
+            direction='desc' if request.args.get('dir') == 'desc' else 'asc'
+        ).all()
     
-    # Get all unique categories for the filter buttons
-    categories = db.session.query(MenuItem.category).distinct().all()
-    categories = [cat[0] for cat in categories if cat[0]]  # Filter out None values
+    # Category filter buttons with counts, served from memory
+    facets = get_category_facets()
     
     return render_template('index.html', 
                          menu_items=menu_items, 
-                         categories=categories,
-                         current_category=category)
+                         categories=facets['categories'],
+                         total_items=facets['total_items'],
+                         current_category=category,
+                         search_query=search_query)
 
 @app.route('/cart')
 def view_cart():
@@ -511,33 +1081,103 @@ def view_cart():
     return render_template('cart.html')
 
 @app.route('/item/<int:item_id>')
+@replicas.read_only
 def item_details(item_id):
     item = MenuItem.query.get_or_404(item_id)
     return render_template('item_details.html', item=item)
 
 @app.route('/admin')
 @login_required
+@replicas.read_only
 def admin_dashboard():
     if not current_user.is_admin:
         flash('Access denied. Admin privileges required.', 'danger')
         return redirect(url_for('index'))
     
-    # Get all menu items ordered by creation date (newest first)
-    menu_items = MenuItem.query.order_by(MenuItem.created_at.desc()).all()
-    return render_template('admin/dashboard.html', menu_items=menu_items)
+    sort_columns = {
+        'name': MenuItem.name,
+        'category': MenuItem.category,
+        'price': MenuItem.price,
+        'created': MenuItem.created_at
+    }
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 25, type=int), 1), 100)
+    sort = request.args.get('sort', 'created')
+    if sort not in sort_columns:
+        sort = 'created'
+    direction = 'asc' if request.args.get('dir') == 'asc' else 'desc'
+    search_query = request.args.get('q', '').strip()
+    
+    query = MenuItem.query
+    if search_query:
+        query = query.filter(MenuItem.id.in_(menu_search.matching_ids(MenuItem, search_query)))
+        total = query.order_by(None).count()
+    else:
+        # The facet cache already knows the item count, no COUNT(*) needed
+        total = get_category_facets()['total_items']
+    
+    column = sort_columns[sort]
+    menu_items = query.order_by(
+        column.asc() if direction == 'asc' else column.desc(),
+        MenuItem.id.desc()
+    ).offset((page - 1) * per_page).limit(per_page).all()
+    
+    template = 'admin/_menu_table.html' if request.args.get('partial') else 'admin/dashboard.html'
+    return render_template(template,
+                         menu_items=menu_items,
+                         page=page,
+                         pages=max((total + per_page - 1) // per_page, 1),
+                         per_page=per_page,
+                         total=total,
+                         sort=sort,
+                         direction=direction,
+                         search_query=search_query)
+
+@app.route('/admin/api/items/<int:item_id>', methods=['GET'])
+@login_required
+def admin_item_details(item_id):
+    """Details for the dashboard's image/discount/delete modals, loaded on demand."""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    item = MenuItem.query.get_or_404(item_id)
+    has_active_discount = bool(item.has_active_discount)
+    return jsonify({
+        'id': item.id,
+        'name': item.name,
+        'category': item.category,
+        'price': float(item.price),
+        'original_price': float(item.original_price),
+        'image_url': url_for('static', filename=item.image_path) if item.image_path else None,
+        'has_active_discount': has_active_discount,
+        'discount_percentage': item.discount_percentage or 0.0,
+        'discount_end': item.discount_end.strftime('%b %d, %Y %H:%M') if has_active_discount else None,
+        'urls': {
+            'apply_discount': url_for('apply_discount', item_id=item.id),
+            'remove_discount': url_for('remove_discount', item_id=item.id),
+            'edit': url_for('edit_item', item_id=item.id),
+            'delete': url_for('delete_item', item_id=item.id)
+        }
+    })
 
 @app.route('/orders')
 @login_required
+@replicas.read_only
 def user_orders():
     # Get current user's orders
-    orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
+    orders = list(newest_first(
+        Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()),
+        ArchivedOrder.query.filter_by(user_id=current_user.id).order_by(ArchivedOrder.created_at.desc())
+    ))
     return render_template('orders.html', orders=orders)
 
 @app.route('/invoice/<int:order_id>')
 @login_required
 def view_invoice(order_id):
     # Users can only view their own invoices, admins can view any
-    order = Order.query.get_or_404(order_id)
+    order = find_order(order_id)
+    if order is None:
+        abort(404)
     if not current_user.is_admin and order.user_id != current_user.id:
         flash('You are not authorized to view this invoice.', 'danger')
         return redirect(url_for('index'))
@@ -564,12 +1204,16 @@ def view_invoice(order_id):
 # Show list of invoices for the current user
 @app.route('/invoices')
 @login_required
+@replicas.read_only
 def list_invoices():
     # Get all paid or completed orders for the current user
-    orders = Order.query.filter(
-        Order.user_id == current_user.id,
-        Order.status.in_(['paid', 'completed', 'delivered'])
-    ).order_by(Order.updated_at.desc()).all()
+    orders = list(newest_first(*(
+        model.query.filter(
+            model.user_id == current_user.id,
+            model.status.in_(['paid', 'completed', 'delivered'])
+        ).order_by(model.updated_at.desc())
+        for model in (Order, ArchivedOrder)
+    ), key='updated_at'))
     
     return render_template('invoices.html', orders=orders)
 
@@ -598,6 +1242,7 @@ def apply_discount(item_id):
         
         item.apply_discount(discount_percentage, days)
         db.session.commit()
+        bump_catalog()
         
         flash(f'Successfully applied {discount_percentage}% discount to {item.name} for {days} days', 'success')
     except Exception as e:
@@ -617,6 +1262,7 @@ def remove_discount(item_id):
         item = MenuItem.query.get_or_404(item_id)
         item.remove_discount()
         db.session.commit()
+        bump_catalog()
         flash(f'Successfully removed discount from {item.name}', 'success')
     except Exception as e:
         db.session.rollback()
@@ -624,8 +1270,73 @@ def remove_discount(item_id):
     
     return redirect(url_for('admin_dashboard'))
 
+# action -> (new status, statuses it can be applied to); delete works on any order that is not archived
+ORDER_ACTIONS = {
+    'mark_paid': ('paid', ('pending',)),
+    'mark_completed': ('completed', ('pending', 'paid')),
+    'delete': (None, None),
+}
+BULK_ORDER_LIMIT = 500
+
+def apply_order_action(order_ids, action):
+    """Apply an admin action to many orders with set-based statements in one transaction.
+
+    Returns {order_id: (success, message)} for every id asked for.
+    """
+    status, allowed = ORDER_ACTIONS[action]
+    current = dict(db.session.query(Order.id, Order.status).filter(Order.id.in_(order_ids)).all())
+    archived = set(db.session.scalars(db.select(ArchivedOrder.id).where(ArchivedOrder.id.in_(order_ids))))
+    results, eligible = {}, []
+    for order_id in order_ids:
+        if order_id not in current:
+            results[order_id] = (False, 'Archived orders cannot be changed' if order_id in archived else 'Order not found')
+        elif status and current[order_id] == status:
+            results[order_id] = (True, f'Order is already {status}')
+        elif allowed and current[order_id] not in allowed:
+            results[order_id] = (False, f'A {current[order_id]} order cannot be marked as {status}')
+        else:
+            eligible.append(order_id)
+    if not eligible:
+        return results
+
+    try:
+        if action == 'delete':
+            payloads = {order.id: order_event_payload(order) for order in Order.query.options(
+                db.joinedload(Order.user), db.selectinload(Order.items)).filter(Order.id.in_(eligible))}
+            db.session.execute(db.delete(OrderItem).where(OrderItem.order_id.in_(eligible)))
+            done = set(db.session.execute(db.delete(Order).where(Order.id.in_(eligible)).returning(Order.id)).scalars())
+        else:
+            # The status guard makes a concurrent change lose cleanly instead of being overwritten
+            done = set(db.session.execute(db.update(Order).where(
+                Order.id.in_(eligible), Order.status.in_(allowed)
+            ).values(status=status).returning(Order.id)).scalars())
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    for order_id in eligible:
+        if order_id not in done:
+            results[order_id] = (False, 'Order was changed by someone else; reload and try again')
+        elif action == 'delete':
+            results[order_id] = (True, 'Order deleted successfully')
+        else:
+            results[order_id] = (True, f'Order marked as {status}')
+
+    # Committed already; as in publish_order_event, a broken feed is only logged
+    try:
+        if action == 'delete':
+            order_events.publish_many([('order_deleted', payloads[order_id]) for order_id in done if order_id in payloads])
+        else:
+            order_events.publish_many([('order_status', order_event_payload(order)) for order in Order.query.options(
+                db.joinedload(Order.user), db.selectinload(Order.items)).filter(Order.id.in_(list(done)))])
+    except Exception as e:
+        app.logger.error(f"Error publishing events for {action} on {len(done)} orders: {str(e)}")
+    return results
+
 @app.route('/admin/orders', methods=['GET', 'POST'])
 @login_required
+@replicas.read_only
 def admin_orders():
     if not current_user.is_admin:
         flash('Access denied. Admin privileges required.', 'danger')
@@ -639,35 +1350,252 @@ def admin_orders():
         if not order_id or not action:
             return jsonify({'success': False, 'message': 'Missing parameters'}), 400
             
-        order = Order.query.get(order_id)
-        if not order:
+        if action not in ORDER_ACTIONS:
+            return jsonify({'success': False, 'message': 'Invalid action'}), 400
+        try:
+            order_id = int(order_id)
+        except (TypeError, ValueError):
             return jsonify({'success': False, 'message': 'Order not found'}), 404
+        try:
+            success, message = apply_order_action([order_id], action)[order_id]
+        except Exception as e:
+            return jsonify({'success': False, 'message': f'Error updating order: {str(e)}'}), 500
+        if not success:
+            return jsonify({'success': False, 'message': message}), 404 if message == 'Order not found' else 409
+        return jsonify({'success': True, 'message': message})
+    
+    # The page takes a while to stream; the live feed resumes from here so no change made meanwhile is lost
+    last_event_id = order_events.for_tenant().broker.last_id(order_events.channel)
+    # Stream the page so time-to-first-byte and memory do not grow with the number of orders
+    orders = newest_first(iter_orders(Order.query.order_by(Order.created_at.desc())),
+                          iter_orders(ArchivedOrder.query.order_by(ArchivedOrder.created_at.desc())))
+    return Response(buffered_stream(stream_template('admin/orders.html', orders=orders, last_event_id=last_event_id)),
+                    mimetype='text/html')
+
+@app.route('/admin/orders/bulk', methods=['POST'])
+@login_required
+def bulk_order_action():
+    """Apply one action to many orders: {"order_ids": [...], "action": "mark_completed"}."""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    order_ids = data.get('order_ids')
+    if action not in ORDER_ACTIONS:
+        return jsonify({'success': False, 'message': 'Invalid action'}), 400
+    if not isinstance(order_ids, list) or not order_ids:
+        return jsonify({'success': False, 'message': 'order_ids must be a non-empty list'}), 400
+    if len(order_ids) > BULK_ORDER_LIMIT:
+        return jsonify({'success': False, 'message': f'At most {BULK_ORDER_LIMIT} orders per request'}), 400
+    
+    results = {}
+    for order_id in order_ids:
+        try:
+            results[int(order_id)] = None
+        except (TypeError, ValueError):
+            results[order_id] = (False, 'Invalid order id')
+    try:
+        valid_ids = [order_id for order_id, result in results.items() if result is None]
+        if valid_ids:
+            results.update(apply_order_action(valid_ids, action))
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error updating orders: {str(e)}'}), 500
+    
+    return jsonify({
+        'success': all(success for success, _ in results.values()),
+        'action': action,
+        'results': [{'order_id': order_id, 'success': success, 'message': message}
+                    for order_id, (success, message) in results.items()]
+    })
+
+@app.route('/admin/orders/export.csv')
+@login_required
+@replicas.read_only
+def export_orders_csv():
+    if not current_user.is_admin:
+        flash('Access denied. Admin privileges required.', 'danger')
+        return redirect(url_for('index'))
+    
+    orders = newest_first(iter_orders(Order.query.order_by(Order.created_at.desc())),
+                          iter_orders(ArchivedOrder.query.order_by(ArchivedOrder.created_at.desc())))
+    
+    def generate():
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['order_id', 'customer', 'email', 'status', 'payment_method', 'payment_status',
+                         'items', 'total_amount', 'created_at'])
+        for order in orders:
+            writer.writerow([
+                order.id,
+                order.user.username if order.user else '',
+                order.user.email if order.user else '',
+                order.status,
+                order.payment_method or '',
+                order.payment_status or '',
+                '; '.join(f"{item.quantity}x {item.menu_item_name}" for item in order.items),
+                f"{order.total_amount:.2f}",
+                order.created_at.isoformat() if order.created_at else ''
+            ])
+            if buffer.tell() >= 16384:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    filename = f"orders_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/admin/orders/stream')
+@login_required
+def admin_orders_stream():
+    """Server-Sent Events feed of order changes for admin and kitchen screens."""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    # Browsers send Last-Event-ID automatically when EventSource reconnects
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    events = order_events.for_tenant()  # the stream outlives the request context
+    subscription = events.subscribe(last_event_id)
+    heartbeat = app.config['EVENT_STREAM_HEARTBEAT']
+    
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            for event in subscription.listen(heartbeat=heartbeat):
+                if event is None:
+                    yield ': keep-alive\n\n'
+                else:
+                    yield format_sse(event)
+        finally:
+            events.unsubscribe(subscription)
+    
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
+
+@app.route('/kitchen')
+@login_required
+def kitchen_display():
+    if not current_user.is_admin:
+        flash('Access denied. Admin privileges required.', 'danger')
+        return redirect(url_for('index'))
+    
+    return render_template('admin/kitchen.html', snapshot=get_kitchen_queue().snapshot())
+
+@app.route('/api/kitchen', methods=['GET'])
+@login_required
+def kitchen_queue_api():
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    return jsonify(get_kitchen_queue().snapshot())
+
+@app.route('/admin/campaigns', methods=['GET', 'POST'])
+@login_required
+def discount_campaigns():
+    if not current_user.is_admin:
+        flash('Access denied. Admin privileges required.', 'danger')
+        return redirect(url_for('index'))
+    
+    if request.method == 'POST':
+        try:
+            name = request.form.get('name', '').strip()
+            scope = request.form.get('scope')
+            discount_percentage = float(request.form.get('discount_percentage', 0))
+            now = datetime.utcnow()
+            starts_at = datetime.fromisoformat(request.form['starts_at']) if request.form.get('starts_at') else now
+            ends_at = datetime.fromisoformat(request.form['ends_at'])
             
-        if action == 'mark_paid':
-            order.status = 'paid'
+            if not name:
+                raise ValueError('Campaign name is required')
+            if scope not in ('category', 'items', 'all'):
+                raise ValueError('Invalid campaign target')
+            if discount_percentage <= 0 or discount_percentage > 100:
+                raise ValueError('Discount percentage must be between 0.01 and 100')
+            if ends_at <= max(starts_at, now):
+                raise ValueError('Campaign must end after it starts and in the future')
+            
+            campaign = DiscountCampaign(
+                name=name,
+                scope=scope,
+                discount_percentage=discount_percentage,
+                starts_at=starts_at,
+                ends_at=ends_at
+            )
+            if scope == 'category':
+                campaign.category = request.form.get('category')
+                if not campaign.category:
+                    raise ValueError('Please choose a category')
+            elif scope == 'items':
+                item_ids = sorted({int(value) for value in request.form.get('item_ids', '').replace(',', ' ').split()})
+                if not item_ids:
+                    raise ValueError('Please enter at least one item ID')
+                campaign.item_ids = json.dumps(item_ids)
+            
+            db.session.add(campaign)
+            db.session.flush()
+            if starts_at <= now:
+                campaign.start()
             db.session.commit()
-            return jsonify({'success': True, 'message': f'Order marked as {order.status}'})
-        elif action == 'mark_completed':
-            order.status = 'completed'
+            
+            if campaign.status == 'active':
+                bump_catalog()
+                flash(f'Campaign "{campaign.name}" applied to {campaign.items_affected} items', 'success')
+            else:
+                flash(f'Campaign "{campaign.name}" scheduled to start {campaign.starts_at.strftime("%b %d, %Y %H:%M")} UTC', 'success')
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error creating campaign: {str(e)}', 'danger')
+        
+        return redirect(url_for('discount_campaigns'))
+    
+    campaigns = DiscountCampaign.query.order_by(DiscountCampaign.created_at.desc()).limit(50).all()
+    return render_template('admin/campaigns.html',
+                         campaigns=campaigns,
+                         categories=[facet['name'] for facet in get_category_facets()['categories']])
+
+@app.route('/admin/campaigns/<int:campaign_id>/cancel', methods=['POST'])
+@login_required
+def cancel_campaign(campaign_id):
+    if not current_user.is_admin:
+        flash('Access denied. Admin privileges required.', 'danger')
+        return redirect(url_for('index'))
+    
+    campaign = DiscountCampaign.query.get_or_404(campaign_id)
+    try:
+        was_active = campaign.status == 'active'
+        if campaign.finish(status='cancelled'):
             db.session.commit()
-            return jsonify({'success': True, 'message': f'Order marked as {order.status}'})
-        elif action == 'delete':
-            try:
-                # Delete order items first due to foreign key constraint
-                OrderItem.query.filter_by(order_id=order_id).delete()
-                # Then delete the order
-                db.session.delete(order)
-                db.session.commit()
-                return jsonify({'success': True, 'message': 'Order deleted successfully'})
-            except Exception as e:
-                db.session.rollback()
-                return jsonify({'success': False, 'message': f'Error deleting order: {str(e)}'}), 500
+            if was_active:
+                bump_catalog()
+            flash(f'Campaign "{campaign.name}" cancelled', 'success')
         else:
-            return jsonify({'success': False, 'message': 'Invalid action'}), 400
+            flash('Only scheduled or active campaigns can be cancelled', 'warning')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error cancelling campaign: {str(e)}', 'danger')
     
-    # Get all orders with user and items data
-    orders = Order.query.order_by(Order.created_at.desc()).all()
-    return render_template('admin/orders.html', orders=orders)
+    return redirect(url_for('discount_campaigns'))
+
+@app.route('/admin/debug/sql', methods=['GET'])
+@login_required
+def sql_profile_debug():
+    """Recent per-request SQL profiles (enable with SQL_PROFILER=1)."""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    profiles = sql_profiler.recent()
+    if request.args.get('n_plus_one') == '1':
+        profiles = [profile for profile in profiles if profile['n_plus_one']]
+    return jsonify({
+        'enabled': sql_profiler.enabled,
+        'slow_query_ms': app.config['SQL_SLOW_QUERY_MS'],
+        'n_plus_one_threshold': app.config['SQL_N_PLUS_ONE_THRESHOLD'],
+        'profiles': profiles
+    })
 
 @app.route('/admin/item/new', methods=['GET', 'POST'])
 @login_required
@@ -688,9 +1616,10 @@ def new_item():
             file = request.files['image']
             if file.filename != '':
                 filename = secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                folder, static_path = upload_folder()
+                filepath = os.path.join(folder, filename)
                 file.save(filepath)
-                image_path = f"uploads/{filename}"
+                image_path = f"{static_path}/{filename}"
         
         new_item = MenuItem(
             name=name,
@@ -702,6 +1631,7 @@ def new_item():
         
         db.session.add(new_item)
         db.session.commit()
+        bump_catalog()
         flash('Menu item added successfully!', 'success')
         return redirect(url_for('admin_dashboard'))
     
@@ -736,11 +1666,13 @@ def edit_item(item_id):
                 
                 # Save new image
                 filename = secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                folder, static_path = upload_folder()
+                filepath = os.path.join(folder, filename)
                 file.save(filepath)
-                item.image_path = f"uploads/{filename}"
+                item.image_path = f"{static_path}/{filename}"
         
         db.session.commit()
+        bump_catalog()
         flash('Menu item updated successfully!', 'success')
         return redirect(url_for('admin_dashboard'))
     
@@ -764,18 +1696,184 @@ def delete_item(item_id):
     
     db.session.delete(item)
     db.session.commit()
+    bump_catalog()
     
     flash('Menu item deleted successfully!', 'success')
     return redirect(url_for('admin_dashboard'))
 
-@app.route('/generate_invoice/<int:item_id>')
+def import_menu(rows, images=None, dry_run=True):
+    """Validate menu rows, diff them against the menu and, unless `dry_run`, write them in one transaction.
+
+    Returns the diff report with the validation errors added; nothing is written if there are any.
+    """
+    image_names = menu_io.zip_image_names(images) if images is not None else None
+    items = {item.external_key: item for item in MenuItem.query.all()}
+    clean, errors = menu_io.validate_rows(rows, image_names, existing=items)
+    current = {key: {'name': item.name, 'description': item.description, 'price': item.original_price,
+                     'category': item.category, 'gst': item.gst,
+                     'image': os.path.basename(item.image_path) if item.image_path else None}
+               for key, item in items.items()}
+    report = menu_io.diff_rows(clean, current)
+    report.update(errors=errors, applied=False)
+    if dry_run or errors or not (report['create'] or report['update']):
+        return report
+
+    changed = report['create'] + [update['row'] for update in report['update'] if 'image' in update['changes']]
+    changed = [row for row in changed if row['image']]
+    paths, image_errors = {}, {}
+    if changed:
+        paths, image_errors = menu_io.save_images(images, [row['image'] for row in changed], *upload_folder(),
+                                                  workers=app.config['MENU_IMPORT_IMAGE_WORKERS'])
+    if image_errors:
+        report['errors'] = [(row['row'], 'image', image_errors[row['image']])
+                            for row in changed if row['image'] in image_errors]
+        return report
+
+    now = datetime.utcnow()
+    creates = [{'sku': row['sku'], 'name': row['name'], 'description': row['description'],
+                'price': row['price'], 'original_price': row['price'], 'category': row['category'],
+                'gst': row['gst'], 'image_path': paths.get(row['image']), 'created_at': now, 'updated_at': now}
+               for row in report['create']]
+    updates = []
+    for update in report['update']:
+        item, row = items[update['sku']], update['row']
+        # A running discount keeps applying to the new price
+        price = round(row['price'] * (1 - item.discount_percentage / 100), 2) if item.has_active_discount else row['price']
+        updates.append({'id': item.id, 'sku': row['sku'], 'name': row['name'], 'description': row['description'],
+                        'price': price, 'original_price': row['price'], 'category': row['category'],
+                        'gst': row['gst'], 'image_path': paths.get(row['image'], item.image_path), 'updated_at': now})
+    try:
+        # One executemany per statement, all in a single transaction
+        if creates:
+            db.session.execute(db.insert(MenuItem), creates)
+        if updates:
+            db.session.execute(db.update(MenuItem), updates)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    bump_catalog()
+    report['applied'] = True
+    return report
+
+def export_menu(export_format):
+    """The menu as (bytes, mimetype) in 'csv', 'json' or 'zip' (menu.csv plus the images) format."""
+    items = MenuItem.query.order_by(MenuItem.id).all()
+    rows = list(menu_io.export_rows(items))
+    if export_format == 'json':
+        return json.dumps(rows, indent=2).encode('utf-8'), 'application/json'
+    output = StringIO()
+    writer = csv.DictWriter(output, fieldnames=menu_io.FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    if export_format == 'csv':
+        return output.getvalue().encode('utf-8'), 'text/csv'
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('menu.csv', output.getvalue())
+        for item, row in zip(items, rows):
+            if item.image_path and os.path.isfile(os.path.join('static', item.image_path)):
+                archive.write(os.path.join('static', item.image_path), row['image'])
+    return buffer.getvalue(), 'application/zip'
+
+@app.route('/admin/menu/import', methods=['GET', 'POST'])
 @login_required
-def generate_invoice(item_id):
-    item = MenuItem.query.get_or_404(item_id)
+def import_menu_items():
+    if not current_user.is_admin:
+        flash('Access denied. Admin privileges required.', 'danger')
+        return redirect(url_for('index'))
     
-    # Calculate total
-    gst_amount = (item.price * item.gst) / 100
-    total = item.price + gst_amount - item.discount
+    report = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        images_upload = request.files.get('images')
+        dry_run = request.form.get('dry_run') == 'on'
+        if not upload or upload.filename == '':
+            flash('Choose a CSV, JSON or ZIP file to import.', 'danger')
+            return redirect(url_for('import_menu_items'))
+        try:
+            rows, images = menu_io.read_upload(upload.read(), upload.filename)
+            if images_upload and images_upload.filename != '':
+                images = menu_io.open_images_zip(images_upload.read())
+            report = import_menu(rows, images, dry_run=dry_run)
+        except menu_io.MenuImportError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('import_menu_items'))
+        except IntegrityError:
+            flash('Another import changed the same items; run the import again.', 'danger')
+            return redirect(url_for('import_menu_items'))
+        if report['applied']:
+            flash(f"Imported {len(report['create'])} new and {len(report['update'])} updated items.", 'success')
+        elif report['errors']:
+            flash(f"Nothing was imported: {len(report['errors'])} problems found.", 'danger')
+    
+    return render_template('admin/menu_import.html', report=report)
+
+@app.route('/admin/menu/export')
+@login_required
+def export_menu_items():
+    if not current_user.is_admin:
+        flash('Access denied. Admin privileges required.', 'danger')
+        return redirect(url_for('index'))
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'json', 'zip'):
+        abort(400)
+    data, mimetype = export_menu(export_format)
+    response = make_response(data)
+    response.headers['Content-Type'] = mimetype
+    response.headers['Content-Disposition'] = f'attachment; filename=menu.{export_format}'
+    return response
+
+@app.cli.command('menu-import')
+@tenants.cli_option
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--images', 'images_path', type=click.Path(exists=True, dir_okay=False), help='ZIP of the images named in the file.')
+@click.option('--dry-run', is_flag=True, help='Only report what would change.')
+def menu_import_command(path, images_path, dry_run):
+    """Import menu items from a CSV, JSON or ZIP file."""
+    try:
+        with open(path, 'rb') as f:
+            rows, images = menu_io.read_upload(f.read(), path)
+        if images_path:
+            with open(images_path, 'rb') as f:
+                images = menu_io.open_images_zip(f.read())
+    except menu_io.MenuImportError as e:
+        raise click.ClickException(str(e))
+    report = import_menu(rows, images, dry_run=dry_run)
+    for number, field, message in report['errors']:
+        click.echo(f"row {number}: {field} {message}", err=True)
+    for row in report['create']:
+        click.echo(f"+ {row['sku']} {row['name']}")
+    for update in report['update']:
+        changes = ', '.join(f"{field}: {old!r} -> {new!r}" for field, (old, new) in update['changes'].items())
+        click.echo(f"~ {update['sku']} {changes}")
+    click.echo(f"{len(report['create'])} to create, {len(report['update'])} to update, "
+               f"{report['unchanged']} unchanged, {len(report['errors'])} errors; "
+               f"{'applied' if report['applied'] else 'nothing written'}")
+    if report['errors']:
+        raise SystemExit(1)
+
+@app.cli.command('menu-export')
+@tenants.cli_option
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+def menu_export_command(path):
+    """Export the menu to a .csv, .json or .zip file."""
+    export_format = os.path.splitext(path)[1].lstrip('.').lower()
+    if export_format not in ('csv', 'json', 'zip'):
+        raise click.BadParameter('use a .csv, .json or .zip file name', param_hint='PATH')
+    data, _ = export_menu(export_format)
+    with open(path, 'wb') as f:
+        f.write(data)
+    click.echo(f"Exported {MenuItem.query.count()} menu items to {path}")
+
+def build_item_invoice_pdf(item, customer_name=None):
+    """Draw the single-item invoice and return the PDF bytes."""
+    # Menu items carry a percentage discount window, not a flat discount amount
+    price = item.current_price
+    discount_amount = item.original_price - price if item.has_active_discount else 0.0
+    gst_amount = (price * item.gst) / 100
+    total = price + gst_amount
     
     # Create PDF in memory
     buffer = BytesIO()
@@ -791,18 +1889,19 @@ def generate_invoice(item_id):
     y_position = 700
     
     # Add customer information
-    if current_user.is_authenticated:
-        p.drawString(100, y_position, f"Customer: {current_user.username}")
+    if customer_name:
+        p.drawString(100, y_position, f"Customer: {customer_name}")
         y_position -= 25
     
     # Add invoice details
     p.drawString(100, y_position, f"Item: {item.name}")
     y_position -= 25
-    p.drawString(100, y_position, f"Price: ${item.price:.2f}")
+    p.drawString(100, y_position, f"Price: ${item.original_price:.2f}")
     y_position -= 25
+    if discount_amount:
+        p.drawString(100, y_position, f"Discount ({item.discount_percentage:g}%): -${discount_amount:.2f}")
+        y_position -= 25
     p.drawString(100, y_position, f"GST ({item.gst}%): ${gst_amount:.2f}")
-    y_position -= 25
-    p.drawString(100, y_position, f"Discount: ${item.discount:.2f}")
     y_position -= 30
     p.line(100, y_position, 300, y_position)
     y_position -= 25
@@ -821,18 +1920,44 @@ def generate_invoice(item_id):
     p.drawString(100, y_position, "Restaurant Management System")
     
     p.save()
+    return buffer.getvalue()
+
+@app.route('/generate_invoice/<int:item_id>')
+@login_required
+def generate_invoice(item_id):
+    item = MenuItem.query.get_or_404(item_id)
+    
+    render_start = time.perf_counter()
+    pdf_span = tracing.tracer.start_span('pdf.render', attributes={'document': 'item_invoice'}, require_parent=True)
+    error = None
+    try:
+        pdf = build_item_invoice_pdf(item, current_user.username if current_user.is_authenticated else None)
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        # Failed renders are timed and traced too; they are the ones worth looking at
+        tracing.tracer.end_span(pdf_span, error=error)
+        pdf_render_seconds.observe(time.perf_counter() - render_start, document='item_invoice')
     
     # Prepare the response
-    buffer.seek(0)
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
     filename = f"invoice_{item.name.replace(' ', '_')}_{timestamp}.pdf"
     
-    response = make_response(buffer.getvalue())
+    response = make_response(pdf)
     response.mimetype = 'application/pdf'
     response.headers['Content-Disposition'] = f'attachment; filename={filename}'
     
     return response
 
+def login_overloaded(page):
+    """503 for a login or signup shed because the password hashing pool is full."""
+    login_rejected_total.inc(reason='overloaded')
+    flash('We are handling a lot of logins right now. Please try again in a few seconds.', 'warning')
+    response = make_response(render_template(f'{page}.html'), 503)
+    response.headers['Retry-After'] = '5'
+    return response
+
 @app.route('/signup', methods=['GET', 'POST'])
 def signup():
     if current_user.is_authenticated:
@@ -854,7 +1979,10 @@ def signup():
             return redirect(url_for('signup'))
         
         # Create new user with email
-        hashed_password = generate_password_hash(password, method='sha256')
+        try:
+            hashed_password = password_hasher.hash(password)
+        except HashingOverloaded:
+            return login_overloaded('signup')
         new_user = User(
             username=username, 
             email=email if email else None,  # Store email if provided, None otherwise
@@ -881,13 +2009,37 @@ def login():
         if not email or not password:
             flash('Please provide both email and password.', 'danger')
             return redirect(url_for('login'))
+
+        retry_after = login_throttle.wait(request.remote_addr)
+        if retry_after:
+            login_rejected_total.inc(reason='throttled')
+            flash(f'Too many login attempts. Please try again in {retry_after} seconds.', 'danger')
+            response = make_response(render_template('login.html'), 429)
+            response.headers['Retry-After'] = str(retry_after)
+            return response
             
         user = User.query.filter_by(email=email).first()
         
         # Check if user exists and password is correct
-        if not user or not check_password_hash(user.password, password):
+        try:
+            valid = user is not None and password_hasher.check(user.password, password)
+        except HashingOverloaded:
+            return login_overloaded('login')
+        if not valid:
+            login_throttle.hit(request.remote_addr)
             flash('Invalid email or password. Please try again.', 'danger')
             return redirect(url_for('login'))
+
+        # Upgrade legacy hashes (e.g. plain sha256) to the configured scheme while we have the password
+        if password_hasher.needs_rehash(user.password):
+            try:
+                user.password = password_hasher.hash(password)
+                db.session.commit()
+            except HashingOverloaded:
+                pass  # try again on the next login
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Error upgrading password hash for user {user.id}: {str(e)}")
             
         # If the above check passes, log the user in
         login_user(user, remember=remember)
@@ -959,7 +2111,9 @@ def order_confirmation():
         flash('No order specified', 'danger')
         return redirect(url_for('index'))
     
-    order = Order.query.filter_by(id=order_id, user_id=current_user.id).first_or_404()
+    order = find_order(order_id, user_id=current_user.id)
+    if order is None:
+        abort(404)
     settings = Settings.get_settings()
     
     # Calculate order totals using the utility function
@@ -987,8 +2141,7 @@ def order_confirmation():
 @login_required
 def payment_options():
     # Get cart items to show order summary
-    cart = current_user.get_or_create_cart()
-    cart_items = CartItem.query.filter_by(cart_id=cart.id).all()
+    cart_items = cart_lines(cart_store.get(current_user.id))
     
     if not cart_items:
         flash('Your cart is empty', 'warning')
@@ -1030,26 +2183,269 @@ def check_expired_discounts():
             
             if expired_items:
                 db.session.commit()
+                bump_catalog()
                 app.logger.info(f"Removed expired discounts from {len(expired_items)} items")
         except Exception as e:
             app.logger.error(f"Error checking expired discounts: {str(e)}")
             db.session.rollback()
 
+def run_discount_campaigns():
+    """Start campaigns whose window has opened and end the ones that are over"""
+    with app.app_context():
+        try:
+            now = datetime.utcnow()
+            changed = False
+            
+            for campaign in DiscountCampaign.query.filter(
+                DiscountCampaign.status.in_(['scheduled', 'active']),
+                DiscountCampaign.ends_at <= now
+            ).all():
+                changed = campaign.finish() or changed
+            
+            for campaign in DiscountCampaign.query.filter(
+                DiscountCampaign.status == 'scheduled',
+                DiscountCampaign.starts_at <= now
+            ).order_by(DiscountCampaign.starts_at).all():
+                changed = campaign.start() or changed
+            
+            db.session.commit()
+            if changed:
+                bump_catalog()
+        except Exception as e:
+            app.logger.error(f"Error running discount campaigns: {str(e)}")
+            db.session.rollback()
+
+def flush_carts():
+    """Write carts changed in the cart store to the cart tables"""
+    with app.app_context():
+        try:
+            cart_store.flush()
+        except Exception as e:
+            app.logger.error(f"Error flushing carts: {str(e)}")
+            db.session.rollback()
+
+def find_abandoned_carts(cutoff):
+    """(cart id, user id) of carts with no activity since `cutoff`."""
+    last_activity = db.session.query(
+        CartItem.cart_id, db.func.max(CartItem.updated_at).label('updated_at')
+    ).group_by(CartItem.cart_id).subquery()
+    return db.session.query(Cart.id, Cart.user_id).outerjoin(
+        last_activity, last_activity.c.cart_id == Cart.id
+    ).filter(db.func.coalesce(last_activity.c.updated_at, Cart.updated_at) < cutoff).order_by(Cart.id).all()
+
+def purge_abandoned_carts(days=None, archive_path=None, full_vacuum=False):
+    """Delete carts idle for `days` in small batches, then shrink the database file"""
+    days = app.config['CART_RETENTION_DAYS'] if days is None else days
+    archive_path = archive_path or app.config['CART_ARCHIVE_PATH']
+    report = {'carts': 0, 'cart_items': 0, 'pages_freed': 0, 'bytes_freed': 0}
+    if days <= 0:
+        return report
+    with app.app_context():
+        try:
+            started = time.perf_counter()
+            # Write pending cart changes first so recently active carts aren't taken for abandoned
+            cart_store.flush()
+            carts = find_abandoned_carts(datetime.utcnow() - timedelta(days=days))
+            owners = dict(carts)
+            archive = open(archive_path, 'a', encoding='utf-8') if archive_path and carts else None
+
+            def delete_batch(cart_ids):
+                if archive is not None:
+                    lines = {}
+                    for cart_id, menu_item_id, quantity in db.session.query(
+                            CartItem.cart_id, CartItem.menu_item_id, CartItem.quantity
+                    ).filter(CartItem.cart_id.in_(cart_ids)):
+                        lines.setdefault(cart_id, {})[menu_item_id] = quantity
+                    archived_at = datetime.utcnow().isoformat()
+                    for cart_id in cart_ids:
+                        archive.write(json.dumps({'tenant': tenants.current(), 'cart_id': cart_id, 'user_id': owners[cart_id],
+                                                  'items': lines.get(cart_id, {}), 'archived_at': archived_at}) + '\n')
+                    archive.flush()
+                items = CartItem.query.filter(CartItem.cart_id.in_(cart_ids)).delete(synchronize_session=False)
+                cart_rows = Cart.query.filter(Cart.id.in_(cart_ids)).delete(synchronize_session=False)
+                return {'cart_items': items, 'carts': cart_rows}
+
+            try:
+                deleted = purge_in_batches(db.session, [cart_id for cart_id, _ in carts], delete_batch,
+                                           batch_size=app.config['CART_RETENTION_BATCH'])
+            finally:
+                if archive is not None:
+                    archive.close()
+            report.update(deleted)
+            cart_store.flush()  # and forget purged carts still held in the store
+            for table, rows in deleted.items():
+                retention_rows_deleted_total.inc(rows, table=table)
+
+            db.session.remove()
+            report['pages_freed'], report['bytes_freed'] = reclaim_space(
+                tenants.engine(), app.config['VACUUM_MAX_PAGES'], full=full_vacuum)
+            app.logger.info(f"Purged {report['carts']} abandoned carts ({report['cart_items']} items), "
+                            f"reclaimed {report['bytes_freed'] / 1024 / 1024:.1f} MB "
+                            f"in {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            app.logger.error(f"Error purging abandoned carts: {str(e)}")
+            db.session.rollback()
+    return report
+
+@app.cli.command('purge-carts')
+@tenants.cli_option
+@click.option('--days', type=float, default=None, help='Idle age in days (default: CART_RETENTION_DAYS).')
+@click.option('--archive', 'archive_path', default=None, help='Append purged carts to this JSON lines file.')
+@click.option('--full-vacuum', is_flag=True, help='Rebuild the whole database file (blocks writers while it runs).')
+def purge_carts_command(days, archive_path, full_vacuum):
+    """Purge abandoned carts and reclaim the freed space."""
+    report = purge_abandoned_carts(days, archive_path, full_vacuum)
+    click.echo(f"Deleted {report['carts']} carts and {report['cart_items']} cart items; "
+               f"freed {report['pages_freed']} pages ({report['bytes_freed'] / 1024 / 1024:.1f} MB)")
+
+def archive_orders(days=None):
+    """Move completed orders older than `days` to the archive database in small batches"""
+    days = app.config['ORDER_ARCHIVE_DAYS'] if days is None else days
+    report = {'order': 0, 'order_item': 0}
+    if days <= 0 or tenants.engine().dialect.name != 'sqlite':  # the archive is a SQLite attachment
+        return report
+    with app.app_context():
+        try:
+            started = time.perf_counter()
+            # Without AUTOINCREMENT (databases created before it) SQLite reuses the highest rowid once it
+            # is deleted, so the newest order always stays hot
+            newest = db.session.query(db.func.max(Order.id)).scalar() or 0
+            order_ids = [row[0] for row in db.session.query(Order.id).filter(
+                Order.status.in_(ARCHIVE_STATUSES),
+                Order.created_at < datetime.utcnow() - timedelta(days=days),
+                Order.id < newest
+            ).order_by(Order.id)]
+
+            def move_batch(batch):
+                # Copy and commit first, then delete: a crash can leave a copy behind but never lose an order
+                copied = (copy_rows(db.session, Order.__table__, ArchivedOrder.__table__, 'id', batch)
+                          & copy_rows(db.session, OrderItem.__table__, ArchivedOrderItem.__table__, 'order_id', batch))
+                db.session.commit()
+                conflicts = sorted(set(batch) - copied)
+                if conflicts:
+                    # A reused id already belongs to a different archived row; keep these orders hot
+                    app.logger.error(f"Not archiving orders {conflicts}: their ids are taken in the archive")
+                copied = sorted(copied)
+                return {'order_item': delete_rows(db.session, OrderItem.__table__, 'order_id', copied),
+                        'order': delete_rows(db.session, Order.__table__, 'id', copied)}
+
+            moved = purge_in_batches(db.session, order_ids, move_batch, batch_size=app.config['ORDER_ARCHIVE_BATCH'])
+            report.update(moved)
+            for table, rows in moved.items():
+                retention_rows_deleted_total.inc(rows, table=table)
+
+            db.session.remove()
+            report['pages_freed'], report['bytes_freed'] = reclaim_space(tenants.engine(), app.config['VACUUM_MAX_PAGES'])
+            app.logger.info(f"Archived {report['order']} orders ({report['order_item']} items) "
+                            f"in {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            app.logger.error(f"Error archiving orders: {str(e)}")
+            db.session.rollback()
+    return report
+
+@app.cli.command('archive-orders')
+@tenants.cli_option
+@click.option('--days', type=float, default=None, help='Age in days (default: ORDER_ARCHIVE_DAYS).')
+def archive_orders_command(days):
+    """Move old completed orders to the archive database."""
+    report = archive_orders(days)
+    click.echo(f"Archived {report['order']} orders and {report['order_item']} order items "
+               f"to {order_archive_paths.get(tenants.current())}")
+
+def tenant_summary(since):
+    """Order totals since `since` for the current tenant, hot and archived orders together (from the replica if any)"""
+    with app.app_context(), replicas.reads():
+        summary = {'orders': 0, 'revenue': 0.0, 'open': 0}
+        quantities = {}
+        for model, item_model in ((Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)):
+            orders, revenue, open_orders = db.session.query(
+                db.func.count(model.id),
+                db.func.coalesce(db.func.sum(model.total_amount), 0.0),
+                db.func.coalesce(db.func.sum(db.case((model.status.in_(OPEN_STATUSES), 1), else_=0)), 0)
+            ).filter(model.created_at >= since).one()
+            summary['orders'] += orders
+            summary['revenue'] += revenue
+            summary['open'] += open_orders
+            for name, quantity in db.session.query(item_model.menu_item_name, db.func.sum(item_model.quantity)).join(
+                model, item_model.order_id == model.id
+            ).filter(model.created_at >= since).group_by(item_model.menu_item_name):
+                quantities[name] = quantities.get(name, 0) + quantity
+        summary['top_item'] = min(quantities, key=lambda name: (-quantities[name], name)) if quantities else None
+        return summary
+
+@app.cli.command('tenant-report')
+@click.option('--days', type=float, default=1, show_default=True, help='Report on orders placed in the last N days.')
+def tenant_report_command(days):
+    """Orders and revenue per outlet, read from every tenant database in parallel."""
+    since = datetime.utcnow() - timedelta(days=days)
+    results = tenants.map(lambda: tenant_summary(since), workers=app.config['TENANT_REPORT_WORKERS'])
+    click.echo(f"{'tenant':<20} {'orders':>8} {'open':>6} {'revenue':>12}  top item")
+    totals = {'orders': 0, 'open': 0, 'revenue': 0.0}
+    for tenant, summary, error in results:
+        if error is not None:
+            click.echo(f"{tenant:<20} error: {error}")
+            continue
+        for key in totals:
+            totals[key] += summary[key]
+        click.echo(f"{tenant:<20} {summary['orders']:>8} {summary['open']:>6} {summary['revenue']:>12.2f}  "
+                   f"{summary['top_item'] or '-'}")
+    click.echo(f"{'total':<20} {totals['orders']:>8} {totals['open']:>6} {totals['revenue']:>12.2f}")
+    if any(error is not None for _, _, error in results):
+        raise SystemExit(1)
+
+def refresh_replicas(force=False):
+    """Take a new snapshot of the current tenant's database for read-only views (READ_REPLICA=snapshot)."""
+    with app.app_context():
+        try:
+            replicas.refresh(force=force)
+        except Exception as e:
+            app.logger.error(f"Error refreshing the read replica of {tenants.current()}: {str(e)}")
+
 # Check for expired discounts when the app starts
-check_expired_discounts()
+tenants.each(check_expired_discounts)()
 
 # Schedule periodic check for expired discounts (every hour)
 from apscheduler.schedulers.background import BackgroundScheduler
 scheduler = BackgroundScheduler()
-scheduler.add_job(func=check_expired_discounts, trigger='interval', hours=1)
+scheduler.add_job(func=scheduler_job_seconds.time(job='check_expired_discounts')(tenants.each(check_expired_discounts)),
+                  trigger='interval', hours=1)
+scheduler.add_job(func=scheduler_job_seconds.time(job='run_discount_campaigns')(tenants.each(run_discount_campaigns)),
+                  trigger='interval', minutes=1)
+scheduler.add_job(func=scheduler_job_seconds.time(job='purge_abandoned_carts')(tenants.each(purge_abandoned_carts)),
+                  trigger='interval', hours=6)
+scheduler.add_job(func=scheduler_job_seconds.time(job='archive_orders')(tenants.each(archive_orders)),
+                  trigger='interval', hours=6)
+if replicas.enabled:
+    scheduler.add_job(func=scheduler_job_seconds.time(job='refresh_replicas')(tenants.each(refresh_replicas)),
+                      trigger='interval', seconds=app.config['READ_REPLICA_REFRESH_INTERVAL'])
+if app.config['CART_FLUSH_INTERVAL'] > 0:
+    scheduler.add_job(func=scheduler_job_seconds.time(job='flush_carts')(tenants.each(flush_carts)),
+                      trigger='interval', seconds=app.config['CART_FLUSH_INTERVAL'])
 scheduler.start()
+# Write out carts still in the store on a clean shutdown
+atexit.register(tenants.each(flush_carts))
 
 def create_tables():
     """Create database tables if they don't exist and ensure admin user exists."""
     with app.app_context():
         try:
-            # This will create all tables that don't exist
-            db.create_all()
+            # This will create all tables that don't exist in the current tenant's database
+            engine = tenants.engine()
+            db.metadata.create_all(engine)
+            # create_all() skips existing tables, so add any nullable columns and indexes declared since
+            inspector = db.inspect(engine)
+            for table in db.metadata.sorted_tables:
+                if table.schema is None and inspector.has_table(table.name):
+                    existing = {column['name'] for column in inspector.get_columns(table.name)}
+                    for column in table.columns:
+                        if column.name not in existing and column.nullable:
+                            column_type = column.type.compile(engine.dialect)
+                            with engine.begin() as conn:
+                                conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+                for index in table.indexes:
+                    index.create(bind=engine, checkfirst=True)
+            if not menu_search.for_tenant().setup(engine):
+                print("FTS5 unavailable, menu search will use LIKE")
             print("Database tables created successfully")
             
             # Check if admin user exists, if not create one
@@ -1085,8 +2481,9 @@ def create_tables():
             db.session.rollback()
             # If there's an error, try to continue anyway
 
-# Create tables when the app starts
-create_tables()
+# Create tables when the app starts, in every tenant's database
+tenants.each(create_tables)()
+tenants.each(refresh_replicas)(force=True)
 
 if __name__ == '__main__':
     # The app is already initialized with create_tables()
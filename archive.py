@@ -0,0 +1,56 @@
+"""
+Hot/cold storage: old rows move to tables in a second SQLite file.
+
+The archive file is ATTACHed to every connection under the schema name
+``archive``, so archive tables are ordinary tables that the ORM can map and
+query (``archive."order"``) and rows move between the two files with plain
+``INSERT ... SELECT`` statements.
+
+Moving is done in two transactions: rows are copied into the archive (rows
+already there are skipped) and committed, and only then deleted from the
+hot table. SQLite in WAL mode does not commit a transaction atomically
+across attached files, so this order means that a crash can at worst leave
+a row in both places, which the next run cleans up, and never loses one.
+"""
+from sqlalchemy import and_, event, exists, select
+
+
+def attach_database(engine, path, name='archive'):
+    """ATTACH the SQLite file at `path` as schema `name` on every new connection of `engine`."""
+    @event.listens_for(engine, 'connect')
+    def attach(dbapi_connection, connection_record):
+        dbapi_connection.execute(f'ATTACH DATABASE ? AS {name}', (path,))
+
+
+def archive_table(table, metadata, schema='archive', archived=()):
+    """Copy of `table` in the archive schema.
+
+    Foreign keys to the tables named in `archived` point at their archive
+    copies; all other foreign keys keep pointing at the hot database.
+    """
+    def referred_schema(table, to_schema, constraint, referred_schema):
+        referred = constraint.elements[0].target_fullname.split('.')[0]
+        return to_schema if referred in archived else referred_schema
+    return table.to_metadata(metadata, schema=schema, referred_schema_fn=referred_schema)
+
+
+def copy_rows(session, source, target, column, ids):
+    """Copy the rows of `source` whose `column` is in `ids` into `target`, skipping rows already there.
+
+    Returns the set of `ids` whose rows are all in `target` now, exactly as
+    they are in `source`. An id is left out when `target` holds a different
+    row under the same primary key (SQLite reused a rowid), so the caller
+    must only delete the ids it gets back.
+    """
+    columns = [c.name for c in source.columns]
+    session.execute(target.insert().prefix_with('OR IGNORE').from_select(
+        columns, select(*source.columns).where(source.c[column].in_(ids))))
+    copy = target.alias('copy')  # both tables may be called "order", which the subquery can't tell apart
+    same = [copy.c[name].is_not_distinct_from(source.c[name]) for name in columns]
+    conflicting = session.scalars(select(source.c[column]).distinct().where(
+        source.c[column].in_(ids), ~exists().where(and_(*same))))
+    return set(ids) - set(conflicting)
+
+
+def delete_rows(session, table, column, ids):
+    return session.execute(table.delete().where(table.c[column].in_(ids))).rowcount
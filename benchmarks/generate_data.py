@@ -0,0 +1,385 @@
+"""
+Synthetic dataset generator for benchmarks and capacity tests.
+
+Builds a SQLite database with the app's schema and fills it with realistic
+volumes and distributions:
+
+* menu items across categories with log-normal prices and a few active discounts
+* customers whose ordering frequency is skewed (a few regulars, a long tail)
+* orders concentrated at lunch and dinner, busier on Friday and Saturday
+* order lines whose item popularity follows a Zipf distribution
+* a mix of payment methods and statuses (recent orders still pending/paid)
+* open carts, some of them long abandoned
+
+Rows are written with ``executemany`` in large transactions with secondary
+indexes dropped during the load, so a multi-million-row database builds in
+minutes. Output is deterministic for a given ``--seed`` and ``--end``::
+
+    python benchmarks/generate_data.py --database /tmp/big.db --items 10000 --users 100000 --orders 1000000
+    python benchmarks/loadtest.py --database /tmp/big.db --reuse-db
+"""
+import argparse
+import bisect
+import itertools
+import math
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'  # what SQLAlchemy stores for DateTime on SQLite
+SHARED_PASSWORD = 'password'
+
+CATEGORIES = {
+    # category: (share of the menu, median price)
+    'Starters': (0.18, 7.0),
+    'Mains': (0.30, 16.0),
+    'Pizza': (0.10, 14.0),
+    'Sides': (0.12, 5.0),
+    'Desserts': (0.12, 8.0),
+    'Drinks': (0.15, 4.0),
+    'Specials': (0.03, 24.0),
+}
+ADJECTIVES = ('Spicy', 'Smoked', 'Crispy', 'Garlic', 'Tandoori', 'Classic', 'Grilled', 'Creamy', 'Herb',
+              'Masala', 'Honey', 'Lemon', 'Butter', 'Roasted', 'Peri Peri', 'Truffle', 'Chilli', 'Mango')
+NOUNS = ('Paneer', 'Chicken', 'Lamb', 'Prawn', 'Mushroom', 'Potato', 'Tofu', 'Salmon', 'Aubergine',
+         'Chickpea', 'Cauliflower', 'Beef', 'Halloumi', 'Spinach', 'Lentil', 'Corn', 'Duck', 'Okra')
+DISHES = {
+    'Starters': ('Tikka', 'Pakora', 'Wings', 'Soup', 'Bites', 'Skewers', 'Samosa'),
+    'Mains': ('Curry', 'Biryani', 'Korma', 'Bowl', 'Platter', 'Stew', 'Thali'),
+    'Pizza': ('Pizza', 'Flatbread', 'Calzone'),
+    'Sides': ('Naan', 'Rice', 'Fries', 'Salad', 'Raita', 'Slaw'),
+    'Desserts': ('Kulfi', 'Cheesecake', 'Brownie', 'Gulab Jamun', 'Sundae', 'Tart'),
+    'Drinks': ('Lassi', 'Lemonade', 'Iced Tea', 'Smoothie', 'Cooler', 'Chai'),
+    'Specials': ('Feast', 'Tasting Plate', 'Sharing Board'),
+}
+DESCRIPTION_WORDS = ('slow cooked', 'fresh', 'house spice blend', 'charred', 'tangy', 'aromatic', 'with mint chutney',
+                     'served hot', 'seasonal vegetables', 'hand made', 'rich tomato gravy', 'toasted cumin',
+                     'coriander', 'finished with butter', 'yoghurt marinade', 'clay oven', 'sweet and sour')
+
+# Relative order volume per hour of day: breakfast, a lunch peak and a bigger dinner peak
+HOUR_WEIGHTS = (1, 0.5, 0.2, 0.1, 0.1, 0.2, 0.5, 2, 4, 4, 5, 9, 16, 15, 8, 5, 5, 8, 14, 20, 19, 13, 7, 3)
+WEEKDAY_WEIGHTS = (0.85, 0.8, 0.85, 0.95, 1.3, 1.45, 1.1)  # Monday .. Sunday
+
+PAYMENT_METHODS = (('cod', 0.45), ('upi', 0.30), ('card', 0.20), ('netbanking', 0.05))
+COD_METHODS = (('cash', 0.6), ('upi', 0.4))
+LINES_PER_ORDER = ((1, 0.30), (2, 0.30), (3, 0.20), (4, 0.10), (5, 0.05), (6, 0.03), (8, 0.02))
+QUANTITIES = ((1, 0.72), (2, 0.20), (3, 0.05), (4, 0.02), (6, 0.01))
+
+
+class WeightedSampler:
+    """O(log n) sampling from fixed weights via a cumulative table."""
+
+    def __init__(self, values, weights):
+        self.values = list(values)
+        self.cumulative = list(itertools.accumulate(weights))
+        self.total = self.cumulative[-1]
+
+    def sample(self, rng):
+        return self.values[bisect.bisect_right(self.cumulative, rng.random() * self.total)]
+
+
+def zipf_sampler(values, exponent, rng):
+    """Popularity ~ 1 / rank**exponent, with ranks shuffled so popularity is unrelated to id."""
+    ranked = list(values)
+    rng.shuffle(ranked)
+    return WeightedSampler(ranked, (1 / (rank ** exponent) for rank in range(1, len(ranked) + 1)))
+
+
+def choice_table(pairs):
+    values, weights = zip(*pairs)
+    return WeightedSampler(values, weights)
+
+
+class Generator:
+    def __init__(self, conn, args, calculate_order_totals):
+        self.conn = conn
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.end = args.end
+        self.start = self.end - timedelta(days=args.days)
+        self.calculate_order_totals = calculate_order_totals
+        self.gst_percentage, self.discount_percentage = conn.execute(
+            'SELECT gst_percentage, discount_percentage FROM settings ORDER BY id LIMIT 1'
+        ).fetchone() or (18.0, 0.0)
+
+    def next_id(self, table):
+        return (self.conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM "{table}"').fetchone()[0]) + 1
+
+    def timestamp(self, moment):
+        return moment.strftime(DATETIME_FORMAT)
+
+    def insert(self, table, columns, rows):
+        """executemany() in transactions of --batch rows; returns the number of rows written."""
+        statement = (f'INSERT INTO "{table}" ({", ".join(columns)}) '
+                     f'VALUES ({", ".join("?" * len(columns))})')
+        written = 0
+        started = time.perf_counter()
+        iterator = iter(rows)
+        while True:
+            batch = list(itertools.islice(iterator, self.args.batch))
+            if not batch:
+                break
+            with self.conn:
+                self.conn.executemany(statement, batch)
+            written += len(batch)
+            rate = written / max(time.perf_counter() - started, 1e-9)
+            print(f'\r  {table}: {written:,} rows ({rate:,.0f}/s)', end='', flush=True)
+        print()
+        return written
+
+    # Menu
+
+    def menu_items(self, first_id):
+        rng = self.rng
+        categories = choice_table((name, share) for name, (share, _) in CATEGORIES.items())
+        self.items = {}  # id -> (name, price)
+        now = self.end
+        for item_id in range(first_id, first_id + self.args.items):
+            category = categories.sample(rng)
+            median = CATEGORIES[category][1]
+            price = round(max(median * math.exp(rng.gauss(0, 0.35)), 1.0), 2)
+            name = f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.choice(DISHES[category])}'
+            description = ', '.join(rng.sample(DESCRIPTION_WORDS, rng.randint(2, 4))).capitalize()
+            created = self.start - timedelta(days=rng.uniform(0, 365))
+
+            discount, discount_start, discount_end, current_price = 0.0, None, None, price
+            if rng.random() < self.args.discounted:
+                discount = float(rng.choice((5, 10, 15, 20, 25, 30)))
+                discount_start = now - timedelta(days=rng.uniform(0, 7))
+                discount_end = now + timedelta(days=rng.uniform(1, 14))
+                current_price = round(price * (1 - discount / 100), 2)
+
+            self.items[item_id] = (name, current_price)
+            yield (item_id, name, description, current_price, price, discount,
+                   discount_start and self.timestamp(discount_start),
+                   discount_end and self.timestamp(discount_end),
+                   category, None, self.timestamp(created), self.timestamp(created), 18.0)
+
+    # Users
+
+    def users(self, first_id, password):
+        rng = self.rng
+        for user_id in range(first_id, first_id + self.args.users):
+            created = self.start - timedelta(days=rng.uniform(0, 365)) + timedelta(days=rng.uniform(0, self.args.days))
+            yield (user_id, f'customer{user_id}', f'customer{user_id}@example.com', password, 0,
+                   self.timestamp(created), self.timestamp(created))
+
+    # Orders
+
+    def order_times(self):
+        """Every hour from --days ago up to --end: day weights (weekday factor) times hour-of-day weights.
+
+        Hours cut off by either end of the window are weighted by the part that falls inside it.
+        """
+        moments, weights = [], []
+        moment = self.start.replace(minute=0, second=0, microsecond=0)
+        while moment < self.end:
+            inside = min(moment + timedelta(hours=1), self.end) - max(moment, self.start)
+            moments.append(moment)
+            weights.append(HOUR_WEIGHTS[moment.hour] * WEEKDAY_WEIGHTS[moment.weekday()] * inside / timedelta(hours=1))
+            moment += timedelta(hours=1)
+        return WeightedSampler(moments, weights)
+
+    def orders(self, first_order_id, first_line_id, user_ids):
+        rng = self.rng
+        args = self.args
+        item_sampler = zipf_sampler(self.items, args.zipf, rng)
+        user_sampler = zipf_sampler(user_ids, args.user_skew, rng)
+        times = self.order_times()
+        payment_methods = choice_table(PAYMENT_METHODS)
+        cod_methods = choice_table(COD_METHODS)
+        lines_per_order = choice_table(LINES_PER_ORDER)
+        quantities = choice_table(QUANTITIES)
+        self.order_lines = []
+
+        line_id = first_line_id
+        for order_id in range(first_order_id, first_order_id + args.orders):
+            moment = times.sample(rng)
+            hour_start, hour_end = max(moment, self.start), min(moment + timedelta(hours=1), self.end)
+            created = hour_start + (hour_end - hour_start) * rng.random()
+            age = self.end - created
+
+            item_ids = set()
+            wanted = lines_per_order.sample(rng)
+            while len(item_ids) < min(wanted, len(self.items)):
+                item_ids.add(item_sampler.sample(rng))
+            lines = []
+            for item_id in sorted(item_ids):
+                name, price = self.items[item_id]
+                quantity = quantities.sample(rng)
+                lines.append((price, quantity))
+                self.order_lines.append((line_id, order_id, item_id, name, quantity, price, self.timestamp(created)))
+                line_id += 1
+
+            method = payment_methods.sample(rng)
+            # Recent orders are still open; the rest were completed or, occasionally, cancelled
+            if rng.random() < 0.03:
+                status = 'cancelled'
+                payment_status = 'refunded' if method != 'cod' else 'failed'
+            elif age < timedelta(hours=2):
+                status = 'pending' if method == 'cod' else rng.choice(('paid', 'paid', 'pending'))
+                payment_status = 'completed' if status == 'paid' else 'pending'
+            else:
+                status = 'completed'
+                payment_status = 'completed'
+            updated = created + timedelta(minutes=rng.uniform(0, 90)) if status != 'pending' else created
+            # Same arithmetic as checkout, so totals always match their lines
+            total = self.calculate_order_totals(
+                items=[{'price': price, 'quantity': quantity} for price, quantity in lines],
+                gst_percentage=self.gst_percentage,
+                discount_percentage=self.discount_percentage
+            ).total
+            yield (order_id, rng.choice(user_ids) if rng.random() < 0.2 else user_sampler.sample(rng),
+                   status, method, cod_methods.sample(rng) if method == 'cod' else None, payment_status,
+                   None if method == 'cod' else f'TXN{order_id:010d}', total,
+                   self.timestamp(created), self.timestamp(min(updated, self.end)))
+
+    def flush_order_lines(self):
+        lines, self.order_lines = self.order_lines, []
+        return lines
+
+    # Carts
+
+    def carts(self, first_cart_id, first_cart_item_id, user_ids):
+        rng = self.rng
+        item_sampler = zipf_sampler(self.items, self.args.zipf, rng)
+        existing = {user_id for (user_id,) in self.conn.execute('SELECT user_id FROM cart')}
+        candidates = [user_id for user_id in user_ids if user_id not in existing]
+        owners = rng.sample(candidates, min(self.args.carts, len(candidates)))
+        self.cart_items = []
+        cart_item_id = first_cart_item_id
+        for cart_id, user_id in enumerate(owners, first_cart_id):
+            # Most carts are fresh; a long tail was abandoned weeks ago
+            age = timedelta(minutes=rng.uniform(0, 120)) if rng.random() < 0.6 \
+                else timedelta(days=rng.uniform(1, min(self.args.days, 60)))
+            updated = self.end - age
+            for item_id in {item_sampler.sample(rng) for _ in range(rng.randint(1, 5))}:
+                self.cart_items.append((cart_item_id, cart_id, item_id, quantities_for_cart(rng),
+                                        self.timestamp(updated), self.timestamp(updated)))
+                cart_item_id += 1
+            yield cart_id, user_id, self.timestamp(updated - timedelta(minutes=rng.uniform(0, 30))), self.timestamp(updated)
+
+
+def quantities_for_cart(rng):
+    return 1 if rng.random() < 0.8 else rng.randint(2, 4)
+
+
+def create_schema(database):
+    """Let the app create its tables, indexes, FTS index and default rows in the target database."""
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    os.environ.setdefault('EVENT_BROKER_PATH', os.path.join(tempfile.mkdtemp(prefix='restaurant-gen-'), 'events.db'))
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    import app
+    app.scheduler.shutdown(wait=False)
+    with app.app.app_context():
+        app.db.engine.dispose()
+    return app.calculate_order_totals
+
+
+def secondary_indexes(conn, tables):
+    placeholders = ', '.join('?' * len(tables))
+    return conn.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+        f"AND tbl_name IN ({placeholders})", tables
+    ).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a large synthetic restaurant database')
+    parser.add_argument('--database', required=True, help='SQLite file to create or extend')
+    parser.add_argument('--force', action='store_true', help='delete --database first')
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--orders', type=int, default=1000000, help='orders (about 2.3 lines each)')
+    parser.add_argument('--carts', type=int, default=5000, help='open carts')
+    parser.add_argument('--days', type=int, default=180, help='history window for orders')
+    parser.add_argument('--end', type=lambda value: datetime.fromisoformat(value),
+                        default=datetime.utcnow().replace(minute=0, second=0, microsecond=0),
+                        help='end of the history window, ISO format (default: this hour, UTC)')
+    parser.add_argument('--zipf', type=float, default=1.1, help='item popularity exponent')
+    parser.add_argument('--user-skew', type=float, default=0.8, help='customer frequency exponent')
+    parser.add_argument('--discounted', type=float, default=0.05, help='share of items on discount')
+    parser.add_argument('--batch', type=int, default=100000, help='rows per transaction')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    database = os.path.abspath(args.database)
+    if args.force and os.path.exists(database):
+        os.remove(database)
+    started = time.perf_counter()
+    calculate_order_totals = create_schema(database)
+
+    conn = sqlite3.connect(database)
+    conn.execute('PRAGMA journal_mode = MEMORY')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')
+    conn.execute('PRAGMA temp_store = MEMORY')
+
+    # Rebuilding indexes once is much cheaper than maintaining them row by row
+    indexes = secondary_indexes(conn, ('order', 'order_item', 'cart_item'))
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX "{name}"')
+
+    generator = Generator(conn, args, calculate_order_totals)
+    print(f'Generating into {database} (seed {args.seed}, window ending {args.end.isoformat()})')
+
+    generator.insert('menu_item', (
+        'id', 'name', 'description', 'price', 'original_price', 'discount_percentage', 'discount_start',
+        'discount_end', 'category', 'image_path', 'created_at', 'updated_at', 'gst'
+    ), generator.menu_items(generator.next_id('menu_item')))
+
+    first_user_id = generator.next_id('user')
+    # One shared hash: hashing a password per row would dominate the build time
+    from werkzeug.security import generate_password_hash
+    generator.insert('user', ('id', 'username', 'email', 'password', 'is_admin', 'created_at', 'updated_at'),
+                     generator.users(first_user_id, generate_password_hash(SHARED_PASSWORD)))
+    user_ids = list(range(first_user_id, first_user_id + args.users))
+
+    order_columns = ('id', 'user_id', 'status', 'payment_method', 'cod_payment_method', 'payment_status',
+                     'payment_reference', 'total_amount', 'created_at', 'updated_at')
+    line_columns = ('id', 'order_id', 'menu_item_id', 'menu_item_name', 'quantity', 'price', 'created_at')
+    orders = generator.orders(generator.next_id('order'), generator.next_id('order_item'), user_ids)
+    order_count = line_count = 0
+    while True:
+        batch = list(itertools.islice(orders, args.batch))
+        if not batch:
+            break
+        lines = generator.flush_order_lines()
+        with conn:
+            conn.executemany(f'INSERT INTO "order" ({", ".join(order_columns)}) '
+                             f'VALUES ({", ".join("?" * len(order_columns))})', batch)
+            conn.executemany(f'INSERT INTO order_item ({", ".join(line_columns)}) '
+                             f'VALUES ({", ".join("?" * len(line_columns))})', lines)
+        order_count += len(batch)
+        line_count += len(lines)
+        elapsed = time.perf_counter() - started
+        print(f'\r  order: {order_count:,} orders, {line_count:,} lines ({elapsed:.0f}s)', end='', flush=True)
+    print()
+
+    carts = list(generator.carts(generator.next_id('cart'), generator.next_id('cart_item'), user_ids))
+    generator.insert('cart', ('id', 'user_id', 'created_at', 'updated_at'), carts)
+    generator.insert('cart_item', ('id', 'cart_id', 'menu_item_id', 'quantity', 'created_at', 'updated_at'),
+                     generator.cart_items)
+
+    print('  rebuilding indexes and statistics')
+    for _, sql in indexes:
+        conn.execute(sql)
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA journal_mode = DELETE')
+    conn.close()
+
+    size_mb = os.path.getsize(database) / 1024 / 1024
+    print(f'Done in {time.perf_counter() - started:.0f}s: {args.items:,} items, {args.users:,} users, '
+          f'{order_count:,} orders, {line_count:,} order lines, {len(carts):,} carts ({size_mb:,.0f} MB)')
+    print(f"Generated customers log in as customer<id>@example.com with password '{SHARED_PASSWORD}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,531 @@
+"""
+End-to-end load test.
+
+Starts the app (gunicorn when available, otherwise the Flask server) against
+a freshly seeded SQLite database and drives it with concurrent asyncio
+clients. Customers browse the menu, add and update cart lines and check out;
+admins poll the orders page. Each client picks its next scenario by weight.
+
+Reports requests per second, p50/p95/p99 latency and error rates per route
+(``database is locked`` responses are counted separately) and writes the
+results as JSON so runs can be compared::
+
+    python benchmarks/loadtest.py --clients 50 --duration 60
+    python benchmarks/loadtest.py --compare benchmarks/results/loadtest-<previous>.json
+    python benchmarks/loadtest.py --url http://localhost:8000   # an already running server
+
+Only the standard library is needed on the client side.
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter, defaultdict
+from datetime import datetime
+from urllib.parse import urlencode, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+CUSTOMER_PASSWORD = 'loadtest'
+ADMIN_EMAIL = os.getenv('ADMIN_EMAIL', 'admin@example.com')
+ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD', 'admin123')
+CATEGORIES = ('Starters', 'Mains', 'Desserts', 'Drinks', 'Sides', 'Specials')
+
+
+def seed(database_url, items, customers):
+    """Create menu items and customer accounts (runs in a child process that imports the app)."""
+    os.environ['DATABASE_URL'] = database_url
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    from werkzeug.security import generate_password_hash
+    from app import app, db, MenuItem, User
+
+    with app.app_context():
+        rng = random.Random(42)
+        missing_items = items - MenuItem.query.count()
+        if missing_items > 0:
+            prices = [round(rng.uniform(2, 40), 2) for _ in range(missing_items)]
+            db.session.execute(db.insert(MenuItem), [{
+                'name': f'Dish {n}',
+                'description': f'Load test dish number {n}',
+                'category': rng.choice(CATEGORIES),
+                'price': price,
+                'original_price': price,
+                'gst': 18.0
+            } for n, price in enumerate(prices)])
+        # One hash shared by every load test account keeps seeding fast
+        password = generate_password_hash(CUSTOMER_PASSWORD)
+        existing = {email for (email,) in db.session.query(User.email).filter(User.email.like('loaduser%'))}
+        new_users = [{
+            'username': f'loaduser{n}',
+            'email': f'loaduser{n}@example.com',
+            'password': password,
+            'is_admin': False
+        } for n in range(customers) if f'loaduser{n}@example.com' not in existing]
+        if new_users:
+            db.session.execute(db.insert(User), new_users)
+        db.session.commit()
+
+
+class HTTPClient:
+    """Minimal keep-alive HTTP/1.1 client with a cookie jar, built on asyncio streams."""
+
+    def __init__(self, host, port, timeout=30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.cookies = {}
+        self._reader = None
+        self._writer = None
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        self._reader = self._writer = None
+
+    async def request(self, method, path, json_body=None, form=None):
+        body = b''
+        headers = {'Host': f'{self.host}:{self.port}', 'User-Agent': 'restaurant-loadtest', 'Accept': '*/*'}
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            body = urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if body or method == 'POST':
+            headers['Content-Length'] = str(len(body))
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        raw = (f'{method} {path} HTTP/1.1\r\n'
+               + ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+               + '\r\n').encode() + body
+
+        for attempt in range(2):
+            reused = self._writer is not None
+            if not reused:
+                self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                self._writer.write(raw)
+                await self._writer.drain()
+                return await asyncio.wait_for(self._read_response(), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                await self.close()
+                # Only a kept-alive connection the server already closed is worth retrying
+                if not reused or attempt:
+                    raise
+
+    async def _read_response(self):
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionResetError('server closed the connection')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip().lower(), value.strip()
+            if name == 'set-cookie':
+                self._store_cookie(value)
+            else:
+                headers[name] = value
+
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self._reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await self._reader.readline()
+                    break
+                chunks.append(await self._reader.readexactly(size))
+                await self._reader.readline()
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await self._reader.readexactly(int(headers['content-length']))
+        else:
+            body = await self._reader.read()
+            keep_alive = False
+        if not keep_alive:
+            await self.close()
+        return status, headers, body
+
+    def _store_cookie(self, value):
+        cookie, _, attributes = value.partition(';')
+        name, _, cookie_value = cookie.strip().partition('=')
+        if not cookie_value or 'max-age=0' in attributes.lower():
+            self.cookies.pop(name, None)
+        else:
+            self.cookies[name] = cookie_value
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    return values[max(math.ceil(pct / 100 * len(values)) - 1, 0)]
+
+
+class Stats:
+    def __init__(self):
+        self.recording = False
+        self.started = None
+        self.stopped = None
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+
+    def record(self, route, elapsed, error=None):
+        if not self.recording:
+            return
+        self.latencies[route].append(elapsed)
+        if error:
+            self.errors[route][error] += 1
+
+    def summary(self):
+        duration = (self.stopped or time.perf_counter()) - self.started
+        routes = {}
+        for route in sorted(self.latencies):
+            latencies = sorted(self.latencies[route])
+            error_count = sum(self.errors[route].values())
+            routes[route] = {
+                'requests': len(latencies),
+                'rps': round(len(latencies) / duration, 2),
+                'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+                'max_ms': round(latencies[-1] * 1000, 2),
+                'error_rate': round(error_count / len(latencies), 4),
+                'errors': dict(self.errors[route])
+            }
+        total = sum(route['requests'] for route in routes.values())
+        errors = Counter()
+        for counter in self.errors.values():
+            errors.update(counter)
+        return {
+            'duration_s': round(duration, 2),
+            'requests': total,
+            'rps': round(total / duration, 2),
+            'error_rate': round(sum(errors.values()) / total, 4) if total else 0.0,
+            'errors': dict(errors),
+            'routes': routes
+        }
+
+
+def classify(status, body):
+    if status < 400:
+        return None
+    if b'database is locked' in body:
+        return 'database is locked'
+    return f'HTTP {status}'
+
+
+class VirtualUser:
+    def __init__(self, host, port, stats, rng, menu):
+        self.client = HTTPClient(host, port)
+        self.stats = stats
+        self.rng = rng
+        self.menu = menu
+        self.cart = {}  # menu_item_id -> quantity, as far as this client knows
+
+    async def call(self, route, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            status, headers, body = await self.client.request(method, path, **kwargs)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+            self.stats.record(route, time.perf_counter() - start, type(e).__name__)
+            return None, {}, b''
+        self.stats.record(route, time.perf_counter() - start, classify(status, body))
+        return status, headers, body
+
+    async def login(self, email, password, username=None):
+        status, headers, _ = await self.call('POST /login', 'POST', '/login',
+                                             form={'email': email, 'password': password})
+        if status == 302 and not headers.get('location', '').rstrip('/').endswith('/login'):
+            return True
+        if username is None:
+            return False
+        # Against an existing server the account may not exist yet
+        await self.call('POST /signup', 'POST', '/signup',
+                        form={'username': username, 'email': email, 'password': password})
+        status, headers, _ = await self.call('POST /login', 'POST', '/login',
+                                             form={'email': email, 'password': password})
+        return status == 302 and not headers.get('location', '').rstrip('/').endswith('/login')
+
+    # Customer scenarios
+
+    async def browse(self):
+        await self.call('GET /', 'GET', '/')
+        category = self.rng.choice(self.menu['categories'])
+        await self.call('GET /?category', 'GET', '/?' + urlencode({'category': category}))
+
+    async def add_to_cart(self):
+        item_id = self.rng.choice(self.menu['item_ids'])
+        quantity = self.rng.randint(1, 3)
+        status, _, _ = await self.call('POST /api/cart/add', 'POST', '/api/cart/add',
+                                       json_body={'menu_item_id': item_id, 'quantity': quantity})
+        if status == 200:
+            self.cart[item_id] = self.cart.get(item_id, 0) + quantity
+
+    async def update_cart(self):
+        if not self.cart:
+            return await self.add_to_cart()
+        item_id = self.rng.choice(list(self.cart))
+        quantity = self.rng.randint(0, 4)
+        status, _, _ = await self.call('POST /api/cart/update', 'POST', '/api/cart/update',
+                                       json_body={'menu_item_id': item_id, 'quantity': quantity})
+        if status == 200:
+            if quantity:
+                self.cart[item_id] = quantity
+            else:
+                self.cart.pop(item_id, None)
+        elif status == 404:
+            self.cart.pop(item_id, None)
+
+    async def checkout(self):
+        if not self.cart:
+            await self.add_to_cart()
+        await self.call('GET /payment-options', 'GET', '/payment-options')
+        method = self.rng.choice(('cod', 'cod', 'upi', 'card'))
+        details = {
+            'cod': {'cod_payment_method': self.rng.choice(('cash', 'upi'))},
+            'upi': {'upi_id': 'loadtest@upi'},
+            'card': {'card_number': '4111 1111 1111 1111', 'expiry': '12/30', 'cvv': '123', 'name': 'Load Test'}
+        }[method]
+        status, _, _ = await self.call('POST /api/process-payment', 'POST', '/api/process-payment',
+                                       json_body={'payment_method': method, 'payment_details': details})
+        if status in (200, 400):
+            self.cart.clear()
+
+    # Admin scenario
+
+    async def poll_orders(self):
+        await self.call('GET /admin/orders', 'GET', '/admin/orders')
+
+
+CUSTOMER_SCENARIOS = {
+    'browse': 40,
+    'add_to_cart': 30,
+    'update_cart': 15,
+    'checkout': 15,
+}
+
+
+async def run_customer(index, args, stats, menu, stop):
+    rng = random.Random(args.seed * 100003 + index)
+    user = VirtualUser(args.host, args.port, stats, rng, menu)
+    email = f'loaduser{index % args.customers}@example.com'
+    if not await user.login(email, CUSTOMER_PASSWORD, username=f'loaduser{index % args.customers}'):
+        print(f'customer {index}: login failed', file=sys.stderr)
+        return
+    names, weights = zip(*CUSTOMER_SCENARIOS.items())
+    try:
+        while not stop.is_set():
+            await getattr(user, rng.choices(names, weights)[0])()
+            if args.think_ms:
+                await asyncio.sleep(rng.expovariate(1000 / args.think_ms))
+    finally:
+        await user.client.close()
+
+
+async def run_admin(index, args, stats, menu, stop):
+    rng = random.Random(args.seed * 7919 + index)
+    user = VirtualUser(args.host, args.port, stats, rng, menu)
+    if not await user.login(ADMIN_EMAIL, ADMIN_PASSWORD):
+        print(f'admin {index}: login failed', file=sys.stderr)
+        return
+    try:
+        while not stop.is_set():
+            await user.poll_orders()
+            await asyncio.sleep(args.admin_poll_s)
+    finally:
+        await user.client.close()
+
+
+def load_menu(base_url):
+    item_ids, categories, page = [], set(), 1
+    while True:
+        with urllib.request.urlopen(f'{base_url}/api/menu?per_page=100&page={page}') as response:
+            data = json.load(response)
+        for item in data['items']:
+            item_ids.append(item['id'])
+            if item['category']:
+                categories.add(item['category'])
+        if not data['has_next']:
+            break
+        page += 1
+    if not item_ids:
+        raise SystemExit('The menu is empty; nothing to order')
+    return {'item_ids': item_ids, 'categories': sorted(categories) or ['']}
+
+
+async def run_load(args, menu):
+    stats = Stats()
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(run_customer(n, args, stats, menu, stop)) for n in range(args.clients)]
+    tasks += [asyncio.create_task(run_admin(n, args, stats, menu, stop)) for n in range(args.admin_clients)]
+
+    await asyncio.sleep(args.warmup)
+    stats.recording = True
+    stats.started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    stats.stopped = time.perf_counter()
+    stats.recording = False
+    stop.set()
+    await asyncio.wait(tasks, timeout=30)
+    return stats.summary()
+
+
+def wait_until_up(base_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit(f'Server exited with code {process.returncode}')
+        try:
+            urllib.request.urlopen(f'{base_url}/api/settings', timeout=2).close()
+            return
+        except OSError:
+            time.sleep(0.25)
+    raise SystemExit('Server did not come up in time')
+
+
+def start_server(args, env):
+    if shutil.which('gunicorn') and not args.flask_server:
+        command = ['gunicorn', '--workers', str(args.workers), '--threads', str(args.threads),
+                   '--bind', f'{args.host}:{args.port}', '--log-level', 'warning', 'app:app']
+    else:
+        command = [sys.executable, '-c',
+                   f"from app import app; app.run(host='{args.host}', port={args.port}, threaded=True)"]
+    log = open(os.path.join(args.work_dir, 'server.log'), 'w')
+    return command, subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, previous=None):
+    previous_routes = (previous or {}).get('summary', {}).get('routes', {})
+    print(f"\n{'route':<28} {'reqs':>7} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}")
+    for route, row in results['routes'].items():
+        line = (f"{route:<28} {row['requests']:>7} {row['rps']:>8.1f} {row['p50_ms']:>8.1f} "
+                f"{row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['error_rate']:>7.1%}")
+        before = previous_routes.get(route)
+        if before:
+            line += (f"   rps {row['rps'] - before['rps']:+.1f}"
+                     f"  p95 {row['p95_ms'] - before['p95_ms']:+.1f} ms")
+        print(line)
+    print(f"\ntotal: {results['requests']} requests in {results['duration_s']} s, "
+          f"{results['rps']} rps, error rate {results['error_rate']:.2%}")
+    for error, count in sorted(results['errors'].items(), key=lambda item: -item[1]):
+        print(f'  {count:>6}  {error}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the restaurant app with weighted scenarios')
+    parser.add_argument('--url', help='target an already running server instead of starting one')
+    parser.add_argument('--clients', type=int, default=50, help='concurrent customer clients')
+    parser.add_argument('--admin-clients', type=int, default=2)
+    parser.add_argument('--admin-poll-s', type=float, default=1.0)
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='unmeasured seconds before measuring')
+    parser.add_argument('--think-ms', type=float, default=0, help='mean pause between customer actions')
+    parser.add_argument('--items', type=int, default=200, help='menu items to seed')
+    parser.add_argument('--customers', type=int, default=100, help='customer accounts to seed')
+    parser.add_argument('--database', help='SQLite file to use (default: a new temporary one)')
+    parser.add_argument('--reuse-db', action='store_true', help='keep existing data in --database')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--flask-server', action='store_true', help='use the Flask server even if gunicorn exists')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='results file (default: benchmarks/results/loadtest-<time>.json)')
+    parser.add_argument('--compare', help='previous results file to diff against')
+    args = parser.parse_args()
+
+    process = None
+    server_command = None
+    args.work_dir = tempfile.mkdtemp(prefix='restaurant-loadtest-')
+    if args.url:
+        parts = urlsplit(args.url)
+        args.host, args.port = parts.hostname, parts.port or 80
+        base_url = args.url.rstrip('/')
+    else:
+        args.host = '127.0.0.1'
+        base_url = f'http://{args.host}:{args.port}'
+        database = os.path.abspath(args.database or os.path.join(args.work_dir, 'loadtest.db'))
+        if not args.reuse_db and os.path.exists(database):
+            os.remove(database)
+        # The server and the seed process share this run's cart store
+        os.environ['CART_STORE_PATH'] = os.path.join(args.work_dir, 'carts.db')
+        env = dict(os.environ,
+                   DATABASE_URL=f'sqlite:///{database}',
+                   EVENT_BROKER_PATH=os.path.join(args.work_dir, 'events.db'),
+                   METRICS_MULTIPROC_DIR=os.path.join(args.work_dir, 'metrics'),
+                   # every virtual user logs in from 127.0.0.1
+                   LOGIN_RATE_LIMIT=os.getenv('LOGIN_RATE_LIMIT', '1000000'),
+                   RATE_LIMIT_ENABLED=os.getenv('RATE_LIMIT_ENABLED', '0'))
+        seeder = multiprocessing.get_context('spawn').Process(
+            target=seed, args=(env['DATABASE_URL'], args.items, args.customers))
+        seeder.start()
+        seeder.join()
+        if seeder.exitcode:
+            raise SystemExit('Seeding failed')
+        server_command, process = start_server(args, env)
+
+    try:
+        wait_until_up(base_url, process)
+        menu = load_menu(base_url)
+        print(f"Target {base_url}: {len(menu['item_ids'])} items, {args.clients} customers, "
+              f"{args.admin_clients} admins, {args.duration}s after {args.warmup}s warm-up")
+        summary = asyncio.run(run_load(args, menu))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_report(summary, previous)
+
+    results = {
+        'timestamp': datetime.utcnow().isoformat(),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'server': ' '.join(server_command) if server_command else args.url,
+        'config': {key: value for key, value in vars(args).items() if key not in ('work_dir', 'compare', 'out')},
+        'scenario_weights': CUSTOMER_SCENARIOS,
+        'summary': summary
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"loadtest-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'\nResults written to {out}')
+    if process is not None:
+        print(f"Server log: {os.path.join(args.work_dir, 'server.log')}")
+
+
+if __name__ == '__main__':
+    main()
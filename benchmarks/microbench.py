@@ -0,0 +1,261 @@
+"""
+Microbenchmarks for hot pure-Python paths, template renders and PDF generation.
+
+Each benchmark is timed with ``timeit`` (auto-ranged loop count, best of
+``--repeat`` runs) and compared with the stored baselines in
+``benchmarks/baselines.json``. A benchmark that is slower than its baseline
+by more than ``--threshold`` (default 25%) is reported as a regression and
+the script exits non-zero::
+
+    python benchmarks/microbench.py                   # compare with the baselines
+    python benchmarks/microbench.py --filter render   # only the template renders
+    python benchmarks/microbench.py --save-baseline   # record new baselines
+
+Baselines are only meaningful on the machine that recorded them; re-record
+them after changing hardware or Python version.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baselines.json')
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a setup function; it receives the fixtures and returns the callable to time."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def load_app():
+    work_dir = tempfile.mkdtemp(prefix='restaurant-microbench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ['EVENT_BROKER_PATH'] = os.path.join(work_dir, 'events.db')
+    os.environ['CART_STORE_PATH'] = os.path.join(work_dir, 'carts.db')
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    import app
+    app.scheduler.shutdown(wait=False)
+    return app
+
+
+def build_fixtures(A):
+    """Large but fixed fixture data: 500 menu items, 500 orders, a 50-line order and a 50-line cart."""
+    db = A.db
+    rng = random.Random(7)
+    categories = ('Starters', 'Mains', 'Desserts', 'Drinks', 'Sides')
+
+    items = [A.MenuItem(name=f'Dish {n}', description=f'A tasty dish with ingredient {n}',
+                        price=round(rng.uniform(2, 40), 2), category=rng.choice(categories))
+             for n in range(500)]
+    for item in items[:50]:
+        item.apply_discount(20, 7)
+    db.session.add_all(items)
+
+    customer = A.User(username='bench', email='bench@example.com', password='x')
+    db.session.add(customer)
+    db.session.flush()
+
+    created = datetime.utcnow() - timedelta(days=1)
+    for n in range(500):
+        order = A.Order(user_id=customer.id, status=rng.choice(('pending', 'paid', 'completed')),
+                        payment_method='cod', total_amount=0, created_at=created + timedelta(minutes=n))
+        for item in rng.sample(items, 3):
+            order.items.append(A.OrderItem(menu_item_id=item.id, menu_item_name=item.name,
+                                           quantity=rng.randint(1, 3), price=item.price))
+        db.session.add(order)
+
+    large_order = A.Order(user_id=customer.id, status='paid', payment_method='card', total_amount=0)
+    for item in items[:50]:
+        large_order.items.append(A.OrderItem(menu_item_id=item.id, menu_item_name=item.name,
+                                             quantity=2, price=item.price))
+    db.session.add(large_order)
+
+    cart = A.Cart(user_id=customer.id)
+    db.session.add(cart)
+    db.session.flush()
+    for item in items[50:100]:
+        db.session.add(A.CartItem(cart_id=cart.id, menu_item_id=item.id, quantity=2))
+    db.session.commit()
+
+    admin = A.User.query.filter_by(is_admin=True).first()
+    return {
+        'app': A,
+        'items': A.MenuItem.query.all(),
+        'discounted_item': items[0],
+        'plain_item': items[-1],
+        'orders': A.Order.query.order_by(A.Order.created_at.desc()).all(),
+        'large_order': large_order,
+        'cart_items': A.CartItem.query.filter_by(cart_id=cart.id).all(),
+        'settings': A.Settings.get_settings(),
+        'admin': admin,
+        'customer': customer
+    }
+
+
+def _cart_lines(count):
+    rng = random.Random(count)
+    return [{'price': round(rng.uniform(1, 50), 2), 'quantity': rng.randint(1, 4)} for _ in range(count)]
+
+
+for _size in (1, 10, 100, 1000):
+    @benchmark(f'calculate_order_totals[{_size}]')
+    def _totals(fixtures, size=_size):
+        A = fixtures['app']
+        lines = _cart_lines(size)
+        return lambda: A.calculate_order_totals(lines, 18.0, 5.0)
+
+
+@benchmark('MenuItem.current_price[discounted]')
+def _current_price_discounted(fixtures):
+    item = fixtures['discounted_item']
+    return lambda: item.current_price
+
+
+@benchmark('MenuItem.current_price[plain]')
+def _current_price_plain(fixtures):
+    item = fixtures['plain_item']
+    return lambda: item.current_price
+
+
+@benchmark('MenuItem.has_active_discount')
+def _has_active_discount(fixtures):
+    item = fixtures['discounted_item']
+    return lambda: item.has_active_discount
+
+
+@benchmark('render index.html[500 items]')
+def _render_index(fixtures):
+    A = fixtures['app']
+    facets = A.get_category_facets()
+    context = dict(menu_items=fixtures['items'], categories=facets['categories'],
+                   total_items=facets['total_items'], current_category=None, search_query='')
+    return lambda: A.render_template('index.html', **context)
+
+
+@benchmark('render admin/orders.html[500 orders]')
+def _render_admin_orders(fixtures):
+    A = fixtures['app']
+    orders = fixtures['orders']
+    return lambda: A.render_template('admin/orders.html', orders=orders)
+
+
+def _totals_context(A, lines, settings):
+    totals = A.calculate_order_totals(lines, settings.gst_percentage, settings.discount_percentage)
+    return dict(subtotal=totals.subtotal, net_price=totals.net_price, gst_amount=totals.gst_amount,
+                discount_amount=totals.discount_amount, total=totals.total, settings=settings)
+
+
+@benchmark('render invoice.html[50 lines]')
+def _render_invoice(fixtures):
+    A = fixtures['app']
+    order = fixtures['large_order']
+    context = _totals_context(A, order.items, fixtures['settings'])
+    return lambda: A.render_template('invoice.html', order=order, **context)
+
+
+@benchmark('render payment_options.html[50 lines]')
+def _render_payment_options(fixtures):
+    A = fixtures['app']
+    cart_items = fixtures['cart_items']
+    lines = [{'price': item.menu_item.price, 'quantity': item.quantity} for item in cart_items]
+    context = _totals_context(A, lines, fixtures['settings'])
+    return lambda: A.render_template('payment_options.html', cart_items=cart_items, **context)
+
+
+@benchmark('build_item_invoice_pdf')
+def _invoice_pdf(fixtures):
+    A = fixtures['app']
+    item = fixtures['discounted_item']
+    return lambda: A.build_item_invoice_pdf(item, 'bench')
+
+
+def measure(func, repeat):
+    """Best per-call time over `repeat` runs of an auto-ranged (>= 0.2 s) loop."""
+    func()  # warm caches (templates, lazy loads) before timing
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.2f} {unit}'
+    return f'{seconds / 1e-9:.0f} ns'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run microbenchmarks and compare with stored baselines')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this text')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown before failing (0.25 = 25%%)')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baselines')
+    parser.add_argument('--list', action='store_true')
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if not args.filter or args.filter in name]
+    if args.list:
+        print('\n'.join(names))
+        return
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    machine = {'python': platform.python_version(), 'machine': platform.machine(), 'system': platform.system()}
+    if baselines and baselines.get('machine') != machine and not args.save_baseline:
+        print(f"warning: baselines were recorded on {baselines.get('machine')}, this is {machine}")
+
+    A = load_app()
+    results = {}
+    regressions = []
+    with A.app.app_context(), A.app.test_request_context('/'):
+        from flask_login import login_user
+        fixtures = build_fixtures(A)
+        login_user(fixtures['admin'])
+
+        print(f"{'benchmark':<42} {'time':>10} {'baseline':>10} {'change':>8}")
+        for name in names:
+            seconds = measure(BENCHMARKS[name](fixtures), args.repeat)
+            results[name] = seconds
+            baseline = baselines.get('results', {}).get(name)
+            change = f'{(seconds / baseline - 1) * 100:+.1f}%' if baseline else 'new'
+            flag = ''
+            if baseline and seconds > baseline * (1 + args.threshold):
+                regressions.append((name, seconds, baseline))
+                flag = '  << REGRESSION'
+            print(f"{name:<42} {format_time(seconds):>10} "
+                  f"{format_time(baseline) if baseline else '-':>10} {change:>8}{flag}")
+
+    if args.save_baseline:
+        stored = baselines.get('results', {}) if args.filter else {}
+        stored.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump({'recorded_at': datetime.utcnow().isoformat(timespec='seconds'), 'machine': machine,
+                       'results': dict(sorted(stored.items()))}, f, indent=2)
+            f.write('\n')
+        print(f'\nBaselines written to {args.baseline}')
+        return
+
+    if regressions:
+        print(f'\n{len(regressions)} benchmark(s) slower than baseline by more than {args.threshold:.0%}:')
+        for name, seconds, baseline in regressions:
+            print(f'  {name}: {format_time(baseline)} -> {format_time(seconds)} ({seconds / baseline:.2f}x)')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
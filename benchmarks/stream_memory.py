@@ -0,0 +1,150 @@
+"""
+Memory check for the streamed admin order views.
+
+Loads increasing numbers of orders into a temporary database and fetches
+``/admin/orders`` and ``/admin/orders/export.csv`` through the test client,
+consuming the body chunk by chunk. ``tracemalloc`` records the peak Python
+memory of each request, and time-to-first-byte is recorded too. For contrast,
+the same page is also rendered the old way: every order loaded with
+``.all()`` and the template rendered to a single string.
+
+The check fails (exit code 1) if the streamed peak at the largest size is
+more than ``--max-growth`` times the peak at the smallest size::
+
+    python benchmarks/stream_memory.py --sizes 1000 4000 16000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app():
+    work_dir = tempfile.mkdtemp(prefix='restaurant-stream-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, 'stream.db')}"
+    os.environ['EVENT_BROKER_PATH'] = os.path.join(work_dir, 'events.db')
+    os.environ['CART_STORE_PATH'] = os.path.join(work_dir, 'carts.db')
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    import app
+    app.scheduler.shutdown(wait=False)
+    return app
+
+
+def add_orders(A, count, first_id, user_id, rng):
+    """Bulk insert `count` orders with three lines each."""
+    db = A.db
+    created = datetime.utcnow() - timedelta(days=30)
+    orders, lines = [], []
+    for order_id in range(first_id, first_id + count):
+        orders.append({'id': order_id, 'user_id': user_id, 'status': rng.choice(('pending', 'paid', 'completed')),
+                       'payment_method': 'cod', 'payment_status': 'pending', 'total_amount': 42.5,
+                       'created_at': created + timedelta(seconds=order_id)})
+        for n in range(3):
+            lines.append({'order_id': order_id, 'menu_item_id': 1, 'menu_item_name': f'Dish {n}',
+                          'quantity': rng.randint(1, 3), 'price': 9.99})
+    db.session.execute(db.insert(A.Order), orders)
+    db.session.execute(db.insert(A.OrderItem), lines)
+    db.session.commit()
+
+
+def measure_streamed(client, path):
+    """Peak traced memory, time to first byte and body size while consuming a streamed response."""
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    response = client.get(path, buffered=False)
+    first_byte = None
+    size = 0
+    for chunk in response.response:
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        size += len(chunk)
+    response.close()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    return {'status': response.status_code, 'peak_mb': peak / 1024 / 1024, 'ttfb_ms': (first_byte or 0) * 1000,
+            'total_ms': elapsed * 1000, 'body_mb': size / 1024 / 1024}
+
+
+def measure_buffered(A, admin_id):
+    """The previous implementation: load every order, then render one big string."""
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    with A.app.test_request_context('/admin/orders'):
+        from flask_login import login_user
+        login_user(A.db.session.get(A.User, admin_id))
+        orders = A.Order.query.order_by(A.Order.created_at.desc()).all()
+        html = A.render_template('admin/orders.html', orders=orders)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    size = len(html)
+    del html, orders
+    A.db.session.remove()
+    return {'peak_mb': peak / 1024 / 1024, 'ttfb_ms': elapsed * 1000, 'total_ms': elapsed * 1000,
+            'body_mb': size / 1024 / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that streamed admin order views use bounded memory')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 3000, 9000])
+    parser.add_argument('--max-growth', type=float, default=1.5,
+                        help='allowed ratio of streamed peak memory between the largest and smallest size')
+    parser.add_argument('--skip-buffered', action='store_true', help='do not measure the old full render')
+    args = parser.parse_args()
+
+    A = load_app()
+    rng = random.Random(3)
+    with A.app.app_context():
+        admin_id = A.User.query.filter_by(is_admin=True).first().id
+        customer = A.User(username='stream', email='stream@example.com', password='x')
+        A.db.session.add(customer)
+        A.db.session.add(A.MenuItem(name='Dish', price=9.99, category='Mains'))
+        A.db.session.commit()
+        customer_id = customer.id
+
+    client = A.app.test_client()
+    client.post('/login', data={'email': os.getenv('ADMIN_EMAIL', 'admin@example.com'),
+                                'password': os.getenv('ADMIN_PASSWORD', 'admin123')})
+
+    tracemalloc.start()
+    rows = []
+    loaded = 0
+    print(f"{'orders':>8} {'view':<22} {'peak MB':>9} {'TTFB ms':>9} {'total ms':>9} {'body MB':>8}")
+    for size in sorted(args.sizes):
+        with A.app.app_context():
+            add_orders(A, size - loaded, loaded + 1, customer_id, rng)
+        loaded = size
+        results = {
+            'streamed page': measure_streamed(client, '/admin/orders'),
+            'streamed csv export': measure_streamed(client, '/admin/orders/export.csv'),
+        }
+        if not args.skip_buffered:
+            with A.app.app_context():
+                results['buffered page (old)'] = measure_buffered(A, admin_id)
+        for view, result in results.items():
+            print(f"{size:>8} {view:<22} {result['peak_mb']:>9.2f} {result['ttfb_ms']:>9.1f} "
+                  f"{result['total_ms']:>9.1f} {result['body_mb']:>8.2f}")
+        rows.append((size, results))
+    tracemalloc.stop()
+
+    failed = False
+    smallest, largest = rows[0][1], rows[-1][1]
+    for view in ('streamed page', 'streamed csv export'):
+        growth = largest[view]['peak_mb'] / max(smallest[view]['peak_mb'], 1e-6)
+        ok = growth <= args.max_growth
+        failed |= not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {view}: peak memory x{growth:.2f} from {rows[0][0]} to {rows[-1][0]} "
+              f"orders (limit x{args.max_growth})")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
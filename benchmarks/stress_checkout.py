@@ -0,0 +1,374 @@
+"""
+Concurrency stress test for the cart and checkout endpoints.
+
+Many processes, each running many threads, log in as the *same* customer (or
+a small pool of customers) and hammer ``/api/cart/add``, ``/api/cart/update``
+and ``/api/process-payment`` with a handful of hot items so that the
+read-modify-write paths collide. Requests that fail with ``database is
+locked`` (or another 5xx) are retried with exponential backoff.
+
+Reported per endpoint: throughput, latency percentiles, retries, and the
+server-side database time from the SQL profiler's ``X-SQL-Profile`` header,
+which under contention is dominated by SQLite lock waits.
+
+Afterwards the database is checked for invariants and the script exits
+non-zero if any is violated:
+
+* at most one cart per user and no duplicate (cart, menu item) lines
+* no order without items
+* every order total matches ``calculate_order_totals`` over its lines
+* every checkout that reported success produced an order with items
+
+::
+
+    python benchmarks/stress_checkout.py --processes 4 --threads 8 --duration 30
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import Counter, defaultdict
+from datetime import datetime
+from urllib.parse import urlencode
+
+from loadtest import CUSTOMER_PASSWORD, RESULTS_DIR, ROOT, git_revision, percentile, seed, start_server, wait_until_up
+
+OPERATIONS = {'add': 50, 'update': 25, 'checkout': 25}
+ROUTES = {'add': '/api/cart/add', 'update': '/api/cart/update', 'checkout': '/api/process-payment'}
+
+
+class Session:
+    """Keep-alive http.client connection with a cookie jar."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookies = {}
+        self.conn = None
+
+    def request(self, method, path, json_body=None, form=None):
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body)
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+                continue
+            for name, value in response.getheaders():
+                if name.lower() == 'set-cookie':
+                    cookie = value.split(';', 1)[0]
+                    key, _, cookie_value = cookie.partition('=')
+                    self.cookies[key.strip()] = cookie_value
+            if response.getheader('Connection', '').lower() == 'close':
+                self.conn.close()
+                self.conn = None
+            return response.status, response.getheader('X-SQL-Profile'), data
+
+
+def db_ms(profile_header):
+    for part in (profile_header or '').split(';'):
+        key, _, value = part.strip().partition('=')
+        if key == 'db_ms':
+            return float(value)
+    return None
+
+
+def run_thread(worker_id, args, menu_ids, results, lock, ready, go, state):
+    rng = random.Random(args.seed * 1000003 + worker_id)
+    session = Session(args.host, args.port)
+    user = worker_id % args.users
+    status, _, _ = session.request('POST', '/login', form={
+        'email': f'loaduser{user}@example.com', 'password': CUSTOMER_PASSWORD})
+    # Log in outside the measured window, then start together with every other thread
+    ready.wait()
+    if status != 302:
+        with lock:
+            results['login_failures'] += 1
+        return
+    go.wait()
+    deadline = state['deadline']
+
+    hot_items = menu_ids[:args.hot_items]
+    names, weights = zip(*OPERATIONS.items())
+    local = defaultdict(lambda: {'latencies': [], 'db_ms': [], 'retries': 0, 'gave_up': 0, 'locked': 0,
+                                 'statuses': Counter(), 'ok': 0})
+    orders = []
+    while time.monotonic() < deadline:
+        operation = rng.choices(names, weights)[0]
+        if operation == 'checkout':
+            body = {'payment_method': 'cod', 'payment_details': {'cod_payment_method': 'cash'}}
+        else:
+            body = {'menu_item_id': rng.choice(hot_items),
+                    'quantity': rng.randint(1, 3) if operation == 'add' else rng.randint(0, 3)}
+
+        stats = local[operation]
+        for attempt in range(args.retries + 1):
+            start = time.perf_counter()
+            try:
+                status, profile, data = session.request('POST', ROUTES[operation], json_body=body)
+            except (OSError, http.client.HTTPException) as e:
+                status, profile, data = type(e).__name__, None, b''
+            stats['latencies'].append(time.perf_counter() - start)
+            stats['statuses'][str(status)] += 1
+            if b'database is locked' in data:
+                stats['locked'] += 1
+            if db_ms(profile) is not None:
+                stats['db_ms'].append(db_ms(profile))
+            retryable = not isinstance(status, int) or status >= 500
+            if not retryable:
+                break
+            if attempt == args.retries:
+                stats['gave_up'] += 1
+                break
+            stats['retries'] += 1
+            time.sleep(args.backoff_ms / 1000 * (2 ** attempt) * rng.uniform(0.5, 1.5))
+
+        if status == 200:
+            stats['ok'] += 1
+            if operation == 'checkout':
+                try:
+                    orders.append(json.loads(data)['order_id'])
+                except (ValueError, KeyError):
+                    pass
+
+    with lock:
+        for operation, stats in local.items():
+            merged = results['operations'].setdefault(operation, {
+                'latencies': [], 'db_ms': [], 'retries': 0, 'gave_up': 0, 'locked': 0, 'statuses': Counter(), 'ok': 0})
+            merged['latencies'] += stats['latencies']
+            merged['db_ms'] += stats['db_ms']
+            merged['retries'] += stats['retries']
+            merged['gave_up'] += stats['gave_up']
+            merged['locked'] += stats['locked']
+            merged['statuses'].update(stats['statuses'])
+            merged['ok'] += stats['ok']
+        results['orders'] += orders
+
+
+def run_process(process_index, args, menu_ids, start_barrier, queue):
+    """One worker process: args.threads threads, released together with the other processes."""
+    results = {'operations': {}, 'orders': [], 'login_failures': 0}
+    lock = threading.Lock()
+    ready = threading.Barrier(args.threads + 1)
+    go = threading.Event()
+    state = {}
+    threads = [threading.Thread(target=run_thread, args=(process_index * args.threads + n, args, menu_ids,
+                                                         results, lock, ready, go, state))
+               for n in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    start_barrier.wait()
+    state['deadline'] = time.monotonic() + args.duration
+    go.set()
+    for thread in threads:
+        thread.join()
+    queue.put(results)
+
+
+def check_invariants(database_url, reported_orders, queue):
+    """Runs in a child process that imports the app to reuse its models and arithmetic."""
+    os.environ['DATABASE_URL'] = database_url
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    from sqlalchemy import func
+    from app import app, db, Cart, CartItem, Order, OrderItem, Settings, calculate_order_totals
+
+    violations = {}
+    with app.app_context():
+        duplicate_carts = db.session.query(Cart.user_id, func.count(Cart.id)).group_by(Cart.user_id) \
+            .having(func.count(Cart.id) > 1).all()
+        violations['duplicate_carts'] = [{'user_id': user_id, 'carts': count} for user_id, count in duplicate_carts]
+
+        duplicate_lines = db.session.query(CartItem.cart_id, CartItem.menu_item_id, func.count(CartItem.id)) \
+            .group_by(CartItem.cart_id, CartItem.menu_item_id).having(func.count(CartItem.id) > 1).all()
+        violations['duplicate_cart_lines'] = [{'cart_id': cart_id, 'menu_item_id': item_id, 'lines': count}
+                                              for cart_id, item_id, count in duplicate_lines]
+
+        empty_orders = db.session.query(Order.id).outerjoin(OrderItem, OrderItem.order_id == Order.id) \
+            .filter(OrderItem.id.is_(None)).all()
+        violations['orders_without_items'] = [order_id for (order_id,) in empty_orders]
+
+        settings = Settings.get_settings()
+        lines = defaultdict(list)
+        for order_id, price, quantity in db.session.query(OrderItem.order_id, OrderItem.price, OrderItem.quantity):
+            lines[order_id].append({'price': price, 'quantity': quantity})
+        mismatched = []
+        order_count = 0
+        for order_id, total in db.session.query(Order.id, Order.total_amount):
+            order_count += 1
+            if not lines[order_id]:
+                continue
+            expected = calculate_order_totals(lines[order_id], settings.gst_percentage,
+                                              settings.discount_percentage).total
+            if abs(expected - total) > 0.005:
+                mismatched.append({'order_id': order_id, 'total': total, 'expected': expected})
+        violations['order_total_mismatch'] = mismatched
+
+        missing = set(reported_orders) - {order_id for order_id, items in lines.items() if items}
+        violations['reported_orders_missing'] = sorted(missing)
+
+    queue.put({'orders_in_db': order_count, 'violations': violations})
+
+
+def summarize(results, duration):
+    summary = {}
+    for operation, stats in sorted(results['operations'].items()):
+        latencies = sorted(stats['latencies'])
+        db_times = sorted(stats['db_ms'])
+        attempts = len(latencies)
+        summary[operation] = {
+            'attempts': attempts,
+            'succeeded': stats['ok'],
+            'throughput_per_s': round(stats['ok'] / duration, 2),
+            'retries': stats['retries'],
+            'gave_up': stats['gave_up'],
+            'database_locked': stats['locked'],
+            'statuses': dict(stats['statuses']),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+            'db_ms_p50': percentile(db_times, 50),
+            'db_ms_p99': percentile(db_times, 99),
+            'db_ms_total': round(sum(db_times), 1),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress the cart and checkout endpoints for one user')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8, help='threads per process')
+    parser.add_argument('--users', type=int, default=1, help='customers the threads share (1 = all the same)')
+    parser.add_argument('--hot-items', type=int, default=3, help='distinct items the clients fight over')
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--backoff-ms', type=float, default=50)
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--threads-per-worker', dest='server_threads', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--flask-server', action='store_true')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='results file (default: benchmarks/results/stress-<time>.json)')
+    args = parser.parse_args()
+
+    args.host = '127.0.0.1'
+    args.work_dir = tempfile.mkdtemp(prefix='restaurant-stress-')
+    database_url = f"sqlite:///{os.path.join(args.work_dir, 'stress.db')}"
+    # The server and the seed/check processes share this run's cart store
+    os.environ['CART_STORE_PATH'] = os.path.join(args.work_dir, 'carts.db')
+    env = dict(os.environ, DATABASE_URL=database_url, SQL_PROFILER='1',
+               SQL_SLOW_QUERY_MS='100000',
+               EVENT_BROKER_PATH=os.path.join(args.work_dir, 'events.db'),
+               LOGIN_RATE_LIMIT=os.getenv('LOGIN_RATE_LIMIT', '1000000'),
+               RATE_LIMIT_ENABLED=os.getenv('RATE_LIMIT_ENABLED', '0'))
+
+    context = multiprocessing.get_context('spawn')
+    seeder = context.Process(target=seed, args=(database_url, max(args.hot_items, 10), args.users))
+    seeder.start()
+    seeder.join()
+    if seeder.exitcode:
+        raise SystemExit('Seeding failed')
+
+    base_url = f'http://{args.host}:{args.port}'
+    server_command, server = start_server(argparse.Namespace(
+        workers=args.workers, threads=args.server_threads, host=args.host, port=args.port,
+        flask_server=args.flask_server, work_dir=args.work_dir), env)
+    try:
+        wait_until_up(base_url, server)
+        with urllib.request.urlopen(f'{base_url}/api/menu?per_page=100') as response:
+            menu_ids = sorted(item['id'] for item in json.load(response)['items'])
+
+        print(f'{args.processes} processes x {args.threads} threads on {args.users} user(s), '
+              f'{args.hot_items} hot items, {args.duration}s against {" ".join(server_command)}')
+        queue = context.Queue()
+        start_barrier = context.Barrier(args.processes)
+        workers = [context.Process(target=run_process, args=(n, args, menu_ids, start_barrier, queue))
+                   for n in range(args.processes)]
+        for worker in workers:
+            worker.start()
+        partials = [queue.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    results = {'operations': {}, 'orders': [], 'login_failures': 0}
+    for partial in partials:
+        results['login_failures'] += partial['login_failures']
+        results['orders'] += partial['orders']
+        for operation, stats in partial['operations'].items():
+            merged = results['operations'].setdefault(operation, {
+                'latencies': [], 'db_ms': [], 'retries': 0, 'gave_up': 0, 'locked': 0, 'statuses': Counter(), 'ok': 0})
+            for key in ('latencies', 'db_ms'):
+                merged[key] += stats[key]
+            for key in ('retries', 'gave_up', 'locked', 'ok'):
+                merged[key] += stats[key]
+            merged['statuses'].update(stats['statuses'])
+
+    checker_queue = context.Queue()
+    checker = context.Process(target=check_invariants, args=(database_url, results['orders'], checker_queue))
+    checker.start()
+    invariants = checker_queue.get()
+    checker.join()
+
+    summary = summarize(results, args.duration)
+    print(f"\n{'operation':<10} {'ok/s':>7} {'attempts':>9} {'retries':>8} {'locked':>7} {'gave up':>8} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'db p50':>8} {'db p99':>8}")
+    for operation, row in summary.items():
+        print(f"{operation:<10} {row['throughput_per_s']:>7.1f} {row['attempts']:>9} {row['retries']:>8} "
+              f"{row['database_locked']:>7} {row['gave_up']:>8} {row['p50_ms']:>8} {row['p99_ms']:>8} "
+              f"{row['db_ms_p50'] if row['db_ms_p50'] is not None else '-':>8} "
+              f"{row['db_ms_p99'] if row['db_ms_p99'] is not None else '-':>8}")
+        print(f"{'':<10} statuses: {row['statuses']}")
+    if results['login_failures']:
+        print(f"login failures: {results['login_failures']}")
+
+    violated = {name: found for name, found in invariants['violations'].items() if found}
+    print(f"\n{len(results['orders'])} successful checkouts, {invariants['orders_in_db']} orders in the database")
+    for name in invariants['violations']:
+        found = invariants['violations'][name]
+        print(f"  {'FAIL' if found else 'ok  '} {name}" + (f': {len(found)} ({found[:3]}...)' if found else ''))
+
+    out = args.out or os.path.join(RESULTS_DIR, f"stress-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump({
+            'timestamp': datetime.utcnow().isoformat(),
+            'git_revision': git_revision(),
+            'server': ' '.join(server_command),
+            'config': {key: value for key, value in vars(args).items() if key not in ('work_dir', 'out')},
+            'operations': summary,
+            'successful_checkouts': len(results['orders']),
+            'invariants': invariants
+        }, f, indent=2)
+    print(f'\nResults written to {out}')
+    sys.exit(1 if violated else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""
+Write-behind store for shopping carts.
+
+Cart clicks only touch a fast local tier; the ``cart``/``cart_item`` tables
+are brought up to date by ``CartStore.flush()``, which the app runs in the
+background every few seconds in one batched transaction, and checkout takes
+the cart straight out of the store.
+
+Two backends keep the hot tier:
+
+``MemoryBackend``
+    A dict in the worker process, with every change appended to a JSON-lines
+    journal first. On start-up the journal is replayed, so carts that were
+    not flushed yet survive a crash or restart. Only correct with a single
+    worker process.
+
+``SQLiteKVBackend``
+    A small key-value table in a local SQLite file (WAL), shared by every
+    worker process on the host. The file is its own journal.
+
+Carts are loaded from the database on first use and dropped from the hot
+tier once they are flushed and unchanged, so it only holds active carts.
+"""
+import json
+import os
+import sqlite3
+import threading
+
+
+class MemoryBackend:
+    def __init__(self, journal_path=None, fsync=False):
+        self.journal_path = journal_path
+        self.fsync = fsync
+        self._carts = {}  # user_id -> [lines, version, dirty]
+        self._lock = threading.Lock()
+        self._journal = None
+        if journal_path:
+            self._replay()
+            self._journal = open(journal_path, 'a', encoding='utf-8')
+
+    def _replay(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # torn last write
+                if record['lines'] is None:
+                    self._carts.pop(record['user'], None)
+                else:
+                    lines = {int(k): v for k, v in record['lines'].items()}
+                    self._carts[record['user']] = [lines, record['version'], True]
+
+    def _log(self, user_id, lines, version):
+        if self._journal is None:
+            return
+        self._journal.write(json.dumps({'user': user_id, 'lines': lines, 'version': version}) + '\n')
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._carts.get(user_id)
+            return dict(entry[0]) if entry else None
+
+    def insert_clean(self, user_id, lines):
+        with self._lock:
+            self._carts.setdefault(user_id, [dict(lines), 0, False])
+
+    def update(self, user_id, change):
+        """Apply `change(lines)` (mutating in place) atomically; returns (old lines, new lines), or None if not loaded."""
+        with self._lock:
+            entry = self._carts.get(user_id)
+            if entry is None:
+                return None
+            old = dict(entry[0])
+            change(entry[0])
+            entry[1] += 1
+            entry[2] = True
+            self._log(user_id, entry[0], entry[1])
+            return old, dict(entry[0])
+
+    def dirty(self):
+        with self._lock:
+            return {user_id: (dict(lines), version)
+                    for user_id, (lines, version, dirty) in self._carts.items() if dirty}
+
+    def evict(self, user_id, version):
+        """Drop a flushed cart unless it changed since `version` was read."""
+        with self._lock:
+            entry = self._carts.get(user_id)
+            if entry is not None and entry[1] == version:
+                del self._carts[user_id]
+                self._log(user_id, None, version)
+
+    def trim(self):
+        """Forget clean carts and rewrite the journal with only the ones that still need flushing."""
+        with self._lock:
+            for user_id in [user_id for user_id, entry in self._carts.items() if not entry[2]]:
+                del self._carts[user_id]
+            if self._journal is None:
+                return
+            tmp_path = self.journal_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for user_id, (lines, version, dirty) in self._carts.items():
+                    if dirty:
+                        f.write(json.dumps({'user': user_id, 'lines': lines, 'version': version}) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal.close()
+            os.replace(tmp_path, self.journal_path)
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def __len__(self):
+        return len(self._carts)
+
+
+class SQLiteKVBackend:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS cart_store ('
+            'user_id INTEGER PRIMARY KEY, lines TEXT NOT NULL, version INTEGER NOT NULL, dirty INTEGER NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')  # durable across process crashes; fsync at checkpoints
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _decode(text):
+        return {int(k): v for k, v in json.loads(text).items()}
+
+    def get(self, user_id):
+        row = self._connect().execute('SELECT lines FROM cart_store WHERE user_id = ?', (user_id,)).fetchone()
+        return self._decode(row[0]) if row else None
+
+    def insert_clean(self, user_id, lines):
+        self._connect().execute('INSERT OR IGNORE INTO cart_store (user_id, lines, version, dirty) VALUES (?, ?, 0, 0)',
+                                (user_id, json.dumps(lines)))
+
+    def update(self, user_id, change):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT lines, version FROM cart_store WHERE user_id = ?', (user_id,)).fetchone()
+            if row is None:
+                conn.execute('ROLLBACK')
+                return None
+            text, version = row
+            lines = self._decode(text)
+            old = dict(lines)
+            change(lines)
+            conn.execute('UPDATE cart_store SET lines = ?, version = ?, dirty = 1 WHERE user_id = ?',
+                         (json.dumps(lines), version + 1, user_id))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return old, lines
+
+    def dirty(self):
+        rows = self._connect().execute('SELECT user_id, lines, version FROM cart_store WHERE dirty = 1').fetchall()
+        return {user_id: (self._decode(text), version) for user_id, text, version in rows}
+
+    def evict(self, user_id, version):
+        self._connect().execute('DELETE FROM cart_store WHERE user_id = ? AND version = ?', (user_id, version))
+
+    def trim(self):
+        self._connect().execute('DELETE FROM cart_store WHERE dirty = 0')
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM cart_store').fetchone()[0]
+
+
+class CartStore:
+    """Carts as {menu_item_id: quantity}, keyed by user id.
+
+    `loader(user_id)` reads a cart from the database; `writer({user_id: lines})`
+    replaces the stored carts of those users in one transaction.
+    """
+
+    def __init__(self, backend, loader, writer):
+        self.backend = backend
+        self.loader = loader
+        self.writer = writer
+        self._flush_lock = threading.Lock()
+
+    def _ensure(self, user_id):
+        lines = self.backend.get(user_id)
+        if lines is None:
+            lines = self.loader(user_id)
+            self.backend.insert_clean(user_id, lines)
+        return lines
+
+    def get(self, user_id):
+        return self._ensure(user_id)
+
+    def _update(self, user_id, change):
+        while True:
+            self._ensure(user_id)
+            result = self.backend.update(user_id, change)
+            if result is not None:  # else flushed and evicted in between; load it again
+                return result
+
+    def add(self, user_id, menu_item_id, quantity=1):
+        """Add to an item's quantity; returns the new cart."""
+        def change(lines):
+            lines[menu_item_id] = lines.get(menu_item_id, 0) + quantity
+            if lines[menu_item_id] <= 0:
+                del lines[menu_item_id]
+        return self._update(user_id, change)[1]
+
+    def set(self, user_id, menu_item_id, quantity):
+        """Set an item's quantity (0 or less removes it); returns the new cart."""
+        def change(lines):
+            if quantity > 0:
+                lines[menu_item_id] = quantity
+            else:
+                lines.pop(menu_item_id, None)
+        return self._update(user_id, change)[1]
+
+    def clear(self, user_id):
+        self._update(user_id, dict.clear)
+
+    def take(self, user_id):
+        """Empty the cart and return what was in it, atomically (for checkout)."""
+        return self._update(user_id, dict.clear)[0]
+
+    def restore(self, user_id, lines):
+        """Put lines from a failed checkout back into the cart."""
+        def change(current):
+            for menu_item_id, quantity in lines.items():
+                current[menu_item_id] = current.get(menu_item_id, 0) + quantity
+        self._update(user_id, change)
+
+    def flush(self):
+        """Write every changed cart to the database; returns how many were written."""
+        with self._flush_lock:
+            dirty = self.backend.dirty()
+            if not dirty:
+                self.backend.trim()
+                return 0
+            self.writer({user_id: lines for user_id, (lines, _) in dirty.items()})
+            for user_id, (_, version) in dirty.items():
+                self.backend.evict(user_id, version)
+            self.backend.trim()
+            return len(dirty)
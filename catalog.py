@@ -0,0 +1,69 @@
+"""
+Precomputed menu category facets.
+
+The facet list (categories with item and active-discount counts) is built
+with a single GROUP BY query and then served from memory. It is rebuilt when
+it is invalidated after a menu write, when the next scheduled discount starts
+or ends, or after ``max_age`` seconds as a safety net.
+"""
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import case, func
+
+
+class CategoryFacets:
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._facets = None
+        self._built_at = 0.0
+        self._expires_at = None  # next discount start/end, naive UTC
+
+    def invalidate(self):
+        with self._lock:
+            self._facets = None
+
+    def get(self, session, model):
+        """Return the cached facets, rebuilding them if they are stale."""
+        facets = self._facets
+        if facets is not None and not self._is_stale():
+            return facets
+        with self._lock:
+            if self._facets is None or self._is_stale():
+                self._facets = self._build(session, model)
+            return self._facets
+
+    def _is_stale(self):
+        if time.monotonic() - self._built_at > self.max_age:
+            return True
+        return self._expires_at is not None and datetime.utcnow() >= self._expires_at
+
+    def _build(self, session, model):
+        now = datetime.utcnow()
+        rows = session.query(
+            model.category,
+            func.count(model.id),
+            func.sum(case((model.has_active_discount, 1), else_=0))
+        ).group_by(model.category).all()
+
+        # The counts change by themselves when a discount window opens or closes
+        next_start, next_end = session.query(
+            func.min(case((model.discount_start > now, model.discount_start))),
+            func.min(case((model.discount_end >= now, model.discount_end)))
+        ).filter(model.discount_percentage > 0).one()
+        transitions = [moment for moment in (next_start, next_end) if moment is not None]
+
+        categories = sorted((
+            {'name': category, 'item_count': item_count, 'discount_count': int(discount_count or 0)}
+            for category, item_count, discount_count in rows if category
+        ), key=lambda facet: facet['name'].lower())
+
+        self._built_at = time.monotonic()
+        self._expires_at = min(transitions) if transitions else None
+        return {
+            'categories': categories,
+            'total_items': sum(item_count for _, item_count, _ in rows),
+            'discounted_items': sum(int(discount_count or 0) for _, _, discount_count in rows)
+        }
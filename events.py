@@ -0,0 +1,279 @@
+"""
+Order event hub used by the live admin/kitchen screens.
+
+Events are appended to a small SQLite notify table (the "broker"). Every
+process runs one poller thread that reads new rows and fans them out to the
+Server-Sent Events subscribers connected to that process, so an order placed
+on one gunicorn worker reaches tablets connected to any other worker. The
+autoincrement row id doubles as the SSE event id, which is what makes
+``Last-Event-ID`` resume work across reconnects and workers. A client whose
+resume point has already been trimmed from the log gets a ``reload`` event
+instead of a replay with a gap in it.
+"""
+import json
+import queue
+import sqlite3
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+Event = namedtuple('Event', ['id', 'type', 'data', 'created_at'])
+
+
+class SQLiteBroker:
+    """Append-only event log shared by all processes through one SQLite file."""
+
+    def __init__(self, path, retention=1000):
+        self.path = path
+        self.retention = retention
+        self._local = threading.local()
+        self._publish_counts = {}  # channel -> events published by this process
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS event_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                type TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_event_log_channel_id ON event_log (channel, id)')
+        # Highest id trimmed from each channel; a client resuming from before it has missed events
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS event_trim (
+                channel TEXT PRIMARY KEY,
+                trimmed_to INTEGER NOT NULL
+            )
+        ''')
+
+    def _connect(self):
+        # One connection per thread; autocommit so readers never hold a lock
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def publish(self, channel, event_type, data):
+        conn = self._connect()
+        cursor = conn.execute(
+            'INSERT INTO event_log (channel, type, payload, created_at) VALUES (?, ?, ?, ?)',
+            (channel, event_type, json.dumps(data), datetime.utcnow().isoformat())
+        )
+        event_id = cursor.lastrowid
+        self._count(conn, channel, 1)
+        return event_id
+
+    def publish_many(self, channel, events):
+        """Append several (type, data) events in one transaction; returns the last event id."""
+        conn = self._connect()
+        now = datetime.utcnow().isoformat()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT INTO event_log (channel, type, payload, created_at) VALUES (?, ?, ?, ?)',
+                [(channel, event_type, json.dumps(data), now) for event_type, data in events]
+            )
+            event_id = conn.execute('SELECT MAX(id) FROM event_log WHERE channel = ?', (channel,)).fetchone()[0]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._count(conn, channel, len(events))
+        return event_id
+
+    def _count(self, conn, channel, published):
+        # Trim old rows now and then so each channel keeps its newest `retention` events; a bulk
+        # publish can jump past a multiple of 100, so trim whenever the count crosses one
+        before = self._publish_counts.get(channel, 0)
+        self._publish_counts[channel] = before + published
+        if before // 100 != (before + published) // 100:
+            self._trim(conn, channel)
+
+    def _trim(self, conn, channel):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT id FROM event_log WHERE channel = ? ORDER BY id DESC LIMIT 1 OFFSET ?',
+                (channel, self.retention)
+            ).fetchone()
+            if row is not None:
+                conn.execute('DELETE FROM event_log WHERE channel = ? AND id <= ?', (channel, row[0]))
+                conn.execute(
+                    'INSERT INTO event_trim (channel, trimmed_to) VALUES (?, ?) '
+                    'ON CONFLICT (channel) DO UPDATE SET trimmed_to = MAX(trimmed_to, excluded.trimmed_to)',
+                    (channel, row[0])
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def fetch(self, channel, after_id, limit=500):
+        rows = self._connect().execute(
+            'SELECT id, type, payload, created_at FROM event_log '
+            'WHERE channel = ? AND id > ? ORDER BY id LIMIT ?',
+            (channel, after_id, limit)
+        ).fetchall()
+        return [Event(row[0], row[1], json.loads(row[2]), row[3]) for row in rows]
+
+    def oldest_id(self, channel):
+        """Lowest id a client of `channel` can resume from; the channel's events before it were trimmed."""
+        row = self._connect().execute(
+            'SELECT trimmed_to FROM event_trim WHERE channel = ?', (channel,)
+        ).fetchone()
+        return (row[0] if row else 0) + 1
+
+    def last_id(self, channel):
+        row = self._connect().execute(
+            'SELECT MAX(id) FROM event_log WHERE channel = ?', (channel,)
+        ).fetchone()
+        return row[0] or 0
+
+
+class Subscription:
+    """A single connected client. Events are delivered through a bounded queue."""
+
+    def __init__(self, max_queue):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.last_id = 0
+        self.backlog = []
+        self.overflowed = False
+
+    def listen(self, heartbeat=15):
+        """Yield replayed events, then live ones; yields None on idle heartbeat."""
+        for event in self.backlog:
+            self.last_id = event.id
+            yield event
+        self.backlog = []
+
+        while not self.overflowed:
+            try:
+                event = self.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield None
+                continue
+            if event is None or event.id <= self.last_id:
+                continue
+            self.last_id = event.id
+            yield event
+
+
+class EventHub:
+    """In-process pub/sub on top of a broker shared with other processes."""
+
+    def __init__(self, broker, channel='orders', poll_interval=0.5, max_queue=1000):
+        self.broker = broker
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.max_queue = max_queue
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._poller = None
+        self._position = 0  # id of the last event handed to subscribers
+        self._listeners = []
+
+    def publish(self, event_type, data):
+        event_id = self.broker.publish(self.channel, event_type, data)
+        self._wake.set()
+        return event_id
+
+    def publish_many(self, events):
+        if not events:
+            return None
+        event_id = self.broker.publish_many(self.channel, events)
+        self._wake.set()
+        return event_id
+
+    def add_listener(self, callback):
+        """Call ``callback(event)`` on the poller thread for every event, from any process."""
+        self._listeners.append(callback)
+        self._ensure_poller()
+
+    def subscribe(self, last_event_id=None):
+        subscription = Subscription(self.max_queue)
+        self._ensure_poller()
+        with self._lock:
+            self._subscribers.add(subscription)
+            live_from = self._position  # the live queue gets every event after this one
+
+        # Replay everything the client missed up to where the live queue starts;
+        # duplicates are dropped by Subscription.listen() using the event id
+        try:
+            after_id = int(last_event_id) if last_event_id else None
+        except (TypeError, ValueError):
+            after_id = None
+        if after_id is None or after_id >= live_from:
+            return subscription
+        backlog = []
+        while after_id < live_from:
+            events = self.broker.fetch(self.channel, after_id)
+            backlog.extend(event for event in events if event.id <= live_from)
+            if not events:
+                break
+            after_id = events[-1].id
+        if int(last_event_id) + 1 < self.broker.oldest_id(self.channel):
+            # Some of the missed events were trimmed already; a partial replay would look complete
+            backlog = [Event(live_from, 'reload', {'reason': 'missed events were trimmed'},
+                             datetime.utcnow().isoformat())]
+        subscription.backlog = backlog
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _ensure_poller(self):
+        if self._poller is not None:
+            return
+        with self._lock:
+            if self._poller is None:
+                # Fix the start position before returning so callers know which events they will see
+                last_id = self._position = self.broker.last_id(self.channel)
+                self._poller = threading.Thread(target=self._poll_loop, args=(last_id,),
+                                                name='event-hub-poller', daemon=True)
+                self._poller.start()
+
+    def _poll_loop(self, last_id, batch=500):
+        behind = False
+        while True:
+            if not behind:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+            try:
+                events = self.broker.fetch(self.channel, last_id, limit=batch)
+            except sqlite3.Error:
+                behind = False
+                continue
+            behind = len(events) == batch  # more are waiting; fetch them without sleeping
+            if not events:
+                continue
+            last_id = events[-1].id
+
+            for listener in self._listeners:
+                for event in events:
+                    try:
+                        listener(event)
+                    except Exception:
+                        pass
+
+            with self._lock:
+                subscribers = list(self._subscribers)
+                self._position = last_id  # later subscribers replay up to here from the log
+            for subscription in subscribers:
+                for event in events:
+                    try:
+                        subscription.queue.put_nowait(event)
+                    except queue.Full:
+                        # Slow client: cut it loose, it will reconnect and resume
+                        subscription.overflowed = True
+                        self.unsubscribe(subscription)
+                        break
+
+
+def format_sse(event):
+    """Serialize an Event in the text/event-stream wire format."""
+    return f"id: {event.id}\nevent: {event.type}\ndata: {json.dumps(event.data)}\n\n"
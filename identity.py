@@ -0,0 +1,89 @@
+"""
+In-process cache of logged-in user identities.
+
+Flask-Login calls the user loader on every authenticated request.
+``IdentityCache`` keeps a small, immutable ``UserIdentity`` (id, username,
+email and admin flag) per user in an LRU with a TTL, so a cache hit costs
+no queries at all.
+
+The identity is not an ORM object and is shared between threads. Any other
+attribute or method (``orders``, ``get_or_create_cart()``...) is looked up
+on the full ``User`` row, which is loaded on demand through the
+``load_user`` callback. Entries are invalidated explicitly when a user
+changes; the TTL bounds staleness for changes made elsewhere
+(another worker process, a manual SQL fix).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+
+
+class UserIdentity(UserMixin):
+    def __init__(self, id, username, email, is_admin, load_user):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.is_admin = bool(is_admin)
+        self._load_user = load_user
+
+    def __getattr__(self, name):
+        # Only called for attributes the identity does not carry
+        if name.startswith('__'):
+            raise AttributeError(name)
+        user = self._load_user(self.id)
+        if user is None:
+            raise AttributeError(name)
+        return getattr(user, name)
+
+    def __repr__(self):
+        return f'<UserIdentity {self.username}>'
+
+
+class IdentityCache:
+    def __init__(self, loader, maxsize=10000, ttl=60):
+        self.loader = loader
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # user_id -> (identity, expires_at)
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped by every invalidation
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+
+        identity = self.loader(user_id)
+        if identity is not None:
+            with self._lock:
+                # Don't store a row read before a concurrent invalidation
+                if generation != self._generation:
+                    return identity
+                self._entries[user_id] = (identity, now + self.ttl)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return identity
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,103 @@
+"""
+In-memory index of open orders for the kitchen display.
+
+The index is loaded from the database once and then kept current by applying
+order events from the event hub, so serving the kitchen screen costs
+O(open orders) no matter how long the order history is.
+"""
+import bisect
+import threading
+
+OPEN_STATUSES = ('pending', 'paid')
+
+
+class KitchenQueue:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._orders = {}  # order id -> order payload
+        self._queue = []   # (created_at, order id), oldest first
+        self._prep = {}    # menu item id -> aggregated prep line
+        self._as_of = 0
+        self._position = 0  # id of the newest event reflected in the index
+        self._pending = []  # events received before load()
+        self.loaded = False
+
+    def load(self, orders, as_of_event_id=0):
+        """Seed the index from serialized open orders; events up to as_of_event_id are already reflected."""
+        with self._lock:
+            self._orders.clear()
+            self._queue = []
+            self._prep.clear()
+            for order in orders:
+                self._add(order)
+            self._as_of = self._position = as_of_event_id
+            self.loaded = True
+            pending, self._pending = self._pending, []
+            for event in pending:
+                self._apply(event)
+
+    def apply(self, event):
+        """Apply a single order event (see events.Event)."""
+        with self._lock:
+            if not self.loaded:
+                self._pending.append(event)
+                return
+            self._apply(event)
+
+    def _apply(self, event):
+        if event.id <= self._as_of:
+            return
+        self._position = max(self._position, event.id)
+        order = event.data
+        self._remove(order['id'])
+        if event.type != 'order_deleted' and order['status'] in OPEN_STATUSES:
+            self._add(order)
+
+    def _add(self, order):
+        self._orders[order['id']] = order
+        bisect.insort(self._queue, (order['created_at'] or '', order['id']))
+        for item in order['items']:
+            line = self._prep.get(item['menu_item_id'])
+            if line is None:
+                line = self._prep[item['menu_item_id']] = {
+                    'menu_item_id': item['menu_item_id'],
+                    'name': item['name'],
+                    'quantity': 0,
+                    'orders': 0
+                }
+            line['quantity'] += item['quantity']
+            line['orders'] += 1
+
+    def _remove(self, order_id):
+        order = self._orders.pop(order_id, None)
+        if order is None:
+            return
+        key = (order['created_at'] or '', order_id)
+        index = bisect.bisect_left(self._queue, key)
+        if index < len(self._queue) and self._queue[index] == key:
+            del self._queue[index]
+        for item in order['items']:
+            line = self._prep.get(item['menu_item_id'])
+            if line is None:
+                continue
+            line['quantity'] -= item['quantity']
+            line['orders'] -= 1
+            if line['quantity'] <= 0:
+                del self._prep[item['menu_item_id']]
+
+    def snapshot(self):
+        """Open orders oldest first, plus "N x item" prep counts largest first.
+
+        ``last_event_id`` is the newest order event included, for resuming the live feed.
+        """
+        with self._lock:
+            orders = [self._orders[order_id] for _, order_id in self._queue]
+            prep = sorted((dict(line) for line in self._prep.values()),
+                          key=lambda line: (-line['quantity'], line['name']))
+            last_event_id = self._position
+        return {
+            'last_event_id': last_event_id,
+            'open_orders': len(orders),
+            'orders': orders,
+            'prep': prep
+        }
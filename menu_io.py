@@ -0,0 +1,222 @@
+"""
+Bulk menu import and export.
+
+An import file is CSV (with a header row) or a JSON list of objects with
+the fields in ``FIELDS``. Rows are matched to menu items by ``sku``, a
+stable external key; items without a SKU (created before SKUs existed, or
+through the admin form) export as ``ITEM-<id>`` and are matched by that, so
+new rows may not use such a SKU. ``image`` names a file inside the ZIP of
+images uploaded with the menu; without a ZIP the column is ignored, so an
+exported file can be edited and imported again as it is. A ZIP
+holding ``menu.csv`` or ``menu.json`` next to the images (what the ZIP
+export writes) can be imported on its own.
+
+Importing is split so nothing is written until the whole file is known to
+be good:
+
+1. ``parse_rows`` and ``validate_rows`` check every row and collect all
+   errors instead of stopping at the first one;
+2. ``diff_rows`` compares the valid rows with the current menu, which is
+   the dry-run report;
+3. the caller writes the creates and updates in one transaction, after
+   ``save_images`` has resized the referenced images on a thread pool.
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+FIELDS = ('sku', 'name', 'description', 'price', 'category', 'gst', 'image')
+COMPARED = ('name', 'description', 'price', 'category', 'gst')
+IMAGE_EXTENSIONS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.webp': 'WEBP', '.gif': 'GIF'}
+MAX_IMAGE_SIZE = (1200, 1200)
+SKU_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$')
+GENERATED_SKU = re.compile(r'^ITEM-\d+$')  # external key of an item without a SKU
+
+
+class MenuImportError(ValueError):
+    """The file could not be read at all."""
+
+
+def parse_rows(data, filename):
+    """Rows (dicts of strings) from CSV or JSON bytes; the format is taken from the file name."""
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise MenuImportError('File is not UTF-8 encoded')
+    if filename.lower().endswith('.json'):
+        try:
+            rows = json.loads(text)
+        except ValueError as e:
+            raise MenuImportError(f'Invalid JSON: {e}')
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise MenuImportError('JSON must be a list of objects')
+        return [{key: '' if value is None else str(value) for key, value in row.items()} for row in rows]
+    if filename.lower().endswith('.csv'):
+        reader = csv.DictReader(io.StringIO(text))
+        missing = {'sku', 'name', 'price'} - set(reader.fieldnames or ())
+        if missing:
+            raise MenuImportError(f"CSV header is missing {', '.join(sorted(missing))}")
+        return list(reader)
+    raise MenuImportError('Upload a .csv or .json file')
+
+
+def validate_rows(rows, image_names=None, existing=()):
+    """Check every row; returns (clean rows, errors) where errors are (row number, field, message).
+
+    `image_names` are the files in the images ZIP, or None when there is none. `existing` are the
+    external keys of the current menu items.
+    """
+    clean, errors, seen = [], [], {}
+    for number, row in enumerate(rows, start=1):
+        row_errors = []
+        sku = (row.get('sku') or '').strip()
+        name = (row.get('name') or '').strip()
+        if not sku:
+            row_errors.append((number, 'sku', 'is required'))
+        elif not SKU_PATTERN.match(sku):
+            row_errors.append((number, 'sku', 'may only contain letters, digits, ".", "_" and "-" (max 64)'))
+        elif sku in seen:
+            row_errors.append((number, 'sku', f'duplicates row {seen[sku]}'))
+        elif GENERATED_SKU.match(sku) and sku not in existing:
+            # A later form-created item with that id would get the same key
+            row_errors.append((number, 'sku', 'ITEM-<id> is reserved for items without a SKU'))
+        else:
+            seen[sku] = number
+        if not name:
+            row_errors.append((number, 'name', 'is required'))
+        elif len(name) > 100:
+            row_errors.append((number, 'name', 'is longer than 100 characters'))
+        price = _number(row.get('price'), number, 'price', row_errors, minimum=0.01)
+        gst = _number(row.get('gst') or '18', number, 'gst', row_errors, minimum=0, maximum=100)
+        category = (row.get('category') or '').strip() or None
+        if category and len(category) > 50:
+            row_errors.append((number, 'category', 'is longer than 50 characters'))
+        image = (row.get('image') or '').strip() or None if image_names is not None else None
+        if image and image not in image_names:
+            row_errors.append((number, 'image', f'{image} is not in the images ZIP'))
+        elif image and os.path.splitext(image)[1].lower() not in IMAGE_EXTENSIONS:
+            row_errors.append((number, 'image', 'must be a JPEG, PNG, WEBP or GIF file'))
+
+        if row_errors:
+            errors.extend(row_errors)
+            continue
+        clean.append({'sku': sku, 'name': name, 'description': (row.get('description') or '').strip() or None,
+                      'price': price, 'category': category, 'gst': gst, 'image': image, 'row': number})
+    return clean, errors
+
+
+def _number(value, number, field, errors, minimum=None, maximum=None):
+    try:
+        result = round(float(str(value).strip()), 2)
+    except (TypeError, ValueError):
+        errors.append((number, field, f'{value!r} is not a number'))
+        return None
+    if minimum is not None and result < minimum or maximum is not None and result > maximum:
+        errors.append((number, field, f'{result} is out of range'))
+        return None
+    return result
+
+
+def diff_rows(rows, current):
+    """Compare rows with `current` ({sku: dict of COMPARED fields}); returns the dry-run report."""
+    report = {'create': [], 'update': [], 'unchanged': 0}
+    for row in rows:
+        existing = current.get(row['sku'])
+        if existing is None:
+            report['create'].append(row)
+            continue
+        changes = {field: (existing[field], row[field]) for field in COMPARED if existing[field] != row[field]}
+        if row['image'] and row['image'] != existing.get('image'):
+            changes['image'] = (existing.get('image'), row['image'])
+        if changes:
+            report['update'].append({'sku': row['sku'], 'row': row, 'changes': changes})
+        else:
+            report['unchanged'] += 1
+    return report
+
+
+def zip_image_names(zip_file):
+    return [info.filename for info in zip_file.infolist() if not info.is_dir()]
+
+
+def save_images(zip_file, names, upload_folder, static_path='uploads', prefix='menu', workers=4):
+    """Resize the named images from the ZIP into `upload_folder` (static/`static_path`) on a thread pool.
+
+    File names end in a hash of the image, so an import never replaces a file other items use.
+    Returns ({name: path under static/}, {name: error}).
+    """
+    # Read in this thread (ZipFile is not thread-safe); decode, resize and write on the pool
+    blobs = {name: zip_file.read(name) for name in set(names)}
+    os.makedirs(upload_folder, exist_ok=True)
+
+    def save(name):
+        stem, extension = os.path.splitext(name)  # keep folders in the name so a/x.jpg and b/x.jpg differ
+        image_format = IMAGE_EXTENSIONS[extension.lower()]
+        stem = re.sub(r'[^A-Za-z0-9_.-]', '_', stem)
+        if not stem.startswith(f'{prefix}-'):  # re-importing an export keeps the same file names
+            stem = f'{prefix}-{stem}'
+        stem = re.sub(r'-[0-9a-f]{12}$', '', stem)  # ...apart from the hash, which is taken again
+        digest = hashlib.sha256(blobs[name]).hexdigest()[:12]
+        filename = f"{stem}-{digest}{extension.lower()}"
+        path = os.path.join(upload_folder, filename)
+        if os.path.exists(path):
+            return name, f"{static_path}/{filename}", None  # the same image, saved already
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with Image.open(io.BytesIO(blobs[name])) as image:
+                image.thumbnail(MAX_IMAGE_SIZE)
+                if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                image.save(tmp_path, image_format)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return name, None, f'{name} is not a readable image ({type(e).__name__})'
+        return name, f"{static_path}/{filename}", None
+
+    paths, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for name, path, error in pool.map(save, blobs):
+            if error:
+                errors[name] = error
+            else:
+                paths[name] = path
+    return paths, errors
+
+
+def read_upload(data, filename):
+    """(rows, images ZIP or None) from an uploaded CSV, JSON, or ZIP with menu.csv/menu.json inside."""
+    if not filename.lower().endswith('.zip'):
+        return parse_rows(data, filename), None
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise MenuImportError('Not a valid ZIP file')
+    for menu_name in ('menu.csv', 'menu.json'):
+        if menu_name in archive.namelist():
+            return parse_rows(archive.read(menu_name), menu_name), archive
+    raise MenuImportError('The ZIP has no menu.csv or menu.json')
+
+
+def open_images_zip(data):
+    try:
+        return zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise MenuImportError('The images file is not a valid ZIP')
+
+
+def export_rows(items):
+    """Rows in import format for MenuItem-like objects with an `external_key`."""
+    for item in items:
+        yield {'sku': item.external_key, 'name': item.name, 'description': item.description or '',
+               'price': item.original_price, 'category': item.category or '', 'gst': item.gst,
+               'image': os.path.basename(item.image_path) if item.image_path else ''}
@@ -0,0 +1,425 @@
+"""
+Prometheus-style metrics without external dependencies.
+
+Counters, gauges and histograms write into per-thread shards, so the hot
+path never takes a lock; shards are summed when ``/metrics`` is scraped.
+The shard of a thread that has exited is folded into a base total, so
+servers that start a thread per connection don't keep one shard per
+thread forever.
+
+With several worker processes (gunicorn), set ``METRICS_MULTIPROC_DIR`` to a
+directory shared by the workers: each process writes a JSON snapshot there
+every few seconds and the worker that serves the scrape aggregates all of
+them. When a worker exits, its counters and histograms are merged into
+``retired.json`` and its snapshot is removed, so they keep counting towards
+the totals and a later process with the same pid can't overwrite them;
+gauges only include processes that wrote a snapshot recently.
+"""
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+
+from flask import Response, g, request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []  # (thread, shard)
+        self._base = {}  # values of threads that have exited
+        self._shard_lock = threading.Lock()
+        registry.register(self)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            with self._shard_lock:
+                self._sweep()
+                self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+        return shard
+
+    def _sweep(self):
+        # A dead thread no longer writes to its shard, so it can be merged without a race; call with the lock held
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                self._merge(self._base, shard)
+        self._shards = alive
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def collect(self):
+        values = {}
+        with self._shard_lock:
+            self._sweep()
+            self._merge(values, self._base)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            self._merge(values, shard.copy())
+        return values
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    @staticmethod
+    def _merge(values, shard):
+        for key, value in shard.items():
+            values[key] = values.get(key, 0) + value
+
+
+class Gauge(Counter):
+    """A value that goes up and down; optionally read from a callback at collection time."""
+    type = 'gauge'
+
+    def __init__(self, registry, name, documentation, labelnames=(), function=None):
+        super().__init__(registry, name, documentation, labelnames)
+        self._function = function
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def collect(self):
+        if self._function is not None:
+            return {(): self._function()}
+        return super().collect()
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        entry = shard.get(key)
+        if entry is None:
+            # per-bucket counts (last one is +Inf), sum, count
+            entry = shard[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def _merge(self, values, shard):
+        for key, (counts, total, count) in shard.items():
+            merged = values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+            merged[2] += count
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+    def __call__(self, func):
+        def wrapper(*args, **kwargs):
+            with _Timer(self.histogram, self.labels):
+                return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self.multiprocess_dir = None
+        self.flush_interval = 5
+        self._flusher_pid = None
+        self._write_lock = threading.Lock()
+        self._retired = False  # set once this process's snapshot has been merged into retired.json
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return Counter(self, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return Gauge(self, name, documentation, labelnames, function)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return Histogram(self, name, documentation, labelnames, buckets)
+
+    def snapshot(self):
+        """This process's values in a JSON-friendly form."""
+        return {
+            metric.name: [[list(key), value] for key, value in metric.collect().items()]
+            for metric in self._metrics
+        }
+
+    def _snapshot_path(self):
+        return os.path.join(self.multiprocess_dir, f'{os.getpid()}.json')
+
+    def write_snapshot(self):
+        with self._write_lock:
+            if self._retired:
+                return  # the flusher thread must not bring back a snapshot that was already merged
+            path = self._snapshot_path()
+            temp_path = f'{path}.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(temp_path, path)
+
+    def _retire(self, path):
+        """Merge the counters and histograms of the snapshot at `path` into retired.json and remove it."""
+        import fcntl  # multiprocess mode is for gunicorn, which only runs on Unix
+
+        with open(os.path.join(self.multiprocess_dir, 'retired.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            retired_path = os.path.join(self.multiprocess_dir, 'retired.json')
+            merged = {}
+            for source in (retired_path, path):
+                try:
+                    with open(source) as f:
+                        self._merge_snapshot(merged, json.load(f), live=False)
+                except (OSError, ValueError):
+                    continue
+            temp_path = f'{retired_path}.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump({name: [[list(key), value] for key, value in values.items()]
+                           for name, values in merged.items()}, f)
+            os.replace(temp_path, retired_path)
+            os.remove(path)
+
+    def _retire_process(self, pid):
+        if os.getpid() != pid:
+            return  # a forked child inherited the handler
+        try:
+            self.write_snapshot()
+            with self._write_lock:
+                self._retired = True
+                self._retire(self._snapshot_path())
+        except OSError:
+            pass
+
+    def ensure_flusher(self):
+        """Start the snapshot writer in this process (again after a fork)."""
+        if not self.multiprocess_dir or self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        self._retired = False
+        os.makedirs(self.multiprocess_dir, exist_ok=True)
+        if os.path.exists(self._snapshot_path()):
+            # Left by an earlier process with the same pid that didn't exit cleanly
+            self._retire(self._snapshot_path())
+        atexit.register(self._retire_process, os.getpid())
+
+        def flush_loop():
+            while True:
+                try:
+                    self.write_snapshot()
+                except OSError:
+                    pass
+                time.sleep(self.flush_interval)
+
+        threading.Thread(target=flush_loop, name='metrics-flusher', daemon=True).start()
+
+    def _collect_all(self):
+        if not self.multiprocess_dir:
+            return {metric.name: metric.collect() for metric in self._metrics}
+
+        self.write_snapshot()
+        merged = {metric.name: {} for metric in self._metrics}
+        stale_before = time.time() - self.flush_interval * 3
+        for filename in os.listdir(self.multiprocess_dir):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(self.multiprocess_dir, filename)
+            try:
+                live = filename != 'retired.json' and os.path.getmtime(path) >= stale_before
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            self._merge_snapshot(merged, snapshot, live)
+        return merged
+
+    def _merge_snapshot(self, merged, snapshot, live):
+        """Add a snapshot's samples to `merged` ({name: {key: value}}); gauges only count if `live`."""
+        by_name = {metric.name: metric for metric in self._metrics}
+        for name, samples in snapshot.items():
+            metric = by_name.get(name)
+            if metric is None or (metric.type == 'gauge' and not live):
+                continue
+            values = merged.setdefault(name, {})
+            for key, value in samples:
+                key = tuple(key)
+                if metric.type == 'histogram':
+                    current = values.setdefault(key, [[0] * len(value[0]), 0.0, 0])
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+                    current[2] += value[2]
+                else:
+                    values[key] = values.get(key, 0) + value
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format (0.0.4)."""
+        collected = self._collect_all()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for key, value in sorted(collected.get(metric.name, {}).items()):
+                if metric.type == 'histogram':
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, bucket_count in zip(metric.buckets + (float('inf'),), counts):
+                        cumulative += bucket_count
+                        labels = _format_labels(metric.labelnames, key, ('le', _format_value(bound)))
+                        lines.append(f'{metric.name}_bucket{labels} {cumulative}')
+                    labels = _format_labels(metric.labelnames, key)
+                    lines.append(f'{metric.name}_sum{labels} {_format_value(total)}')
+                    lines.append(f'{metric.name}_count{labels} {count}')
+                else:
+                    lines.append(f'{metric.name}{_format_labels(metric.labelnames, key)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """Registry plus the standard HTTP, template and connection pool metrics for a Flask app."""
+
+    def __init__(self, app=None):
+        self.registry = Registry()
+        registry = self.registry
+        self.request_latency = registry.histogram(
+            'http_request_duration_seconds', 'HTTP request latency.', ('endpoint', 'method', 'status'))
+        self.requests_in_flight = registry.gauge(
+            'http_requests_in_flight', 'HTTP requests currently being served.')
+        self.template_render = registry.histogram(
+            'template_render_seconds', 'Jinja template render time.', ('template',))
+        self.pool_checked_out = registry.gauge(
+            'db_pool_checked_out', 'Database connections currently checked out of the pool.')
+        self.pool_connections = registry.gauge(
+            'db_pool_connections', 'Open database connections held by the pool.')
+        self.pool_checkouts = registry.counter(
+            'db_pool_checkouts_total', 'Database connection checkouts.')
+        self._template_starts = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.registry.counter(name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.registry.histogram(name, documentation, labelnames, buckets)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_MULTIPROC_DIR', os.getenv('METRICS_MULTIPROC_DIR'))
+        self.registry.multiprocess_dir = app.config['METRICS_MULTIPROC_DIR']
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+
+        event.listen(Pool, 'checkout', self._on_checkout)
+        event.listen(Pool, 'checkin', self._on_checkin)
+        event.listen(Pool, 'connect', self._on_connect)
+        event.listen(Pool, 'close', self._on_close)
+
+        app.add_url_rule('/metrics', 'metrics', self._metrics_view)
+
+    def _before_request(self):
+        self.registry.ensure_flusher()
+        g.metrics_start = time.perf_counter()
+        self.requests_in_flight.inc()
+
+    def _after_request(self, response):
+        start = g.get('metrics_start')
+        if start is not None:
+            self.request_latency.observe(
+                time.perf_counter() - start,
+                endpoint=request.endpoint or 'unmatched',
+                method=request.method,
+                status=response.status_code
+            )
+        return response
+
+    def _teardown_request(self, exc):
+        if g.pop('metrics_start', None) is not None:
+            self.requests_in_flight.dec()
+
+    def _before_render(self, sender, template, context, **extra):
+        stack = getattr(self._template_starts, 'stack', None)
+        if stack is None:
+            stack = self._template_starts.stack = []
+        stack.append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        stack = getattr(self._template_starts, 'stack', None)
+        if stack:
+            self.template_render.observe(time.perf_counter() - stack.pop(), template=template.name)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.pool_checkouts.inc()
+        self.pool_checked_out.inc()
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        self.pool_checked_out.dec()
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        self.pool_connections.inc()
+
+    def _on_close(self, dbapi_connection, connection_record):
+        self.pool_connections.dec()
+
+    def _metrics_view(self):
+        return Response(self.registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,119 @@
+"""
+Password hashing off the request threads, and login throttling.
+
+``PasswordHasher`` runs ``generate_password_hash``/``check_password_hash`` on
+a small thread pool (hashlib releases the GIL while it hashes). The pool and
+its queue are bounded: when they are full, callers get ``HashingOverloaded``
+immediately, so the route can answer 503 instead of queueing more CPU work
+behind a login burst. It also reports stored hashes that do not use the
+configured scheme so they can be upgraded on the next successful login.
+
+``LoginThrottle`` limits failed login attempts per client IP with a sliding window.
+Both are per process.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingOverloaded(Exception):
+    """The hashing pool and its queue are full."""
+
+
+class PasswordHasher:
+    def __init__(self, method='pbkdf2:sha256', max_workers=2, max_queue=16, timeout=10):
+        self.method = method
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._prefix = None
+        self.rejected = 0
+
+    @property
+    def pending(self):
+        """Hash operations running or queued."""
+        return self._pending
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingOverloaded()
+        with self._pending_lock:
+            self._pending += 1
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashingOverloaded()
+
+    def _release(self):
+        with self._pending_lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if the stored hash was made with another method or cost (e.g. legacy plain sha256)."""
+        if self._prefix is None:
+            # e.g. 'pbkdf2:sha256' is stored as 'pbkdf2:sha256:600000' with the current default cost
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self._prefix
+
+
+class LoginThrottle:
+    def __init__(self, limit=10, window=60, max_clients=100000):
+        self.limit = limit
+        self.window = window
+        self.max_clients = max_clients
+        self._attempts = {}  # client -> deque of attempt times
+        self._lock = threading.Lock()
+
+    def wait(self, client):
+        """Seconds until `client` may try to log in again, or 0 if it may now."""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._recent(client, now)
+            if attempts is None or len(attempts) < self.limit:
+                return 0
+            return max(int(attempts[0] + self.window - now) + 1, 1)
+
+    def hit(self, client):
+        """Record a failed attempt; successful logins are not counted."""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._recent(client, now)
+            if attempts is None:
+                if len(self._attempts) >= self.max_clients:
+                    self._prune(now)
+                attempts = self._attempts[client] = deque()
+            attempts.append(now)
+
+    def _recent(self, client, now):
+        attempts = self._attempts.get(client)
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+        return attempts
+
+    def reset(self, client):
+        with self._lock:
+            self._attempts.pop(client, None)
+
+    def _prune(self, now):
+        for client in [client for client, attempts in self._attempts.items()
+                       if not attempts or attempts[-1] <= now - self.window]:
+            del self._attempts[client]
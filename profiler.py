@@ -0,0 +1,154 @@
+"""
+Opt-in per-request SQL profiler.
+
+Hooks SQLAlchemy's before/after_cursor_execute events on every Engine and
+records, for each request, the number of statements, total database time and
+a normalized fingerprint of each statement. Fingerprints repeated more than
+``SQL_N_PLUS_ONE_THRESHOLD`` times in one request are flagged as probable
+N+1 queries, and statements slower than ``SQL_SLOW_QUERY_MS`` are logged
+(including ones issued outside a request, e.g. by scheduler jobs).
+
+Enable with ``SQL_PROFILER_ENABLED = True``. Results are added to each
+response as ``X-SQL-Profile`` and ``Server-Timing`` headers and the last
+``SQL_PROFILER_HISTORY`` profiles are kept in memory for the debug endpoint.
+A profile is recorded when the response is closed, so the queries run while
+a streamed body is generated are counted too; streamed responses get no
+headers, since those are sent before the body.
+"""
+import re
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)', re.IGNORECASE)
+_PARAM_RE = re.compile(r'(%\(\w+\)s|:\w+|\$\d+|%s)')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(statement):
+    """Normalize a SQL statement so that executions differing only in literals compare equal."""
+    statement = _STRING_RE.sub('?', statement)
+    statement = _PARAM_RE.sub('?', statement)
+    statement = _NUMBER_RE.sub('?', statement)
+    statement = _IN_LIST_RE.sub('IN (...)', statement)
+    return _WHITESPACE_RE.sub(' ', statement).strip()
+
+
+class SQLProfiler:
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._history = deque()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQL_PROFILER_ENABLED', False)
+        app.config.setdefault('SQL_SLOW_QUERY_MS', 100)
+        app.config.setdefault('SQL_N_PLUS_ONE_THRESHOLD', 5)
+        app.config.setdefault('SQL_PROFILER_HISTORY', 100)
+        self.app = app
+        self.enabled = bool(app.config['SQL_PROFILER_ENABLED'])
+        self._history = deque(maxlen=app.config['SQL_PROFILER_HISTORY'])
+        if not self.enabled:
+            return
+
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def recent(self):
+        with self._lock:
+            return list(reversed(self._history))
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('sql_profiler_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('sql_profiler_start')
+        if not starts:
+            return
+        elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+
+        if elapsed_ms >= self.app.config['SQL_SLOW_QUERY_MS']:
+            where = f"{request.method} {request.path}" if has_request_context() else 'background'
+            self.app.logger.warning(f"Slow query ({elapsed_ms:.1f} ms, {where}): {_WHITESPACE_RE.sub(' ', statement)}")
+
+        if not has_request_context():
+            return
+        profile = g.get('sql_profile')
+        if profile is None:
+            return
+        key = fingerprint(statement)
+        profile['count'] += 1
+        profile['db_time_ms'] += elapsed_ms
+        profile['fingerprints'][key] += 1
+        profile['fingerprint_ms'][key] += elapsed_ms
+        if elapsed_ms >= self.app.config['SQL_SLOW_QUERY_MS']:
+            profile['slow'].append({'statement': key, 'duration_ms': round(elapsed_ms, 2)})
+
+    def _start_request(self):
+        g.sql_profile = {
+            'started': time.perf_counter(),
+            'count': 0,
+            'db_time_ms': 0.0,
+            'fingerprints': Counter(),
+            'fingerprint_ms': Counter(),
+            'slow': []
+        }
+
+    def _finish_request(self, response):
+        profile = g.get('sql_profile')
+        if profile is None:
+            return response
+        if not response.is_streamed:
+            response.headers['X-SQL-Profile'] = (
+                f"queries={profile['count']}; db_ms={round(profile['db_time_ms'], 2)}; "
+                f"n_plus_one={len(self._repeated(profile))}"
+            )
+            response.headers.add('Server-Timing',
+                                 f'db;dur={round(profile["db_time_ms"], 2)};desc="{profile["count"]} queries"')
+        # The request context is gone by the time the response is closed
+        context = {'method': request.method, 'path': request.path, 'endpoint': request.endpoint,
+                   'status': response.status_code}
+        response.call_on_close(lambda: self._record(profile, context))
+        return response
+
+    def _repeated(self, profile):
+        threshold = self.app.config['SQL_N_PLUS_ONE_THRESHOLD']
+        return [{
+            'statement': key,
+            'count': count,
+            'total_ms': round(profile['fingerprint_ms'][key], 2)
+        } for key, count in profile['fingerprints'].most_common() if count >= threshold]
+
+    def _record(self, profile, context):
+        repeated = self._repeated(profile)
+        if repeated:
+            self.app.logger.warning(
+                f"Probable N+1 in {context['method']} {context['path']}: "
+                + '; '.join(f"{entry['count']}x {entry['statement'][:120]}" for entry in repeated)
+            )
+
+        record = {
+            'timestamp': datetime.utcnow().isoformat(),
+            **context,
+            'duration_ms': round((time.perf_counter() - profile['started']) * 1000, 2),
+            'query_count': profile['count'],
+            'db_time_ms': round(profile['db_time_ms'], 2),
+            'n_plus_one': repeated,
+            'slow_queries': profile['slow'],
+            'top_statements': [{'statement': key, 'count': count}
+                               for key, count in profile['fingerprints'].most_common(10)]
+        }
+        with self._lock:
+            self._history.append(record)
@@ -0,0 +1,183 @@
+"""
+Token-bucket rate limiting and a concurrency cap for write endpoints.
+
+Each limited endpoint has buckets per user and/or per client IP, written as
+``"<count>/<period>"`` (``"30/minute"``): a bucket holds up to ``count``
+tokens and refills at ``count / period`` tokens per second, so a client can
+burst ``count`` requests and then continue at the sustained rate. A request
+that finds a bucket empty gets a 429 with ``Retry-After``.
+
+Bucket state lives in process memory by default. With several workers, set
+``RATE_LIMIT_STORAGE`` to a SQLite file so all of them share the same
+buckets. Per-endpoint limits can be overridden through ``RATE_LIMITS``::
+
+    app.config['RATE_LIMITS'] = {'add_to_cart': {'user': '120/minute', 'ip': None}}
+
+``write=True`` endpoints also pass through a semaphore of
+``WRITE_CONCURRENCY_LIMIT`` slots per process. A request waits up to
+``WRITE_QUEUE_TIMEOUT`` seconds for a slot and is shed with a 503 after that,
+so bursts queue in the app instead of as SQLite lock waits.
+"""
+import sqlite3
+import threading
+import time
+from functools import lru_cache, wraps
+
+from flask import current_app, jsonify, request
+from flask_login import current_user
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+@lru_cache(maxsize=None)
+def parse_limit(limit):
+    """'30/minute' -> (capacity, refill rate per second)."""
+    count, _, period = limit.partition('/')
+    count, period = int(count), period.strip().rstrip('s')
+    if period not in PERIODS:
+        raise ValueError(f'Unknown rate limit period in {limit!r}')
+    return count, count / PERIODS[period]
+
+
+def _refill(tokens, updated, now, capacity, rate):
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+class MemoryStorage:
+    """Buckets in a dict; per process."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now=None):
+        """Take one token; returns 0 on success, else seconds until a token is available."""
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = _refill(tokens, updated, now, capacity, rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / rate
+            if key not in self._buckets and len(self._buckets) >= self.max_keys:
+                self._prune(now)
+            self._buckets[key] = (tokens - 1, now)
+            return 0
+
+    def _prune(self, now):
+        # A bucket idle for an hour has refilled (limits are per minute or hour); forget it
+        for key, (_, updated) in list(self._buckets.items()):
+            if now - updated > 3600:
+                del self._buckets[key]
+
+
+class SQLiteStorage:
+    """Buckets in a SQLite file shared by every worker process."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._take_count = 0
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS rate_bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, capacity, rate, now=None):
+        now = time.time() if now is None else now
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM rate_bucket WHERE key = ?', (key,)).fetchone()
+            tokens = _refill(row[0], row[1], now, capacity, rate) if row else capacity
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            conn.execute('INSERT INTO rate_bucket (key, tokens, updated) VALUES (?, ?, ?) '
+                         'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                         (key, tokens, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        # Forget idle buckets now and then so the table stays small
+        self._take_count += 1
+        if self._take_count % 1000 == 0:
+            conn.execute('DELETE FROM rate_bucket WHERE updated < ?', (now - 86400,))
+        return wait
+
+
+class RateLimiter:
+    def __init__(self, app=None, on_reject=None, namespace=None):
+        self.on_reject = on_reject  # called with (endpoint, reason)
+        self.namespace = namespace  # called for a prefix that keeps buckets apart, e.g. the current tenant
+        self.storage = None
+        self._write_slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATE_LIMIT_ENABLED', True)
+        app.config.setdefault('RATE_LIMIT_STORAGE', None)  # path of a shared SQLite file; None keeps buckets in memory
+        app.config.setdefault('RATE_LIMITS', {})
+        app.config.setdefault('WRITE_CONCURRENCY_LIMIT', 8)
+        app.config.setdefault('WRITE_QUEUE_TIMEOUT', 2.0)
+        path = app.config['RATE_LIMIT_STORAGE']
+        self.storage = SQLiteStorage(path) if path else MemoryStorage()
+        self._write_slots = threading.BoundedSemaphore(app.config['WRITE_CONCURRENCY_LIMIT'])
+
+    def limit(self, user=None, ip=None, write=False):
+        """Rate limit a view per user and/or per IP; put `login_required` above it."""
+        def decorator(view):
+            defaults = {'user': user, 'ip': ip}
+
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                config = current_app.config
+                if not config['RATE_LIMIT_ENABLED']:
+                    return view(*args, **kwargs)
+                limits = dict(defaults, **config['RATE_LIMITS'].get(view.__name__, {}))
+
+                wait = 0
+                if limits['ip']:
+                    wait = self._take(view.__name__, 'ip', request.remote_addr, limits['ip'])
+                if not wait and limits['user'] and current_user.is_authenticated:
+                    wait = self._take(view.__name__, 'user', current_user.id, limits['user'])
+                if wait:
+                    return self._reject(view.__name__, 'rate_limited', 429, 'Too many requests', wait)
+
+                if not write:
+                    return view(*args, **kwargs)
+                if not self._write_slots.acquire(timeout=config['WRITE_QUEUE_TIMEOUT']):
+                    return self._reject(view.__name__, 'overloaded', 503, 'Server busy, please retry', 1)
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    self._write_slots.release()
+            return wrapper
+        return decorator
+
+    def _take(self, endpoint, scope, identity, limit):
+        capacity, rate = parse_limit(limit)
+        key = f'{endpoint}:{scope}:{identity}'
+        if self.namespace is not None:
+            key = f'{self.namespace()}:{key}'
+        return self.storage.take(key, capacity, rate)
+
+    def _reject(self, endpoint, reason, status, message, retry_after):
+        if self.on_reject is not None:
+            self.on_reject(endpoint, reason)
+        retry_after = max(int(retry_after + 0.999), 1)
+        response = jsonify({'error': message, 'retry_after': retry_after})
+        response.status_code = status
+        response.headers['Retry-After'] = str(retry_after)
+        return response
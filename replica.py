@@ -0,0 +1,285 @@
+"""
+Read replica routing.
+
+Views marked with ``replicas.read_only`` (menu browsing, order lists,
+reports) run their queries on a read replica. Everything else runs on the
+primary, and so does any statement that writes, so checkout never shares a
+connection or a lock with browsing and reporting.
+
+``READ_REPLICA`` chooses the replica:
+
+``'snapshot'``
+    A copy of the SQLite primary, ``<database>-replica.db``, taken with the
+    online backup API. ``refresh()`` replaces it at most every
+    ``READ_REPLICA_REFRESH_INTERVAL`` seconds. It writes a new file and
+    renames it into place, so readers never see a half-written copy. The
+    file's mtime records when the copy was taken, which lets every worker
+    process share one snapshot.
+a database URI
+    A replica kept up to date by the database server, for example a
+    Postgres streaming replica. ``{tenant}`` in the URI is replaced with
+    the tenant name. Its lag is assumed to be ``READ_REPLICA_MAX_STALENESS``.
+
+A read only goes to the replica if the replica is at most
+``READ_REPLICA_MAX_STALENESS`` seconds old. It must also be newer than the
+client's last write: after a request writes, the time is kept in the
+client's session. Until a newer replica is available, that client's
+requests are pinned to the primary, so users always read their own writes.
+"""
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context, request, session as client_session
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.sql.elements import TextClause
+
+_reads = contextvars.ContextVar('replica_reads', default=None)  # True/False overrides the request's choice
+
+
+class SnapshotReplica:
+    """Read-only SQLite copy of a SQLite primary, including the databases ATTACHed to it."""
+
+    def __init__(self, source, path):
+        self.source = source
+        self.path = path
+        self.stem = os.path.splitext(path)[0]
+        self.attached = None  # schema names copied next to the main file, read from the primary on first use
+        self.engine = create_engine(f'sqlite:///file:{path}?mode=ro&uri=true')
+        event.listen(self.engine, 'do_connect', self._opening)
+        event.listen(self.engine, 'connect', self._attach)
+        event.listen(self.engine, 'checkout', self._checkout)
+        self._lock = threading.Lock()
+        self._synced_at = (0.0, None)  # (checked at, mtime) so the file is stat'ed at most once a second
+
+    def _file(self):
+        """Identity of the copy on disk right now; a refresh in any process changes it."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _opening(self, dialect, connection_record, cargs, cparams):
+        # Recorded before the file is opened, so a copy replaced in between is caught at the next checkout
+        connection_record.info['replica_file'] = self._file()
+        if self.attached is None:
+            self.attached = self._attached_names()
+
+    def _attach(self, dbapi_connection, connection_record):
+        for name in self.attached:
+            dbapi_connection.execute(f'ATTACH DATABASE ? AS {name}', (f'file:{self.stem}-{name}.db?mode=ro',))
+
+    def _checkout(self, dbapi_connection, connection_record, connection_proxy):
+        # An open connection keeps reading the file it opened after another process renames a new copy over
+        # it, while synced_at() already reports the new one; the pool reconnects on DisconnectionError
+        if connection_record.info.get('replica_file') != self._file():
+            raise DisconnectionError('read replica was refreshed')
+
+    def _attached_names(self):
+        source = self.source.raw_connection()
+        try:
+            return self._list_attached(source.driver_connection)
+        finally:
+            source.close()
+
+    @staticmethod
+    def _list_attached(connection):
+        return tuple(row[1] for row in connection.execute('PRAGMA database_list') if row[1] not in ('main', 'temp'))
+
+    def synced_at(self):
+        """When the current copy was taken (epoch seconds), or None if there is none yet."""
+        checked_at, mtime = self._synced_at
+        now = time.monotonic()
+        if now - checked_at > 1:
+            try:
+                new_mtime = os.path.getmtime(self.path)
+            except OSError:
+                new_mtime = None
+            if new_mtime != mtime and checked_at:
+                self.engine.dispose()  # close idle connections to the replaced copy; busy ones are checked at checkout
+            mtime = new_mtime
+            self._synced_at = (now, mtime)
+        return mtime
+
+    def refresh(self, min_age=0):
+        """Copy the primary unless the current copy is younger than `min_age` seconds; True if it copied."""
+        if not self._lock.acquire(blocking=False):
+            return False  # another thread is copying already
+        try:
+            try:
+                if time.time() - os.path.getmtime(self.path) < min_age:
+                    return False
+            except OSError:
+                pass
+            started = time.time()
+            source = self.source.raw_connection()
+            try:
+                connection = source.driver_connection
+                attached = self._list_attached(connection)
+                # Attached files first: until the main file is replaced nothing reads them
+                for name in attached:
+                    self._copy(connection, name, f'{self.stem}-{name}.db', started)
+                self.attached = attached
+                self._copy(connection, 'main', self.path, started)
+            finally:
+                source.close()
+            self.engine.dispose()  # pooled connections still have the old file open
+            self._synced_at = (time.monotonic(), started)
+            return True
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _copy(connection, name, path, started):
+        # Write a new file and rename it into place, so readers never see a half-written copy
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        target = sqlite3.connect(tmp_path)
+        try:
+            connection.backup(target, name=name)
+            target.execute('PRAGMA journal_mode=DELETE')  # a WAL file can't be opened read-only without its -shm
+        finally:
+            target.close()
+        os.utime(tmp_path, (started, started))  # the copy is at least as new as the moment it started
+        os.replace(tmp_path, path)
+
+
+class URIReplica:
+    """Replica maintained by the database server; its lag is assumed to be `lag` seconds."""
+
+    def __init__(self, uri, lag, **engine_options):
+        self.engine = create_engine(uri, **engine_options)
+        self.lag = lag
+
+    def synced_at(self):
+        return time.time() - self.lag
+
+    def refresh(self, min_age=0):
+        return False
+
+
+class ReadReplicas:
+    def __init__(self, app=None, primary=None, current=None, on_route=None):
+        self.primary = primary  # primary(tenant) -> engine
+        self.current = current  # current() -> tenant name
+        self.on_route = on_route  # called with 'primary' or 'replica' for every read in a read-only view
+        self.mode = None
+        self._replicas = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('READ_REPLICA', None)
+        app.config.setdefault('READ_REPLICA_MAX_STALENESS', 10.0)
+        app.config.setdefault('READ_REPLICA_REFRESH_INTERVAL', 5.0)
+        self.mode = app.config['READ_REPLICA'] or None
+        self.max_staleness = app.config['READ_REPLICA_MAX_STALENESS']
+        self.refresh_interval = app.config['READ_REPLICA_REFRESH_INTERVAL']
+        self.engine_options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        app.after_request(self._after_request)
+
+    @property
+    def enabled(self):
+        return self.mode is not None
+
+    def replica(self, tenant=None):
+        """The tenant's replica (the current tenant's by default), or None if it can't have one."""
+        tenant = tenant or self.current()
+        if tenant in self._replicas:
+            return self._replicas[tenant]
+        with self._lock:
+            if tenant not in self._replicas:
+                self._replicas[tenant] = self._make(tenant)
+        return self._replicas[tenant]
+
+    def _make(self, tenant):
+        if self.mode != 'snapshot':
+            return URIReplica(self.mode.replace('{tenant}', tenant), self.max_staleness, **self.engine_options)
+        source = self.primary(tenant)
+        if source.dialect.name != 'sqlite' or not source.url.database:
+            return None
+        return SnapshotReplica(source, os.path.splitext(source.url.database)[0] + '-replica.db')
+
+    def refresh(self, tenant=None, force=False):
+        """Bring a snapshot replica up to date if it is older than the refresh interval."""
+        replica = self.replica(tenant) if self.enabled else None
+        return replica is not None and replica.refresh(min_age=0 if force else self.refresh_interval * 0.9)
+
+    def read_only(self, view):
+        """Let a view's GET requests read from the replica."""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method in ('GET', 'HEAD'):
+                g.read_replica = True
+            return view(*args, **kwargs)
+        return wrapper
+
+    @contextmanager
+    def reads(self, allowed=True):
+        """Allow (or with allowed=False, forbid) replica reads in the block, e.g. in CLI reports."""
+        token = _reads.set(allowed)
+        try:
+            yield
+        finally:
+            _reads.reset(token)
+
+    def route(self, session, primary, clause):
+        """The engine for a statement: the primary for writes, the replica for allowed reads."""
+        if not self.enabled:
+            return primary
+        if session._flushing or self._is_write(clause):
+            session.info['wrote'] = True
+            if has_request_context():
+                g.replica_wrote = True
+            return primary
+        # Once a session has written, its reads must see that write
+        if session.info.get('wrote') or not self._reads_allowed():
+            return primary
+        replica = self.replica()
+        synced_at = replica.synced_at() if replica is not None else None
+        last_write = client_session.get('_wrote_at', 0) if has_request_context() else 0
+        if synced_at is None or time.time() - synced_at > self.max_staleness or synced_at < last_write:
+            target = primary
+        else:
+            target = replica.engine
+        if self.on_route is not None:
+            self.on_route('replica' if target is not primary else 'primary')
+        return target
+
+    @staticmethod
+    def _is_write(clause):
+        if isinstance(clause, TextClause):  # raw SQL counts as a write unless it is a plain SELECT
+            return not clause.text.lstrip().lower().startswith('select')
+        return getattr(clause, 'is_dml', False)
+
+    @staticmethod
+    def _reads_allowed():
+        allowed = _reads.get()
+        if allowed is not None:
+            return allowed
+        return has_request_context() and g.get('read_replica', False)
+
+    def _after_request(self, response):
+        if g.get('replica_wrote'):
+            client_session['_wrote_at'] = time.time()
+        return response
+
+
+class ReplicaSessionMixin:
+    """Session mixin that lets ReadReplicas pick the engine for each statement."""
+
+    def __init__(self, *args, replicas=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._replicas = replicas
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        primary = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or self._replicas is None:
+            return primary
+        return self._replicas.route(self, primary, clause)
@@ -0,0 +1,56 @@
+"""
+Helpers for retention jobs: batched deletes and SQLite space reclamation.
+
+``purge_in_batches`` deletes a list of ids a batch at a time, committing
+after every batch and pausing briefly in between, so the database write
+lock is only ever held for one short transaction and other writers (cart
+flushes, checkouts) get in between batches.
+
+Deleted rows only go to SQLite's freelist; the file does not shrink until
+the space is vacuumed. ``reclaim_space`` switches the database to
+``auto_vacuum=INCREMENTAL`` (which needs a one-off full ``VACUUM``) and then
+returns free pages to the filesystem with ``PRAGMA incremental_vacuum``.
+A full ``VACUUM`` can be asked for to also compact partly empty pages.
+"""
+import time
+from collections import Counter
+
+
+def purge_in_batches(session, ids, delete, batch_size=500, pause=0.05):
+    """Call `delete(batch)` for each batch of ids and commit; returns a Counter of rows deleted per table.
+
+    `delete` returns a {table: rows} mapping for its batch.
+    """
+    deleted = Counter()
+    for start in range(0, len(ids), batch_size):
+        try:
+            deleted.update(delete(ids[start:start + batch_size]))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        if pause and start + batch_size < len(ids):
+            time.sleep(pause)  # let waiting writers in
+    return deleted
+
+
+def reclaim_space(engine, max_pages=0, full=False):
+    """Give free pages back to the filesystem; returns (pages freed, bytes freed). SQLite only.
+
+    `max_pages` caps the pages freed per call (0 frees all of them). Rows deleted
+    here and there leave partly empty pages that only a `full` VACUUM compacts;
+    it rewrites the whole file and blocks writers while it runs.
+    """
+    if engine.dialect.name != 'sqlite':
+        return 0, 0
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        page_size = conn.exec_driver_sql('PRAGMA page_size').scalar()
+        before = conn.exec_driver_sql('PRAGMA page_count').scalar()
+        if full or conn.exec_driver_sql('PRAGMA auto_vacuum').scalar() != 2:
+            # Switching to incremental mode only takes effect after a full VACUUM
+            conn.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.exec_driver_sql('VACUUM')
+        elif conn.exec_driver_sql('PRAGMA freelist_count').scalar():
+            conn.exec_driver_sql(f'PRAGMA incremental_vacuum({int(max_pages)})').fetchall()
+        freed = max(before - conn.exec_driver_sql('PRAGMA page_count').scalar(), 0)  # incremental mode adds map pages
+    return freed, freed * page_size
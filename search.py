@@ -0,0 +1,190 @@
+"""
+Full-text menu search.
+
+On SQLite builds with FTS5 the menu is indexed in an external-content FTS5
+table (``menu_item_fts``) that triggers keep in sync with ``menu_item``, so
+every write path - ORM, bulk SQL or a manual fix in the sqlite shell - is
+covered. Queries use prefix matching and bm25 ranking with highlighted
+snippets. Other databases (or SQLite without FTS5) fall back to LIKE.
+"""
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import case, column, false, or_, select, text
+from sqlalchemy.exc import OperationalError
+
+# Private-use markers so highlighting survives HTML escaping
+_MARK_START = '\ue000'
+_MARK_END = '\ue001'
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Column weights for bm25(): name matters most, then category, then description
+_BM25_WEIGHTS = (10.0, 2.0, 5.0)
+
+_FTS_TABLE = '''CREATE VIRTUAL TABLE menu_item_fts USING fts5(
+    name, description, category,
+    content='menu_item', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+)'''
+
+_FTS_TRIGGERS = {
+    'menu_item_fts_ai': '''CREATE TRIGGER menu_item_fts_ai AFTER INSERT ON menu_item BEGIN
+        INSERT INTO menu_item_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END''',
+    'menu_item_fts_ad': '''CREATE TRIGGER menu_item_fts_ad AFTER DELETE ON menu_item BEGIN
+        INSERT INTO menu_item_fts(menu_item_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+    END''',
+    'menu_item_fts_au': '''CREATE TRIGGER menu_item_fts_au AFTER UPDATE OF name, description, category ON menu_item BEGIN
+        INSERT INTO menu_item_fts(menu_item_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+        INSERT INTO menu_item_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END''',
+}
+
+
+def tokenize(query):
+    return _TOKEN_RE.findall(query or '')[:10]
+
+
+def render_marks(value):
+    """Escape text and turn the highlight markers into <mark> tags."""
+    if value is None:
+        return Markup('')
+    return Markup(str(escape(value))
+                  .replace(_MARK_START, '<mark>')
+                  .replace(_MARK_END, '</mark>'))
+
+
+def _mark_terms(value, terms):
+    # Python-side highlighting for the LIKE fallback
+    if not value:
+        return value
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    return pattern.sub(lambda m: f'{_MARK_START}{m.group(0)}{_MARK_END}', value)
+
+
+def _fallback_snippet(value, terms, width=80):
+    if not value:
+        return value
+    lowered = value.lower()
+    positions = [lowered.find(term.lower()) for term in terms]
+    positions = [position for position in positions if position >= 0]
+    start = max(min(positions) - width // 4, 0) if positions else 0
+    snippet = value[start:start + width]
+    if start > 0:
+        snippet = '…' + snippet
+    if start + width < len(value):
+        snippet += '…'
+    return _mark_terms(snippet, terms)
+
+
+def _fts_match(terms):
+    # Each term is quoted (so FTS syntax in user input is inert) and prefix-matched
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+def _like_conditions(model, terms):
+    conditions = []
+    for term in terms:
+        pattern = f'%{term}%'
+        conditions.append(or_(
+            model.name.ilike(pattern),
+            model.description.ilike(pattern),
+            model.category.ilike(pattern)
+        ))
+    return conditions
+
+
+class MenuSearch:
+    def __init__(self):
+        self.fts_enabled = False
+
+    def setup(self, engine):
+        """Create the FTS5 index and its triggers if needed. Returns True when FTS5 is in use."""
+        if engine.dialect.name != 'sqlite':
+            self.fts_enabled = False
+            return False
+
+        with engine.begin() as conn:
+            existing = {row[0] for row in conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE name LIKE 'menu_item_fts%'"
+            ))}
+            try:
+                if 'menu_item_fts' not in existing:
+                    conn.execute(text(_FTS_TABLE))
+            except OperationalError:
+                # SQLite compiled without FTS5
+                self.fts_enabled = False
+                return False
+
+            missing = [name for name in _FTS_TRIGGERS if name not in existing]
+            for name in missing:
+                conn.execute(text(_FTS_TRIGGERS[name]))
+
+            # A new index, or one whose triggers were dropped with menu_item, must be repopulated
+            if 'menu_item_fts' not in existing or missing:
+                conn.execute(text("INSERT INTO menu_item_fts(menu_item_fts) VALUES ('rebuild')"))
+
+        self.fts_enabled = True
+        return True
+
+    def search(self, session, model, query, limit=20):
+        """
+        Search menu items.
+
+        Returns a list of dicts with the item ``id``, a highlighted ``name`` and
+        ``snippet`` (both safe Markup), ordered best match first.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        if self.fts_enabled:
+            return self._search_fts(session, terms, limit)
+        return self._search_like(session, model, terms, limit)
+
+    def matching_ids(self, model, query):
+        """A SELECT of the ids of every item matching ``query``, to filter, page and count in SQL."""
+        terms = tokenize(query)
+        if not terms:
+            return select(model.id).where(false())
+        if self.fts_enabled:
+            return text('SELECT rowid FROM menu_item_fts WHERE menu_item_fts MATCH :match').bindparams(
+                match=_fts_match(terms)).columns(column('rowid'))
+        return select(model.id).where(*_like_conditions(model, terms))
+
+    def _search_fts(self, session, terms, limit):
+        match = _fts_match(terms)
+        rows = session.execute(text(f'''
+            SELECT rowid,
+                   highlight(menu_item_fts, 0, :start, :end),
+                   snippet(menu_item_fts, 1, :start, :end, '…', 12),
+                   bm25(menu_item_fts, {', '.join(str(w) for w in _BM25_WEIGHTS)}) AS rank
+            FROM menu_item_fts
+            WHERE menu_item_fts MATCH :match
+            ORDER BY rank
+            LIMIT :limit
+        '''), {'start': _MARK_START, 'end': _MARK_END, 'match': match, 'limit': limit}).fetchall()
+        return [{
+            'id': row[0],
+            'name': render_marks(row[1]),
+            'snippet': render_marks(row[2]),
+            'rank': row[3]
+        } for row in rows]
+
+    def _search_like(self, session, model, terms, limit):
+        conditions = _like_conditions(model, terms)
+        name_match = case((model.name.ilike(f'{terms[0]}%'), 0),
+                          (model.name.ilike(f'%{terms[0]}%'), 1), else_=2)
+        rows = session.query(model.id, model.name, model.description).filter(
+            *conditions
+        ).order_by(name_match, model.name).limit(limit).all()
+        return [{
+            'id': row[0],
+            'name': render_marks(_mark_terms(row[1], terms)),
+            'snippet': render_marks(_fallback_snippet(row[2], terms)),
+            'rank': None
+        } for row in rows]
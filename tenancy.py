@@ -0,0 +1,254 @@
+"""
+Multi-outlet tenancy: every restaurant (tenant) has its own database.
+
+The tenant of a request comes from
+
+- a path prefix, ``/t/<tenant>/...``. ``TenantMiddleware`` moves the prefix
+  into ``SCRIPT_NAME``, so the routes stay as they are and ``url_for`` builds
+  links under the prefix;
+- the host: an entry in ``TENANT_HOSTS`` (``{'downtown.example.com':
+  'downtown'}``) or ``<tenant>.<TENANT_BASE_DOMAIN>``;
+
+and is ``default`` otherwise. The default tenant uses
+``SQLALCHEMY_DATABASE_URI`` as before, so a single-outlet install sees no
+change. The other tenants are listed in ``TENANTS``.
+
+Each tenant's database (its shard) gets its own engine and connection pool,
+created on first use from ``TENANT_DATABASE_URI`` with ``{tenant}`` replaced
+by the name. A busy outlet therefore only ever holds its own SQLite write
+lock. ``TenantSession`` binds the Flask-SQLAlchemy session to the current
+tenant's engine. Jobs and CLI commands run for a tenant inside
+``tenants.activate(name)``. A session keeps the engine it started with, so
+push a new app context after switching tenants.
+
+``TenantLocal`` keeps one instance of a cache or store per tenant behind a
+proxy, so module-level objects such as the catalog cache work unchanged at
+their call sites.
+"""
+import contextvars
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+
+import click
+from flask import has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from werkzeug.exceptions import NotFound
+
+DEFAULT_TENANT = 'default'
+ENVIRON_KEY = 'restaurant.tenant'
+TENANT_NAME = re.compile(r'^[a-z0-9][a-z0-9_-]{0,39}$')
+
+_active = contextvars.ContextVar('tenant', default=None)
+
+
+class UnknownTenant(LookupError):
+    pass
+
+
+class Tenants:
+    def __init__(self, app=None, db=None, on_engine=None):
+        self.names = (DEFAULT_TENANT,)
+        self.on_engine = on_engine  # called with (tenant, engine) when a tenant's engine is created
+        self._db = None
+        self._engines = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('TENANTS', ())
+        app.config.setdefault('TENANT_DATABASE_URI',
+                              'sqlite:///' + os.path.join(app.instance_path, 'tenants', '{tenant}.db'))
+        app.config.setdefault('TENANT_HOSTS', {})
+        app.config.setdefault('TENANT_BASE_DOMAIN', None)
+        app.config.setdefault('TENANT_PATH_PREFIX', '/t')
+        tenants = app.config['TENANTS']
+        if isinstance(tenants, str):
+            tenants = [name.strip() for name in tenants.split(',') if name.strip()]
+        for name in tenants:
+            if not TENANT_NAME.match(name):
+                raise ValueError(f'Invalid tenant name {name!r}')
+        self.names = tuple(dict.fromkeys([DEFAULT_TENANT, *tenants]))
+        self.database_uri = app.config['TENANT_DATABASE_URI']
+        self.engine_options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        self.hosts = {host.lower(): tenant for host, tenant in app.config['TENANT_HOSTS'].items()}
+        self.base_domain = (app.config['TENANT_BASE_DOMAIN'] or '').lower() or None
+        self.path_prefix = app.config['TENANT_PATH_PREFIX'].rstrip('/')
+        self._db = db
+        app.wsgi_app = TenantMiddleware(app.wsgi_app, self)
+
+    @property
+    def enabled(self):
+        return len(self.names) > 1
+
+    def current(self):
+        tenant = _active.get()
+        if tenant is None and has_request_context():
+            tenant = request.environ.get(ENVIRON_KEY)
+        return tenant or DEFAULT_TENANT
+
+    @contextmanager
+    def activate(self, tenant):
+        """Run the block for `tenant` (in jobs, CLI commands and worker threads)."""
+        if tenant not in self.names:
+            raise UnknownTenant(tenant)
+        token = _active.set(tenant)
+        try:
+            yield tenant
+        finally:
+            _active.reset(token)
+
+    def engine(self, tenant=None):
+        """The engine of a tenant's database (the current tenant's by default), created on first use.
+
+        The default tenant's engine is Flask-SQLAlchemy's, so the first call needs an app context.
+        """
+        tenant = tenant or self.current()
+        engine = self._engines.get(tenant)
+        if engine is not None:
+            return engine
+        if tenant not in self.names:
+            raise UnknownTenant(tenant)
+        with self._lock:
+            engine = self._engines.get(tenant)
+            if engine is None:
+                if tenant == DEFAULT_TENANT:
+                    engine = self._db.engines[None]
+                else:
+                    url = make_url(self.database_uri.replace('{tenant}', tenant))
+                    if url.get_backend_name() == 'sqlite' and url.database:
+                        os.makedirs(os.path.dirname(os.path.abspath(url.database)), exist_ok=True)
+                    engine = create_engine(url, **self.engine_options)
+                if self.on_engine is not None:
+                    self.on_engine(tenant, engine)
+                self._engines[tenant] = engine
+        return engine
+
+    def resolve(self, host, path):
+        """(tenant, path prefix) for a request; the tenant may be unknown."""
+        prefix = self.path_prefix + '/'
+        if path.startswith(prefix):
+            tenant = path[len(prefix):].split('/', 1)[0]
+            if tenant:
+                return tenant, prefix + tenant
+        host = host.split(':', 1)[0].lower()
+        if host in self.hosts:
+            return self.hosts[host], ''
+        if self.base_domain and host.endswith('.' + self.base_domain):
+            subdomain = host[:-len(self.base_domain) - 1]
+            if subdomain in self.names:
+                return subdomain, ''
+        return DEFAULT_TENANT, ''
+
+    def user_id(self, user_id):
+        """Flask-Login id for a user of the current tenant, so a login only counts for its own outlet."""
+        tenant = self.current()
+        return str(user_id) if tenant == DEFAULT_TENANT else f'{tenant}:{user_id}'
+
+    @staticmethod
+    def parse_user_id(value):
+        """(tenant, user id) from `user_id()`'s output."""
+        tenant, _, user_id = value.rpartition(':')
+        return tenant or DEFAULT_TENANT, int(user_id)
+
+    def each(self, func):
+        """Wrap `func` to run once per tenant, one after another (for background jobs)."""
+        @wraps(func)
+        def run_each(*args, **kwargs):
+            for tenant in self.names:
+                with self.activate(tenant):
+                    func(*args, **kwargs)
+        return run_each
+
+    def map(self, func, workers=4):
+        """Run `func()` for every tenant on a thread pool; returns [(tenant, result, error)] in tenant order.
+
+        `func` must push its own app context, since worker threads have none.
+        """
+        def run(tenant):
+            with self.activate(tenant):
+                try:
+                    return tenant, func(), None
+                except Exception as e:
+                    return tenant, None, e
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(self.names)))) as pool:
+            return list(pool.map(run, self.names))
+
+    def cli_option(self, command):
+        """Add a --tenant option to a CLI command; put it directly below `app.cli.command`."""
+        @click.option('--tenant', type=click.Choice(self.names), default=DEFAULT_TENANT, show_default=True,
+                      help='Outlet whose database to use.')
+        @wraps(command)
+        def wrapper(*args, tenant, **kwargs):
+            with self.activate(tenant):
+                return command(*args, **kwargs)
+        return wrapper
+
+
+class TenantMiddleware:
+    """Resolve the tenant of each request and strip a /t/<tenant> path prefix."""
+
+    def __init__(self, wsgi_app, tenants):
+        self.wsgi_app = wsgi_app
+        self.tenants = tenants
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        tenant, prefix = self.tenants.resolve(environ.get('HTTP_HOST', ''), path)
+        if tenant not in self.tenants.names:
+            return NotFound()(environ, start_response)
+        if prefix:
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + prefix
+            environ['PATH_INFO'] = path[len(prefix):] or '/'
+        environ[ENVIRON_KEY] = tenant
+        return self.wsgi_app(environ, start_response)
+
+
+class TenantSession(Session):
+    """Flask-SQLAlchemy session that uses the current tenant's database."""
+
+    def __init__(self, db, tenants=None, **kwargs):
+        super().__init__(db, **kwargs)
+        self._tenants = tenants
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._tenants is not None:
+            return self._tenants.engine()
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class TenantLocal:
+    """Proxy to one `factory(tenant)` object per tenant, created on first use.
+
+    Attribute access goes to the current tenant's object. Use `for_tenant()`
+    where the tenant is not the current one, e.g. on event poller threads.
+    """
+
+    def __init__(self, tenants, factory):
+        self._tenants = tenants
+        self._factory = factory
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def for_tenant(self, tenant=None):
+        tenant = tenant or self._tenants.current()
+        instance = self._instances.get(tenant)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(tenant)
+                if instance is None:
+                    instance = self._instances[tenant] = self._factory(tenant)
+        return instance
+
+    def instances(self):
+        """{tenant: object} for the tenants used so far."""
+        return dict(self._instances)
+
+    def __getattr__(self, name):
+        return getattr(self.for_tenant(), name)
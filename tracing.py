@@ -0,0 +1,489 @@
+"""
+Lightweight request tracing.
+
+Spans are propagated through a context variable, so anything that runs
+inside a request (SQL statements, template renders, PDF generation) becomes
+a child of the request span. Sampling is decided once at the root span
+(head-based) and honours the sampled flag of an incoming W3C ``traceparent``
+header. Finished spans are batched on a background thread and written to a
+local JSONL file and/or POSTed as OTLP/JSON to a collector.
+
+Command line::
+
+    python tracing.py show <trace_id> [--file instance/traces.jsonl]
+    python tracing.py collect [--port 4318] [--file instance/traces.jsonl]
+
+``show`` prints a flame-style breakdown of one trace; ``collect`` runs a
+minimal OTLP/HTTP collector stand-in that appends received spans to JSONL.
+"""
+import argparse
+import contextvars
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from flask import g, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'start_ns', 'end_ns',
+                 'attributes', 'status')
+
+    def __init__(self, trace_id, parent_id, name, kind=SPAN_KIND_INTERNAL, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'start_time_unix_nano': self.start_ns,
+            'end_time_unix_nano': self.end_ns,
+            'attributes': self.attributes,
+            'status': self.status
+        }
+
+
+class _NotSampled:
+    """Context marker for a trace that was not sampled; children are skipped too."""
+    trace_id = None
+    span_id = None
+
+
+NOT_SAMPLED = _NotSampled()
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class JSONLExporter:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def export(self, spans):
+        with open(self.path, 'a') as f:
+            for span in spans:
+                f.write(json.dumps(span) + '\n')
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def to_otlp(spans, service_name):
+    """Encode span dicts as an OTLP/JSON ExportTraceServiceRequest."""
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]},
+        'scopeSpans': [{
+            'scope': {'name': 'restaurant.tracing'},
+            'spans': [{
+                'traceId': span['trace_id'],
+                'spanId': span['span_id'],
+                'parentSpanId': span['parent_id'] or '',
+                'name': span['name'],
+                'kind': span['kind'],
+                'startTimeUnixNano': str(span['start_time_unix_nano']),
+                'endTimeUnixNano': str(span['end_time_unix_nano']),
+                'attributes': [{'key': key, 'value': _otlp_value(value)}
+                               for key, value in span['attributes'].items()],
+                'status': {'code': 2 if span['status'] == 'error' else 1}
+            } for span in spans]
+        }]
+    }]}
+
+
+def from_otlp(payload):
+    """Decode an OTLP/JSON request back into span dicts."""
+    spans = []
+    for resource_spans in payload.get('resourceSpans', []):
+        for scope_spans in resource_spans.get('scopeSpans', []):
+            for span in scope_spans.get('spans', []):
+                spans.append({
+                    'trace_id': span['traceId'],
+                    'span_id': span['spanId'],
+                    'parent_id': span.get('parentSpanId') or None,
+                    'name': span['name'],
+                    'kind': span.get('kind', SPAN_KIND_INTERNAL),
+                    'start_time_unix_nano': int(span['startTimeUnixNano']),
+                    'end_time_unix_nano': int(span['endTimeUnixNano']),
+                    'attributes': {
+                        attribute['key']: next(iter(attribute['value'].values()))
+                        for attribute in span.get('attributes', [])
+                    },
+                    'status': 'error' if span.get('status', {}).get('code') == 2 else 'ok'
+                })
+    return spans
+
+
+class OTLPHTTPExporter:
+    def __init__(self, endpoint, service_name='restaurant', timeout=2):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def export(self, spans):
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(to_otlp(spans, self.service_name)).encode(),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        urllib.request.urlopen(request, timeout=self.timeout).close()
+
+
+class Tracer:
+    def __init__(self, sample_rate=1.0, exporters=(), max_queue=10000, batch_size=512, flush_interval=1.0):
+        self.sample_rate = sample_rate
+        self.exporters = list(exporters)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._worker_pid = None
+        self._worker_lock = threading.Lock()
+
+    @staticmethod
+    def current_span():
+        span = _current_span.get()
+        return None if span is NOT_SAMPLED else span
+
+    def start_span(self, name, kind=SPAN_KIND_INTERNAL, attributes=None, parent=None, require_parent=False):
+        """
+        Start a span as a child of ``parent`` (default: the current span).
+
+        Returns None when the trace is not sampled, or when ``require_parent``
+        is set and there is no recording parent.
+        """
+        parent = _current_span.get() if parent is None else parent
+        if parent is NOT_SAMPLED:
+            return None
+        if parent is None:
+            if require_parent or random.random() >= self.sample_rate:
+                return None
+            return Span(os.urandom(16).hex(), None, name, kind, attributes)
+        return Span(parent.trace_id, parent.span_id, name, kind, attributes)
+
+    def end_span(self, span, error=None):
+        if span is None:
+            return
+        span.end_ns = time.time_ns()
+        if error is not None:
+            span.status = 'error'
+            span.attributes['error'] = repr(error)
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except queue.Full:
+            pass  # Never slow requests down because the exporter is behind
+
+    @contextmanager
+    def span(self, name, kind=SPAN_KIND_INTERNAL, **attributes):
+        span = self.start_span(name, kind, attributes)
+        token = _current_span.set(span) if span is not None else None
+        try:
+            yield span
+        except Exception as e:
+            self.end_span(span, error=e)
+            span = None
+            raise
+        finally:
+            if token is not None:
+                _current_span.reset(token)
+            self.end_span(span)
+
+    def activate(self, span):
+        """Make span (or NOT_SAMPLED) current; returns a token for deactivate()."""
+        return _current_span.set(span)
+
+    def deactivate(self, token):
+        _current_span.reset(token)
+
+    def _ensure_worker(self):
+        if self._worker_pid == os.getpid():
+            return
+        with self._worker_lock:
+            if self._worker_pid != os.getpid():
+                self._worker_pid = os.getpid()
+                threading.Thread(target=self._export_loop, name='trace-exporter', daemon=True).start()
+
+    def _export_loop(self):
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch:
+                self.flush(batch)
+
+    def flush(self, batch=None):
+        if batch is None:
+            batch = []
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+        for exporter in self.exporters:
+            try:
+                exporter.export(batch)
+            except Exception:
+                pass
+
+
+def parse_traceparent(header):
+    """Return (trace_id, parent_span_id, sampled) from a W3C traceparent header, or None."""
+    match = _TRACEPARENT_RE.match((header or '').strip().lower())
+    if not match:
+        return None
+    return match.group(1), match.group(2), int(match.group(3), 16) & 1 == 1
+
+
+class FlaskTracing:
+    """Automatic spans for Flask requests, SQLAlchemy statements and Jinja renders."""
+
+    def __init__(self, app=None):
+        self.tracer = None
+        self.enabled = False
+        self._template_spans = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TRACING_ENABLED', False)
+        app.config.setdefault('TRACING_SAMPLE_RATE', 0.1)
+        app.config.setdefault('TRACING_JSONL_PATH', os.path.join(app.instance_path, 'traces.jsonl'))
+        app.config.setdefault('TRACING_OTLP_ENDPOINT', None)
+        app.config.setdefault('TRACING_SERVICE_NAME', 'restaurant')
+
+        exporters = []
+        if app.config['TRACING_JSONL_PATH']:
+            exporters.append(JSONLExporter(app.config['TRACING_JSONL_PATH']))
+        if app.config['TRACING_OTLP_ENDPOINT']:
+            exporters.append(OTLPHTTPExporter(app.config['TRACING_OTLP_ENDPOINT'],
+                                              app.config['TRACING_SERVICE_NAME']))
+        self.tracer = Tracer(sample_rate=app.config['TRACING_SAMPLE_RATE'], exporters=exporters)
+        self.enabled = bool(app.config['TRACING_ENABLED'])
+        if not self.enabled:
+            # Explicit spans become no-ops
+            self.tracer.sample_rate = 0.0
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(Engine, 'handle_error', self._handle_error)
+
+    def _before_request(self):
+        incoming = parse_traceparent(request.headers.get('traceparent'))
+        attributes = {'http.method': request.method, 'http.target': request.full_path.rstrip('?')}
+        name = f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+        if incoming:
+            trace_id, parent_id, sampled = incoming
+            if sampled:
+                span = Span(trace_id, parent_id, name, SPAN_KIND_SERVER, attributes)
+            else:
+                span = None
+        else:
+            span = self.tracer.start_span(name, SPAN_KIND_SERVER, attributes)
+        g.trace_span = span
+        g.trace_token = self.tracer.activate(span if span is not None else NOT_SAMPLED)
+
+    def _after_request(self, response):
+        span = g.get('trace_span')
+        if span is not None:
+            span.set_attribute('http.status_code', response.status_code)
+            span.set_attribute('flask.endpoint', request.endpoint or '')
+            if response.status_code >= 500:
+                span.status = 'error'
+            response.headers['X-Trace-Id'] = span.trace_id
+            response.headers['traceparent'] = f'00-{span.trace_id}-{span.span_id}-01'
+        return response
+
+    def _teardown_request(self, exc):
+        token = g.pop('trace_token', None)
+        if token is not None:
+            self.tracer.deactivate(token)
+        self.tracer.end_span(g.pop('trace_span', None), error=exc)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        span = self.tracer.start_span('sql', SPAN_KIND_CLIENT, {
+            'db.system': conn.engine.dialect.name,
+            'db.statement': statement[:500],
+            'db.executemany': executemany
+        }, require_parent=True)
+        conn.info.setdefault('trace_spans', []).append(span)
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get('trace_spans')
+        if spans:
+            self.tracer.end_span(spans.pop())
+
+    def _handle_error(self, context):
+        spans = context.connection.info.get('trace_spans') if context.connection is not None else None
+        if spans:
+            self.tracer.end_span(spans.pop(), error=context.original_exception)
+
+    def _before_render(self, sender, template, context, **extra):
+        span = self.tracer.start_span('render', attributes={'template': template.name}, require_parent=True)
+        stack = getattr(self._template_spans, 'stack', None)
+        if stack is None:
+            stack = self._template_spans.stack = []
+        stack.append((span, self.tracer.activate(span) if span is not None else None))
+
+    def _after_render(self, sender, template, context, **extra):
+        stack = getattr(self._template_spans, 'stack', None)
+        if not stack:
+            return
+        span, token = stack.pop()
+        if token is not None:
+            self.tracer.deactivate(token)
+        self.tracer.end_span(span)
+
+
+def load_trace(path, trace_id):
+    spans = []
+    with open(path) as f:
+        for line in f:
+            if trace_id in line:
+                span = json.loads(line)
+                if span['trace_id'] == trace_id:
+                    spans.append(span)
+    return spans
+
+
+def print_flame(spans, width=30):
+    """Print a span tree with durations, share of the trace and a bar, then time per span type."""
+    if not spans:
+        print('No spans found for this trace')
+        return
+    children = {}
+    by_id = {span['span_id']: span for span in spans}
+    for span in spans:
+        children.setdefault(span['parent_id'] if span['parent_id'] in by_id else None, []).append(span)
+    for siblings in children.values():
+        siblings.sort(key=lambda span: span['start_time_unix_nano'])
+
+    trace_start = min(span['start_time_unix_nano'] for span in spans)
+    trace_end = max(span['end_time_unix_nano'] for span in spans)
+    total_ns = max(trace_end - trace_start, 1)
+    print(f"trace {spans[0]['trace_id']}  {total_ns / 1e6:.2f} ms  {len(spans)} spans")
+
+    self_time = {}
+
+    def walk(span, depth):
+        duration = span['end_time_unix_nano'] - span['start_time_unix_nano']
+        offset = int((span['start_time_unix_nano'] - trace_start) / total_ns * width)
+        length = max(int(duration / total_ns * width), 1)
+        bar = ' ' * offset + '█' * min(length, width - offset)
+        label = span['name']
+        if span['name'] == 'sql':
+            label = 'sql ' + ' '.join(str(span['attributes'].get('db.statement', '')).split())[:60]
+        elif span['name'] == 'render':
+            label = f"render {span['attributes'].get('template', '')}"
+        marker = ' !' if span['status'] == 'error' else ''
+        print(f"{duration / 1e6:9.2f} ms {duration / total_ns * 100:5.1f}% |{bar:<{width}}| {'  ' * depth}{label}{marker}")
+
+        child_ns = sum(child['end_time_unix_nano'] - child['start_time_unix_nano']
+                       for child in children.get(span['span_id'], []))
+        key = span['name'] if span['name'] in ('sql', 'render') or span['kind'] != SPAN_KIND_SERVER else 'handler'
+        self_time[key] = self_time.get(key, 0) + max(duration - child_ns, 0)
+        for child in children.get(span['span_id'], []):
+            walk(child, depth + 1)
+
+    for root in children.get(None, []):
+        walk(root, 0)
+
+    print('\nself time by span type:')
+    for key, value in sorted(self_time.items(), key=lambda item: -item[1]):
+        print(f"{value / 1e6:9.2f} ms {value / total_ns * 100:5.1f}%  {key}")
+
+
+def run_collector(port, path):
+    """Minimal OTLP/HTTP (JSON) collector that appends received spans to a JSONL file."""
+    exporter = JSONLExporter(path)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/v1/traces':
+                self.send_error(404)
+                return
+            try:
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                exporter.export(from_otlp(json.loads(body)))
+            except (ValueError, KeyError):
+                self.send_error(400)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, format, *args):
+            pass
+
+    print(f"Collecting OTLP/JSON on http://localhost:{port}/v1/traces into {path}")
+    ThreadingHTTPServer(('', port), Handler).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect and collect request traces')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    show = subparsers.add_parser('show', help='print a flame-style breakdown of a trace')
+    show.add_argument('trace_id')
+    show.add_argument('--file', default=os.path.join('instance', 'traces.jsonl'))
+    collect = subparsers.add_parser('collect', help='run an OTLP/HTTP collector stand-in')
+    collect.add_argument('--port', type=int, default=4318)
+    collect.add_argument('--file', default=os.path.join('instance', 'traces.jsonl'))
+    args = parser.parse_args()
+
+    if args.command == 'show':
+        print_flame(load_trace(args.file, args.trace_id))
+    else:
+        run_collector(args.port, args.file)
+
+
+if __name__ == '__main__':
+    main()